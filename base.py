@@ -1,11 +1,16 @@
+import contextlib
+import json
 import logging
 import os
 import random
 import sys
-from typing import Text, Optional, Any, Dict, Union
+import tempfile
+from typing import Text, Optional, Any, Dict, Union, List, Iterable, Iterator, Tuple, Callable
 
 import datasets
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import torch
 import transformers
 from datasets import load_dataset
@@ -16,11 +21,28 @@ from transformers import (
     EvalPrediction,
     PreTrainedModel,
     PreTrainedTokenizerFast,
-    DataCollator, PretrainedConfig, TrainingArguments
+    DataCollator, PretrainedConfig, TrainingArguments,
+    AutoConfig, AutoTokenizer, PreTrainedTokenizerBase
 )
 from transformers.trainer_utils import get_last_checkpoint
 from utils import metrics
+from utils.cache import PredictionCache, make_cache_key, model_fingerprint
+from utils.dataset_cache import (
+    file_fingerprint,
+    hash_text,
+    make_dataset_cache_key,
+    load_cached_dataset,
+    save_cached_dataset,
+    load_cached_labels,
+    save_cached_labels,
+)
 from utils.metrics import SUPPORTED_METRICS
+from utils.compiled_model import BucketedModel
+from utils.onnx_backend import OnnxRuntimeModel, export_onnx
+from utils.registry import model_registry
+from utils.streaming import chunked
+from utils.tracing import LatencyTracer, NO_TRACE
+from utils.train_telemetry import ThroughputCallback
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -35,6 +57,54 @@ transformers.utils.logging.enable_default_handler()
 transformers.utils.logging.enable_explicit_format()
 
 _DEFAULT_METRIC = metrics.accuracy
+_MODEL_INPUT_COLUMNS = ["input_ids", "attention_mask", "token_type_ids", "label", "labels"]
+_PRECISIONS = {"fp32": None, "bf16": torch.bfloat16, "fp16": torch.float16}
+# Evaluation outputs larger than this are written to a memory-mapped temporary file.
+_MEMMAP_THRESHOLD_BYTES = 1 << 30
+_QUANTIZATION_METHODS = ["dynamic-int8"]
+# Quantized modules can't be loaded by `from_pretrained`, so their state dict is saved next to the config instead.
+_QUANTIZED_WEIGHTS_NAME = "quantized_model.bin"
+_BACKENDS = ["torch", "onnxruntime"]
+_WINDOW_POOLINGS = ["mean", "max"]
+
+
+def _input_length(inputs: Any) -> int:
+    if isinstance(inputs, str):
+        return len(inputs)
+    if isinstance(inputs, dict):
+        inputs = list(inputs.values())
+    return sum(len(x) for x in inputs if isinstance(x, str))
+
+
+class _OutputBuffer:
+    def __init__(self, num_samples: int, padding_value: Any, memmap_dir: Optional[Text] = None):
+        self.num_samples = num_samples
+        self.padding_value = padding_value
+        self.memmap_dir = memmap_dir
+        self.array = None
+
+    def _allocate(self, shape, dtype) -> np.ndarray:
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if nbytes >= _MEMMAP_THRESHOLD_BYTES:
+            # The temporary file is unlinked right away and is kept alive by the mapping.
+            array = np.memmap(tempfile.TemporaryFile(dir=self.memmap_dir), dtype=dtype, mode="w+", shape=shape)
+        else:
+            array = np.empty(shape, dtype=dtype)
+        array.fill(self.padding_value)
+        return array
+
+    def write(self, indices: Union[slice, List[int]], values: np.ndarray) -> None:
+        if self.array is None:
+            self.array = self._allocate((self.num_samples,) + values.shape[1:], values.dtype)
+        elif values.ndim > 1 and values.shape[1] > self.array.shape[1]:
+            # Only happens with dynamic padding when a batch is longer than all previous ones.
+            array = self._allocate((self.num_samples, values.shape[1]) + self.array.shape[2:], self.array.dtype)
+            array[:, :self.array.shape[1]] = self.array
+            self.array = array
+        if values.ndim > 1:
+            self.array[indices, :values.shape[1]] = values
+        else:
+            self.array[indices] = values
 
 
 class BaseModel:
@@ -47,8 +117,13 @@ class BaseModel:
             use_fast_tokenizer: bool = True,
             ignore_mismatched_sizes: bool = False,
             no_cuda: bool = False,
+            revision: Optional[Text] = None,
+            use_registry: bool = False,
     ):
         self.model_name = model_name
+        self.revision = revision
+        # Inference-only instances share configs, tokenizers and weights through the process-wide registry.
+        self.use_registry = use_registry
         self.cache_dir = cache_dir
         self.use_tf = use_tf
         self.auth_token = auth_token
@@ -58,6 +133,182 @@ class BaseModel:
         self.model = PreTrainedModel
         self.tokenizer = PreTrainedTokenizerFast
         self.device = "cuda" if not no_cuda and torch.cuda.is_available() else "cpu"
+        self.prediction_cache = None
+        self._model_fingerprint = None
+        # Labels discovered by the last `_update_model_number_labels` call.
+        self.label_list = None
+        self.quantization = None
+        self.backend = "torch"
+        self.compiled_model = None
+        self.sliding_window = None
+        self.tracer = None
+        self._config_key = None
+
+    def _from_registry(self, key: Tuple, loader: Callable[[], Any]) -> Any:
+        if not self.use_registry:
+            return loader()
+        return model_registry.get_or_load(key, loader)
+
+    def _load_config(self, **kwargs) -> PretrainedConfig:
+        self._config_key = ("config", self.model_name, self.revision, self.cache_dir, tuple(sorted(kwargs.items())))
+        return self._from_registry(self._config_key, lambda: AutoConfig.from_pretrained(
+            self.model_name,
+            revision=self.revision,
+            cache_dir=self.cache_dir,
+            use_auth_token=self.auth_token,
+            **kwargs,
+        ))
+
+    def _load_tokenizer(self, **kwargs) -> PreTrainedTokenizerBase:
+        key = ("tokenizer", self.model_name, self.revision, self.cache_dir, self.use_fast_tokenizer,
+               tuple(sorted(kwargs.items())))
+        return self._from_registry(key, lambda: AutoTokenizer.from_pretrained(
+            self.model_name,
+            revision=self.revision,
+            cache_dir=self.cache_dir,
+            use_fast=self.use_fast_tokenizer,
+            use_auth_token=self.auth_token,
+            **kwargs,
+        ))
+
+    def _load_pretrained_model(
+            self,
+            model_class,
+            quantize: Optional[Text] = None,
+            backend: Text = "torch",
+    ) -> PreTrainedModel:
+        if backend not in _BACKENDS:
+            raise ValueError(f"`backend` must be one of {_BACKENDS}, got {backend}.")
+        if backend == "onnxruntime":
+            if quantize is not None:
+                raise ValueError("`quantize` is only supported with the torch backend.")
+            self.backend = backend
+            self.device = "cpu"
+        quantized_weights = os.path.join(self.model_name, _QUANTIZED_WEIGHTS_NAME)
+        if backend == "torch" and os.path.isfile(quantized_weights):
+            quantize = getattr(self.config, "quantization", "dynamic-int8")
+        if quantize is not None:
+            if self.device != "cpu":
+                logger.warning(f"Dynamic int8 quantization only runs on CPU, moving the model from {self.device} to CPU.")
+                self.device = "cpu"
+            self.quantization = quantize
+        key = ("model", model_class.__name__, self.model_name, self.revision, backend, quantize, self.device,
+               self.use_tf, self.ignore_mismatched_sizes, self._config_key)
+        return self._from_registry(key, lambda: self._build_model(model_class, quantize, backend))
+
+    def _build_model(self, model_class, quantize: Optional[Text], backend: Text):
+        if backend == "onnxruntime":
+            return OnnxRuntimeModel(self.model_name, self.config)
+        quantized_weights = os.path.join(self.model_name, _QUANTIZED_WEIGHTS_NAME)
+        if os.path.isfile(quantized_weights):
+            # Rebuild the architecture from the config, quantize it and only then load the int8 weights.
+            model = model_class.from_config(self.config)
+            self._quantize_model(model, quantize)
+            model.load_state_dict(torch.load(quantized_weights, map_location="cpu"))
+        else:
+            # Recent transformers versions memory-map the checkpoint (safetensors, or `pytorch_model.bin` with
+            # torch>=2.1) and assign its tensors as the weights, so they stay shared with the page cache.
+            # `low_cpu_mem_usage=True` doesn't save memory on top of that and adds seconds of startup.
+            model = model_class.from_pretrained(
+                self.model_name,
+                revision=self.revision,
+                from_tf=self.use_tf,
+                config=self.config,
+                cache_dir=self.cache_dir,
+                use_auth_token=self.auth_token,
+                ignore_mismatched_sizes=self.ignore_mismatched_sizes,
+            )
+            if quantize is not None:
+                self._quantize_model(model, quantize)
+        model.to(self.device)
+        model.eval()
+        return model
+
+    def _quantize_model(self, model: PreTrainedModel, quantize: Text) -> None:
+        if quantize not in _QUANTIZATION_METHODS:
+            raise ValueError(f"`quantize` must be one of {_QUANTIZATION_METHODS}, got {quantize}.")
+        if self.device != "cpu":
+            logger.warning(f"Dynamic int8 quantization only runs on CPU, moving the model from {self.device} to CPU.")
+            self.device = "cpu"
+        model.to(self.device)
+        # Only the encoder is quantized, the classification head is small and stays in fp32.
+        torch.ao.quantization.quantize_dynamic(model.base_model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        model.config.quantization = quantize
+        self.quantization = quantize
+
+    def optimize(self, quantize: Text = "dynamic-int8") -> "BaseModel":
+        if self.use_registry:
+            raise ValueError("Models shared through the registry can't be modified, pass `quantize` on construction.")
+        if self.quantization is not None:
+            raise ValueError(f"The model is already quantized with {self.quantization}.")
+        self._quantize_model(self.model, quantize)
+        return self
+
+    def compile(
+            self,
+            mode: Text = "torch.compile",
+            batch_buckets: Optional[List[int]] = None,
+            sequence_buckets: Optional[List[int]] = None,
+            warmup: bool = True,
+    ) -> Dict[Text, Any]:
+        if self.backend != "torch":
+            raise ValueError(f"Compilation is only supported with the torch backend, got {self.backend}.")
+        self.model.eval()
+        self.compiled_model = BucketedModel(self.model,
+                                            mode=mode,
+                                            batch_buckets=batch_buckets,
+                                            sequence_buckets=sequence_buckets,
+                                            pad_token_id=self.tokenizer.pad_token_id or 0)
+        if not warmup:
+            return self.compiled_model.stats()
+        stats = self.compiled_model.warmup(self.device)
+        logger.info(f"Compiled {len(self.compiled_model.shapes)} shapes with {mode} "
+                    f"in {stats['compile_seconds']:.2f}s")
+        return stats
+
+    def enable_sliding_window(self, stride: int = 128, pooling: Text = "mean") -> None:
+        if not self.tokenizer.is_fast:
+            raise ValueError("Sliding-window inference needs a fast tokenizer.")
+        if stride < 0:
+            raise ValueError(f"`stride` must be non-negative, got {stride}.")
+        if pooling not in _WINDOW_POOLINGS:
+            raise ValueError(f"`pooling` must be one of {_WINDOW_POOLINGS}, got {pooling}.")
+        # Consecutive windows share `stride` tokens, `pooling` combines the window logits of sentence classification.
+        self.sliding_window = {"stride": stride, "pooling": pooling}
+
+    def disable_sliding_window(self) -> None:
+        self.sliding_window = None
+
+    def _tokenizer_kwargs(self, is_pair: bool = False, **kwargs: Any) -> Dict[Text, Any]:
+        if self.sliding_window is None:
+            return kwargs
+        # Inputs longer than `max_length` are split into overlapping windows instead of being truncated,
+        # `overflow_to_sample_mapping` gives the input index of every window.
+        return {
+            **kwargs,
+            "truncation": "only_second" if is_pair else True,
+            "padding": kwargs.get("padding") or True,
+            "stride": self.sliding_window["stride"],
+            "return_overflowing_tokens": True,
+        }
+
+    def export(self, output_dir: Text, format: Text = "onnx", opset: int = 14) -> Text:
+        if format != "onnx":
+            raise ValueError(f"Currently we only support exporting to `onnx`, got {format}.")
+        if self.backend != "torch" or self.quantization is not None:
+            raise ValueError("Only fp32 models loaded with the torch backend can be exported.")
+        path = export_onnx(self.model, self.tokenizer, output_dir, opset=opset)
+        self.model.to(self.device)
+        return path
+
+    def save_pretrained(self, output_dir: Text) -> None:
+        os.makedirs(output_dir, exist_ok=True)
+        self.tokenizer.save_pretrained(output_dir)
+        if self.quantization is None:
+            self.model.save_pretrained(output_dir)
+            return
+        self.model.config.save_pretrained(output_dir)
+        torch.save(self.model.state_dict(), os.path.join(output_dir, _QUANTIZED_WEIGHTS_NAME))
 
     def _train(
             self,
@@ -88,6 +339,7 @@ class BaseModel:
                     "the `--output_dir` or add `--overwrite_output_dir` to train from scratch."
                 )
 
+        throughput = ThroughputCallback()
         trainer = Trainer(
             model=self.model,
             args=training_args,
@@ -96,6 +348,7 @@ class BaseModel:
             compute_metrics=self.compute_metrics,
             tokenizer=self.tokenizer,
             data_collator=data_collator,
+            callbacks=[throughput],
         )
         checkpoint = None
         if resume_from_checkpoint is not None:
@@ -106,11 +359,19 @@ class BaseModel:
         metrics = train_result.metrics
         max_train_samples = (max_train_samples if max_train_samples is not None else len(train_dataset))
         metrics["train_samples"] = min(max_train_samples, len(train_dataset))
+        metrics.update(throughput.summary())
 
         trainer.save_model()  # Saves the tokenizer too for easy upload
+        # `Trainer` leaves the model in training mode, dropout would make the predictions that follow random.
+        self.model.eval()
+        if self.prediction_cache is not None:
+            # The weights in memory are now those saved in `output_dir`, predictions of the previous ones aren't reused.
+            self._model_fingerprint = model_fingerprint(trainer.args.output_dir, self.config)
 
         trainer.log_metrics("train", metrics)
         trainer.save_metrics("train", metrics)
+        # Per logging step, written next to `train_results.json` as `throughput_results.json`.
+        trainer.save_metrics("throughput", {"steps": throughput.history}, combined=False)
         trainer.save_state()
 
     def _load_dataset(
@@ -124,6 +385,7 @@ class BaseModel:
         max_seq_length: int = 128,
         overwrite_cache: bool = False,
         pad_to_max_length: bool = True,
+        tokenized_cache_dir: Optional[Text] = None,
         **kwargs,
     ):
         if dataset_name is not None:
@@ -147,14 +409,24 @@ class BaseModel:
                 cache_dir=self.cache_dir,
                 use_auth_token=self.auth_token,
             )
+        if dataset_name is not None:
+            data_fingerprints = lambda: {  # noqa: E731
+                name: f"{dataset_name}/{dataset_config_name}/{raw_datasets[name]._fingerprint}" for name in raw_datasets
+            }
+        else:
+            data_fingerprints = lambda: {  # noqa: E731
+                name: file_fingerprint([data_files[name]]) for name in raw_datasets
+            }
         # Process data
-        processed_datasets = self._preprocess_data(raw_datasets,
-                                                   max_seq_length=max_seq_length,
-                                                   pad_to_max_length=pad_to_max_length,
-                                                   overwrite_cache=overwrite_cache,
-                                                   do_train=True,
-                                                   split="train",
-                                                   **kwargs)
+        processed_datasets = self._preprocess_data_cached(raw_datasets,
+                                                          data_fingerprints=data_fingerprints,
+                                                          tokenized_cache_dir=tokenized_cache_dir,
+                                                          max_seq_length=max_seq_length,
+                                                          pad_to_max_length=pad_to_max_length,
+                                                          overwrite_cache=overwrite_cache,
+                                                          do_train=True,
+                                                          split="train",
+                                                          **kwargs)
 
         train_dataset = processed_datasets['train']
         if max_train_samples:
@@ -177,10 +449,110 @@ class BaseModel:
             overwrite_cache: bool = False,
             do_train: bool = True,
             split: Text = "train",
+            preprocessing_num_workers: Optional[int] = None,
+            preprocessing_batch_size: int = 1000,
+            label_list: Optional[List[Any]] = None,
+            **kwargs,
+    ):
+        raise NotImplementedError("Hasn't implemented yet!")
+
+    def _tokenizer_fingerprint(self) -> Text:
+        if self.tokenizer.is_fast:
+            state = json.loads(self.tokenizer.backend_tokenizer.to_str())
+            # Truncation and padding are set by every call to the tokenizer, they don't change its output here.
+            state = json.dumps({k: v for k, v in state.items() if k not in ["truncation", "padding"]}, sort_keys=True)
+        else:
+            state = json.dumps(self.tokenizer.get_vocab(), sort_keys=True, ensure_ascii=False)
+        return hash_text(state)
+
+    def _preprocess_data_cached(
+            self,
+            dataset,
+            data_fingerprints: Callable[[], Dict[Text, Text]],
+            tokenized_cache_dir: Optional[Text] = None,
+            max_seq_length: int = 128,
+            pad_to_max_length: Union[bool, Text] = True,
+            overwrite_cache: bool = False,
+            do_train: bool = True,
+            split: Text = "train",
             **kwargs,
     ):
+        if tokenized_cache_dir is None:
+            return self._preprocess_data(dataset,
+                                         max_seq_length=max_seq_length,
+                                         pad_to_max_length=pad_to_max_length,
+                                         overwrite_cache=overwrite_cache,
+                                         do_train=do_train,
+                                         split=split,
+                                         **kwargs)
+
+        # Hashing the data files is a full pass over them, it is only done when the cache is used.
+        data_fingerprints = data_fingerprints()
+        if do_train:
+            # Labels are discovered first, the label map they produce is part of the key of every split.
+            label_list = kwargs.get("label_list")
+            labels_key = make_dataset_cache_key(model_class=type(self).__name__, data=data_fingerprints[split])
+            if label_list is not None:
+                # Still passed to the tokenization of each split, which reports labels missing from it.
+                label_list = kwargs["label_list"] = self._convert_label_list(dataset[split], label_list)
+            elif not overwrite_cache:
+                label_list = load_cached_labels(tokenized_cache_dir, labels_key)
+            if label_list is None:
+                label_list = self._find_label_list(dataset[split])
+                save_cached_labels(tokenized_cache_dir, labels_key, label_list)
+            self._update_model_number_labels(list(label_list))
+
+        # The `datasets` fingerprint of `self._preprocess_function` changes whenever the model config is mutated,
+        # so each split is cached under everything its tokenized output depends on. `train` and `evaluate` share
+        # the entry of a data file as long as they tokenize it the same way.
+        processed_splits = {}
+        for name in dataset:
+            key = make_dataset_cache_key(
+                model_class=type(self).__name__,
+                data=data_fingerprints[name],
+                # The tokenizer's content rather than its path, so that a trained model saved elsewhere shares entries.
+                tokenizer_hash=self._tokenizer_fingerprint(),
+                max_seq_length=min(max_seq_length, self.tokenizer.model_max_length),
+                pad_to_max_length=bool(pad_to_max_length),
+                label2id=self.model.config.label2id,
+                b2i_label=getattr(self.model.config, "b2i_label", None),
+                label_all_tokens=kwargs.get("label_all_tokens"),
+            )
+            cached = None if overwrite_cache else load_cached_dataset(tokenized_cache_dir, key)
+            if cached is None:
+                processed = self._preprocess_data(datasets.DatasetDict({name: dataset[name]}),
+                                                  max_seq_length=max_seq_length,
+                                                  pad_to_max_length=pad_to_max_length,
+                                                  overwrite_cache=overwrite_cache,
+                                                  do_train=False,
+                                                  split=name,
+                                                  **kwargs)
+                save_cached_dataset(tokenized_cache_dir, key, processed[name], metadata={}, overwrite=overwrite_cache)
+                logger.info(f"Saved the tokenized {name} split to {os.path.join(tokenized_cache_dir, key)}")
+                # Reload so that the returned dataset is memory-mapped from the cache.
+                cached = load_cached_dataset(tokenized_cache_dir, key) or (processed[name], {})
+            else:
+                logger.info(f"Loaded the tokenized {name} split from {os.path.join(tokenized_cache_dir, key)}")
+            processed_splits[name] = cached[0]
+        return datasets.DatasetDict(processed_splits)
+
+    def _find_label_list(self, dataset: datasets.Dataset) -> List[Any]:
         raise NotImplementedError("Hasn't implemented yet!")
 
+    def _label_feature(self, dataset: datasets.Dataset) -> Any:
+        raise NotImplementedError("Hasn't implemented yet!")
+
+    def _convert_label_list(self, dataset: datasets.Dataset, label_list: List[Any]) -> List[Any]:
+        # Labels given on the command line are strings, they are converted to the type of the label column. The data
+        # isn't scanned, labels missing from the list are reported when the examples are tokenized.
+        feature = self._label_feature(dataset)
+        try:
+            if isinstance(feature, datasets.ClassLabel):
+                return [feature.str2int(str(label)) for label in label_list]
+            return pa.array(label_list).cast(feature.pa_type).to_pylist()
+        except (ValueError, TypeError, NotImplementedError) as e:
+            raise ValueError(f"`label_list` doesn't match the type of the label column ({feature}): {e}")
+
     def _get_collator(self, padding: bool = True, fp16: bool = True):
         return None
 
@@ -197,8 +569,16 @@ class BaseModel:
             max_train_samples: Optional[int] = None,
             max_eval_samples: Optional[int] = None,
             pad_to_max_length: bool = True,
+            tokenized_cache_dir: Optional[Text] = None,
+            preprocessing_num_workers: Optional[int] = None,
+            preprocessing_batch_size: int = 1000,
+            label_list: Optional[List[Any]] = None,
             **kwargs
     ):
+        if self.backend != "torch":
+            raise ValueError(f"Training is only supported with the torch backend, got {self.backend}.")
+        if self.use_registry:
+            raise ValueError("Models shared through the registry are inference-only, set `use_registry=False` to train.")
         kwargs['output_dir'] = output_dir
         training_args = TrainingArguments(**kwargs)
         logger.warning(
@@ -227,6 +607,10 @@ class BaseModel:
                                                          max_seq_length=max_seq_length,
                                                          overwrite_cache=overwrite_cache,
                                                          pad_to_max_length=pad_to_max_length,
+                                                         tokenized_cache_dir=tokenized_cache_dir,
+                                                         preprocessing_num_workers=preprocessing_num_workers,
+                                                         preprocessing_batch_size=preprocessing_batch_size,
+                                                         label_list=label_list,
                                                          **kwargs)
         self._train(
             train_dataset,
@@ -252,9 +636,19 @@ class BaseModel:
             overwrite_cache: bool = False,
             metric: Optional[Text] = None,
             no_cuda: bool = False,
+            group_by_length: bool = False,
+            memmap_dir: Optional[Text] = None,
+            streaming_metrics: bool = False,
+            precision: Optional[Text] = None,
+            tokenized_cache_dir: Optional[Text] = None,
+            preprocessing_num_workers: Optional[int] = None,
+            preprocessing_batch_size: int = 1000,
             **kwargs,
     ) -> Dict:
         split = "test" if not split else split
+        if precision is None:
+            # `fp16` used to only change the padding of batches, it now also runs the forward pass in fp16 on GPU.
+            precision = "fp16" if fp16 and self.device == "cuda" else "fp32"
         if eval_file is not None:
             extension = eval_file.split(".")[-1]
             assert extension in ["csv", "json"], "`eval_file` should be a csv or a json file."
@@ -271,50 +665,246 @@ class BaseModel:
             )
         else:
             raise ValueError(f"`eval_file` or `eval_dataset_name` must be not empty!")
-        eval_dataset = self._preprocess_data(eval_dataset,
-                                             max_seq_length=max_length,
-                                             pad_to_max_length=padding,
-                                             overwrite_cache=overwrite_cache,
-                                             do_train=False,
-                                             split=split,
-                                             **kwargs)
-        eval_dataloader = DataLoader(eval_dataset[split],
-                                     collate_fn=self._get_collator(padding, fp16),
-                                     batch_size=batch_size)
+        if group_by_length:
+            # Each batch is padded to its own longest sequence instead of `max_length`.
+            padding = False
+        if eval_file is not None:
+            data_fingerprints = lambda: {split: file_fingerprint([eval_file])}  # noqa: E731
+        else:
+            data_fingerprints = lambda: {  # noqa: E731
+                name: f"{eval_dataset_name}/{eval_dataset_config_name}/{eval_dataset[name]._fingerprint}"
+                for name in eval_dataset
+            }
+        with self._trace("preprocess"):
+            eval_dataset = self._preprocess_data_cached(eval_dataset,
+                                                        data_fingerprints=data_fingerprints,
+                                                        tokenized_cache_dir=tokenized_cache_dir,
+                                                        max_seq_length=max_length,
+                                                        pad_to_max_length=padding,
+                                                        overwrite_cache=overwrite_cache,
+                                                        do_train=False,
+                                                        split=split,
+                                                        preprocessing_num_workers=preprocessing_num_workers,
+                                                        preprocessing_batch_size=preprocessing_batch_size,
+                                                        **kwargs)
+        eval_split = eval_dataset[split]
+        eval_split = eval_split.remove_columns(
+            [name for name in eval_split.column_names if name not in _MODEL_INPUT_COLUMNS]
+        )
+        if group_by_length:
+            # Read from Arrow, without converting the token ids to Python lists.
+            lengths = pc.list_value_length(eval_split.with_format("arrow")["input_ids"]).to_numpy()
+            # Longest batches first, so the output buffers are allocated at their final size.
+            order = np.argsort(-lengths, kind="stable")
+            batch_sampler = [order[i:i + batch_size].tolist() for i in range(0, len(order), batch_size)]
+            eval_dataloader = DataLoader(eval_split,
+                                         collate_fn=self._get_collator(padding, fp16),
+                                         batch_sampler=batch_sampler)
+        else:
+            batch_sampler = None
+            eval_dataloader = DataLoader(eval_split,
+                                         collate_fn=self._get_collator(padding, fp16),
+                                         batch_size=batch_size)
+        accumulator = None
+        if streaming_metrics:
+            # Accumulators don't support `sample_weight`, weighted metrics are computed on the full arrays.
+            if kwargs.get("sample_weight") is None:
+                accumulator = self._get_metric_accumulator(metric, **kwargs)
+            if accumulator is None:
+                logger.warning(f"`{metric}` can't be computed incrementally, keeping all predictions in memory.")
         self.model.eval()
-        predictions = []
-        references = []
+        predictions = _OutputBuffer(len(eval_split), padding_value=0, memmap_dir=memmap_dir)
+        references = _OutputBuffer(len(eval_split), padding_value=-100, memmap_dir=memmap_dir)
         for step, batch in enumerate(eval_dataloader):
-            with torch.no_grad():
-                batch = {k: v.to(self.device) for k, v in batch.items()}
-                outputs = self.forward(batch)
-            pred = outputs["logits"].cpu().tolist()
-            ref = batch["labels"].cpu().tolist()
-            predictions.extend(pred)
-            references.extend(ref)
-
-        predictions = np.array(predictions)
-        references = np.array(references)
-        eval_metric = self.compute_metrics(EvalPrediction(predictions, references), metric=metric, **kwargs)
+            if self.tracer is not None:
+                self.tracer.observe_batch(batch)
+            # The model isn't given the labels, the loss isn't needed and unlabeled `-1` examples would break it.
+            labels = batch.pop("labels").numpy()
+            with torch.inference_mode():
+                # `forward` copies the batch to the device.
+                outputs = self.forward(batch, precision=precision)
+            with self._trace("postprocess"):
+                logits = outputs["logits"]
+                if logits.dtype == torch.bfloat16:
+                    # NumPy has no bfloat16.
+                    logits = logits.float()
+                logits = logits.cpu().numpy()
+                if accumulator is not None:
+                    self._update_metric_accumulator(accumulator, logits, labels)
+                    continue
+                if batch_sampler is not None:
+                    # Write each example back at its original position.
+                    indices = batch_sampler[step]
+                else:
+                    indices = slice(step * batch_size, step * batch_size + len(logits))
+                predictions.write(indices, logits)
+                references.write(indices, labels)
+
+        if accumulator is not None:
+            eval_metric = self._compute_accumulated_metrics(accumulator, **kwargs)
+        else:
+            predictions = predictions.array
+            references = references.array
+            eval_metric = self.compute_metrics(EvalPrediction(predictions, references), metric=metric, **kwargs)
         logger.info(f"{eval_metric}")
         return eval_metric
 
-    def predict(self, inputs, activation: Text = "softmax", top_k: int = 1, **kwargs: Dict):
-        model_inputs = self.preprocess_input(inputs, **kwargs)
-        model_outputs = self.forward(model_inputs)
-        outputs = self.postprocess_output(model_outputs, activation, top_k)
+    def enable_prediction_cache(
+            self,
+            max_size: int = 10000,
+            ttl: Optional[float] = None,
+            path: Optional[Text] = None,
+    ) -> PredictionCache:
+        self.prediction_cache = PredictionCache(max_size=max_size, ttl=ttl, path=path)
+        self._model_fingerprint = model_fingerprint(self.model_name, self.config)
+        return self.prediction_cache
+
+    def enable_tracing(self, tracer: Optional[LatencyTracer] = None) -> LatencyTracer:
+        self.tracer = tracer or LatencyTracer(cuda_sync=torch.device(self.device).type == "cuda")
+        return self.tracer
+
+    def disable_tracing(self) -> None:
+        self.tracer = None
+
+    def _trace(self, stage: Text):
+        return self.tracer.stage(stage) if self.tracer is not None else NO_TRACE
+
+    def _prediction_cache_key(
+            self,
+            inputs,
+            activation: Text,
+            top_k: int,
+            precision: Text,
+            normalize: bool = True,
+            **kwargs: Dict
+    ) -> Text:
+        # Predictions of a retrained, quantized, exported or compiled model don't reuse the entries of another one.
+        return make_cache_key(inputs,
+                              normalize=normalize,
+                              model=f"{type(self).__name__}:{self.model_name}",
+                              fingerprint=self._model_fingerprint,
+                              revision=self.revision,
+                              backend=self.backend,
+                              quantization=self.quantization,
+                              compile_mode=self.compiled_model.mode if self.compiled_model is not None else None,
+                              activation=activation,
+                              top_k=top_k,
+                              precision=precision,
+                              sliding_window=self.sliding_window,
+                              **kwargs)
+
+    def predict(self, inputs, activation: Text = "softmax", top_k: int = 1, precision: Text = "fp32", **kwargs: Dict):
+        cache_key = None
+        if self.prediction_cache is not None:
+            cache_key = self._prediction_cache_key(inputs, activation, top_k, precision, **kwargs)
+            outputs = self.prediction_cache.get(cache_key)
+            if outputs is not None:
+                return outputs
+        with self._trace("preprocess"):
+            model_inputs = self.preprocess_input(inputs, **kwargs)
+        if self.tracer is not None:
+            self.tracer.observe_batch(model_inputs)
+        with torch.inference_mode():
+            model_outputs = self.forward(model_inputs, precision=precision)
+        with self._trace("postprocess"):
+            outputs = self.postprocess_output(model_outputs, activation, top_k)
+        if cache_key is not None:
+            self.prediction_cache.set(cache_key, outputs)
         return outputs
 
+    def predict_batch(
+            self,
+            inputs: List[Any],
+            batch_size: int = 32,
+            activation: Text = "softmax",
+            top_k: int = 1,
+            precision: Text = "fp32",
+            **kwargs: Dict
+    ) -> List[Any]:
+        cache_keys = None
+        if self.prediction_cache is not None:
+            cache_keys = [
+                self._prediction_cache_key(x, activation, top_k, precision, **kwargs) for x in inputs
+            ]
+            outputs = [self.prediction_cache.get(key) for key in cache_keys]
+        else:
+            outputs = [None] * len(inputs)
+        # Sort inputs by length so that each batch is padded as little as possible,
+        # then scatter the results back to their original positions.
+        order = sorted(
+            [i for i, output in enumerate(outputs) if output is None],
+            key=lambda i: _input_length(inputs[i])
+        )
+        for start in range(0, len(order), batch_size):
+            batch_indices = order[start:start + batch_size]
+            with self._trace("preprocess"):
+                model_inputs = self.preprocess_batch([inputs[i] for i in batch_indices], **kwargs)
+            if self.tracer is not None:
+                self.tracer.observe_batch(model_inputs)
+            with torch.inference_mode():
+                model_outputs = self.forward(model_inputs, precision=precision)
+            with self._trace("postprocess"):
+                batch_outputs = self.postprocess_batch(model_outputs, activation, top_k)
+            for index, output in zip(batch_indices, batch_outputs):
+                outputs[index] = output
+                if cache_keys is not None:
+                    self.prediction_cache.set(cache_keys[index], output)
+        return outputs
+
+    def predict_stream(
+            self,
+            inputs: Iterable[Any],
+            chunk_size: int = 1024,
+            batch_size: int = 32,
+            activation: Text = "softmax",
+            top_k: int = 1,
+            precision: Text = "fp32",
+            **kwargs: Dict
+    ) -> Iterator[Any]:
+        # Only `chunk_size` inputs are held in memory at a time.
+        for chunk in chunked(inputs, chunk_size):
+            yield from self.predict_batch(chunk,
+                                          batch_size=batch_size,
+                                          activation=activation,
+                                          top_k=top_k,
+                                          precision=precision,
+                                          **kwargs)
+
     def preprocess_input(self, inputs, **kwargs: Dict) -> Dict[str, Tensor]:
-        return self.tokenizer(inputs, return_tensors='pt', **kwargs)
+        return self.tokenizer(inputs, return_tensors='pt', **self._tokenizer_kwargs(**kwargs))
 
-    def forward(self, model_inputs: Dict[str, Tensor]):
-        model_inputs = {k: v.to(self.device) for k, v in model_inputs.items()}
+    def preprocess_batch(self, inputs: List[Any], **kwargs: Dict) -> Dict[str, Tensor]:
+        return self.tokenizer(inputs, return_tensors='pt', **self._tokenizer_kwargs(padding=True, truncation=True,
+                                                                                       **kwargs))
+
+    def _autocast(self, precision: Text = "fp32"):
+        if precision not in _PRECISIONS:
+            raise ValueError(f"Unrecognized `precision` argument: {precision}. Choose one of {list(_PRECISIONS)}")
+        if _PRECISIONS[precision] is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=torch.device(self.device).type, dtype=_PRECISIONS[precision])
+
+    def forward(self, model_inputs: Dict[str, Tensor], precision: Text = "fp32"):
+        sample_mapping = model_inputs.pop("overflow_to_sample_mapping", None)
+        with self._trace("host_to_device"):
+            model_inputs = {k: v.to(self.device) for k, v in model_inputs.items()}
+        with self._trace("model"), self._autocast(precision):
+            model_outputs = self._call_model(model_inputs)
+        if sample_mapping is None:
+            return model_outputs
+        return {**model_outputs, "overflow_to_sample_mapping": sample_mapping}
+
+    def _call_model(self, model_inputs: Dict[str, Tensor]):
+        if self.compiled_model is not None:
+            return self.compiled_model(**model_inputs)
         return self.model(**model_inputs)
 
     def postprocess_output(self, model_outputs, activation: Text = "softmax", top_k: int = 1) -> Any:
         raise NotImplementedError("Hasn't implemented yet!")
 
+    def postprocess_batch(self, model_outputs, activation: Text = "softmax", top_k: int = 1) -> List[Any]:
+        raise NotImplementedError("Hasn't implemented yet!")
+
     def compute_metrics(self, p: EvalPrediction, metric: Optional[Text] = None, **kwargs):
         if metric and metric not in SUPPORTED_METRICS:
             raise ValueError(f"We haven't supported `{metric}` yet."
@@ -328,3 +918,24 @@ class BaseModel:
         if metric != "mse":
             preds = np.argmax(preds, axis=1)
         return metric_func(predictions=preds, references=p.label_ids, **kwargs)
+
+    def _get_metric_accumulator(self, metric: Optional[Text] = None, **kwargs) -> Optional[metrics.MetricAccumulator]:
+        metric = metric or _DEFAULT_METRIC.__name__
+        if metric == "mse":
+            return metrics.MseAccumulator()
+        elif metric in ["accuracy", "f1", "recall", "precision"]:
+            return metrics.ConfusionMatrixAccumulator(self.model.config.num_labels, metric)
+        return None
+
+    def _update_metric_accumulator(
+            self,
+            accumulator: metrics.MetricAccumulator,
+            logits: np.ndarray,
+            labels: np.ndarray,
+    ) -> None:
+        if not isinstance(accumulator, metrics.MseAccumulator):
+            logits = np.argmax(logits, axis=1)
+        accumulator.update(logits, labels)
+
+    def _compute_accumulated_metrics(self, accumulator: metrics.MetricAccumulator, **kwargs) -> Dict:
+        return accumulator.compute(**kwargs)
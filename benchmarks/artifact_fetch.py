@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Text, List, Dict, Any
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from utils.artifact_store import (  # noqa: E402
+    LocalArtifactStore,
+    fetch_artifacts,
+    is_complete,
+    get_artifact_store,
+)
+
+
+class CountingStore(LocalArtifactStore):
+    def __init__(self, root: Text):
+        super().__init__(root)
+        self.downloaded_bytes = 0
+
+    def download(self, path, f, start=0):
+        offset = f.tell()
+        super().download(path, f, start)
+        self.downloaded_bytes += f.tell() - offset
+
+
+def _write_files(root: Text, prefix: Text, num_files: int, file_mb: float) -> List[Text]:
+    os.makedirs(os.path.join(root, prefix), exist_ok=True)
+    files = [f"file_{i}.bin" for i in range(num_files)]
+    for i, filename in enumerate(files):
+        with open(os.path.join(root, prefix, filename), "wb") as f:
+            f.write(os.urandom(int(file_mb * (1 << 20))) + bytes([i]))
+    return files
+
+
+def run_checks(tmp_dir: Text, num_files: int, file_mb: float, max_workers: int) -> Dict[Text, Any]:
+    remote_dir = os.path.join(tmp_dir, "remote")
+    cache_dir = os.path.join(tmp_dir, "cache")
+    files = _write_files(remote_dir, "model", num_files, file_mb)
+    total_bytes = sum(os.path.getsize(os.path.join(remote_dir, "model", filename)) for filename in files)
+    results = {"total_bytes": total_bytes}
+
+    store = CountingStore(remote_dir)
+    start = time.perf_counter()
+    local_dir = fetch_artifacts(store, "model", files, os.path.join(cache_dir, "model"), max_workers=max_workers)
+    results["cold_seconds"] = time.perf_counter() - start
+    results["cold_complete"] = is_complete(local_dir, files, verify_checksums=True)
+    results["cold_downloaded_bytes"] = store.downloaded_bytes
+
+    store = CountingStore(remote_dir)
+    start = time.perf_counter()
+    fetch_artifacts(store, "model", files, local_dir, max_workers=max_workers)
+    results["warm_seconds"] = time.perf_counter() - start
+    results["warm_downloaded_bytes"] = store.downloaded_bytes
+
+    # A second model with the same files only links the cached blobs.
+    store = CountingStore(remote_dir)
+    fetch_artifacts(store, "model", files, os.path.join(cache_dir, "copy"), max_workers=max_workers)
+    results["shared_downloaded_bytes"] = store.downloaded_bytes
+
+    # Interrupt a download half way: the manifest is missing and only the remaining bytes are fetched again.
+    resume_cache_dir = os.path.join(tmp_dir, "resume")
+    resume_dir = os.path.join(resume_cache_dir, "model")
+    blobs_dir = os.path.join(resume_cache_dir, ".blobs")
+    os.makedirs(blobs_dir)
+    size, checksum = store.stat(f"model/{files[0]}")
+    with open(os.path.join(blobs_dir, checksum.replace(":", "-") + ".part"), "wb") as f:
+        with open(os.path.join(remote_dir, "model", files[0]), "rb") as source:
+            f.write(source.read(size // 2))
+    results["partial_complete"] = is_complete(resume_dir, files)
+    store = CountingStore(remote_dir)
+    fetch_artifacts(store, "model", files, resume_dir, max_workers=max_workers)
+    results["resumed_downloaded_bytes"] = store.downloaded_bytes
+    results["resumed_expected_bytes"] = total_bytes - size // 2
+    results["resumed_complete"] = is_complete(resume_dir, files, verify_checksums=True)
+
+    # A corrupted part file must be detected instead of ending up in the model directory.
+    corrupt_dir = os.path.join(tmp_dir, "corrupt", "model")
+    os.makedirs(os.path.join(tmp_dir, "corrupt", ".blobs"))
+    with open(os.path.join(tmp_dir, "corrupt", ".blobs", checksum.replace(":", "-") + ".part"), "wb") as f:
+        f.write(b"\0" * (size // 2))
+    try:
+        fetch_artifacts(CountingStore(remote_dir), "model", files, corrupt_dir, max_workers=max_workers)
+        results["corruption_detected"] = False
+    except ValueError:
+        results["corruption_detected"] = not is_complete(corrupt_dir, files)
+    results["local_store_from_uri"] = isinstance(get_artifact_store(f"file://{remote_dir}"), LocalArtifactStore)
+    return results
+
+
+@click.command()
+@click.option('--num_files', type=int, default=6, help='Number of files of the fake model.')
+@click.option('--file_mb', type=float, default=8.0, help='Size of each file in MB.')
+@click.option('--max_workers', type=int, default=8, help='Number of concurrent downloads.')
+def main(num_files: int, file_mb: float, max_workers: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = run_checks(tmp_dir, num_files, file_mb, max_workers)
+    print(json.dumps(results, indent=2))
+    failures = [
+        name for name, ok in [
+            ("cold fetch", results["cold_complete"] and results["cold_downloaded_bytes"] == results["total_bytes"]),
+            ("warm fetch", results["warm_downloaded_bytes"] == 0),
+            ("shared blobs", results["shared_downloaded_bytes"] == 0),
+            ("manifest", not results["partial_complete"]),
+            ("resume", results["resumed_complete"]
+             and results["resumed_downloaded_bytes"] == results["resumed_expected_bytes"]),
+            ("checksum", results["corruption_detected"]),
+            ("store uri", results["local_store_from_uri"]),
+        ] if not ok
+    ]
+    if failures:
+        raise SystemExit(f"Artifact store checks failed: {failures}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Text, Optional, List, Dict, Any, Callable
+
+import click
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from utils.testing import build_tiny_model, write_synthetic_dataset  # noqa: E402
+
+_TASKS = ["sentence-classification", "token-classification"]
+_EXTENSIONS = {"sentence-classification": "csv", "token-classification": "json"}
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "baseline.json")
+
+
+def _best_of(fn: Callable[[], Any], repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _percentiles_ms(fn: Callable[[], Any], num_calls: int) -> Dict[Text, float]:
+    timings = []
+    for _ in range(num_calls):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"p50": float(np.percentile(timings, 50)), "p99": float(np.percentile(timings, 99))}
+
+
+def run_task(task_name: Text, tmp_dir: Text, params: Dict[Text, Any]) -> Dict[Text, float]:
+    import torch
+    from datasets import load_dataset
+    from transformers import EvalPrediction
+
+    from classification.sentence import SentenceClassifier
+    from classification.token import TokenClassifier
+
+    model_class = SentenceClassifier if task_name == "sentence-classification" else TokenClassifier
+    model_dir = build_tiny_model(os.path.join(tmp_dir, task_name), task_name, hidden_size=params["hidden_size"])
+    data_file = write_synthetic_dataset(os.path.join(tmp_dir, f"{task_name}.{_EXTENSIONS[task_name]}"),
+                                        task_name,
+                                        num_examples=params["num_examples"],
+                                        min_words=params["min_words"],
+                                        max_words=params["max_words"],
+                                        distribution=params["distribution"])
+    model = model_class(task_name, model_dir, no_cuda=True)
+    repeats, batch_size, max_length = params["repeats"], params["batch_size"], params["max_length"]
+
+    raw_dataset = load_dataset(_EXTENSIONS[task_name], data_files={"test": data_file})
+    texts = [x if isinstance(x, str) else " ".join(x) for x in raw_dataset["test"]["input"]]
+    results = {
+        "preprocess_seconds": _best_of(lambda: model._preprocess_data(raw_dataset,
+                                                                      max_seq_length=max_length,
+                                                                      overwrite_cache=True,
+                                                                      do_train=False,
+                                                                      split="test"), repeats),
+        "evaluate_seconds": _best_of(lambda: model.evaluate(data_file,
+                                                            batch_size=batch_size,
+                                                            max_length=max_length,
+                                                            padding=False,
+                                                            overwrite_cache=True), repeats),
+        "predict_batch_seconds": _best_of(
+            lambda: model.predict_batch(texts, batch_size=batch_size, max_length=max_length), repeats
+        ),
+    }
+    latencies = _percentiles_ms(lambda: model.predict(texts[0], max_length=max_length), params["num_calls"])
+    results["predict_p50_ms"], results["predict_p99_ms"] = latencies["p50"], latencies["p99"]
+
+    # Postprocessing and metrics are timed on fixed model outputs, so model time doesn't hide their changes.
+    with torch.inference_mode():
+        model_outputs = model.forward(model.preprocess_batch(texts[:batch_size], max_length=max_length))
+    results["postprocess_batch_ms"] = _best_of(lambda: model.postprocess_batch(dict(model_outputs)), repeats) * 1000
+    rng = np.random.default_rng(0)
+    num_labels = model.model.config.num_labels
+    if task_name == "sentence-classification":
+        predictions = rng.standard_normal((params["num_examples"], num_labels)).astype(np.float32)
+        references = rng.integers(0, num_labels, size=params["num_examples"])
+    else:
+        shape = (params["num_examples"], max_length)
+        predictions = rng.standard_normal(shape + (num_labels,)).astype(np.float32)
+        references = rng.integers(0, num_labels, size=shape)
+        references[:, 0] = -100
+    results["metrics_seconds"] = _best_of(
+        lambda: model.compute_metrics(EvalPrediction(predictions, references)), repeats
+    )
+    return results
+
+
+def compare(results: Dict[Text, Any], baseline: Dict[Text, Any], tolerance: float) -> List[Dict[Text, Any]]:
+    # Every measurement is a duration, a regression is one that got slower than the baseline by more than `tolerance`.
+    regressions = []
+    for task_name, measurements in results["results"].items():
+        for name, value in measurements.items():
+            expected = baseline["results"].get(task_name, {}).get(name)
+            if expected is not None and value > expected * (1 + tolerance):
+                regressions.append({"task_name": task_name, "name": name, "baseline": expected, "value": value,
+                                    "ratio": value / expected})
+    return regressions
+
+
+@click.command()
+@click.option('--tasks', default=",".join(_TASKS), help='Comma-separated tasks to benchmark.')
+@click.option('--num_examples', type=int, default=1000, help='Number of synthetic examples per dataset.')
+@click.option('--min_words', type=int, default=5, help='Minimum number of words per example.')
+@click.option('--max_words', type=int, default=60, help='Maximum number of words per example.')
+@click.option('--distribution', type=click.Choice(["uniform", "lognormal"]), default="uniform",
+              help='Distribution of the example lengths.')
+@click.option('--max_length', type=int, default=128, help='The maximum total input sequence length after tokenization.')
+@click.option('--batch_size', type=int, default=32, help='Batch size of `evaluate` and `predict_batch`.')
+@click.option('--hidden_size', type=int, default=32, help='Hidden size of the tiny models.')
+@click.option('--repeats', type=int, default=3, help='Number of runs per measurement, the fastest one is kept.')
+@click.option('--num_calls', type=int, default=200, help='Number of single-example `predict` calls.')
+@click.option('--num_threads', type=int, default=1, help='Number of torch threads, fixed to reduce noise.')
+@click.option('--output_file', help='A json file to write the results to.')
+@click.option('--baseline', 'baseline_file', default=DEFAULT_BASELINE, help='A json file of results to compare against.')
+@click.option('--update_baseline', is_flag=True, default=False, help='Write the results to `--baseline` instead.')
+@click.option('--tolerance', type=float, default=0.25, help='Allowed relative slowdown against the baseline.')
+def main(
+        tasks: Text,
+        num_examples: int,
+        min_words: int,
+        max_words: int,
+        distribution: Text,
+        max_length: int,
+        batch_size: int,
+        hidden_size: int,
+        repeats: int,
+        num_calls: int,
+        num_threads: int,
+        output_file: Optional[Text],
+        baseline_file: Text,
+        update_baseline: bool,
+        tolerance: float,
+):
+    import torch
+
+    torch.set_num_threads(num_threads)
+    params = {
+        "num_examples": num_examples,
+        "min_words": min_words,
+        "max_words": max_words,
+        "distribution": distribution,
+        "max_length": max_length,
+        "batch_size": batch_size,
+        "hidden_size": hidden_size,
+        "repeats": repeats,
+        "num_calls": num_calls,
+        "num_threads": num_threads,
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = {
+            "params": params,
+            "results": {task_name: run_task(task_name, tmp_dir, params) for task_name in tasks.split(",")},
+        }
+    print(json.dumps(results, indent=2))
+    if output_file is not None:
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if update_baseline:
+        with open(baseline_file, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        return
+    if not os.path.exists(baseline_file):
+        raise SystemExit(f"No baseline at {baseline_file}, create one with `--update_baseline`.")
+    with open(baseline_file, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["params"] != params:
+        raise SystemExit(f"The baseline was measured with different parameters: {baseline['params']}")
+    regressions = compare(results, baseline, tolerance)
+    if regressions:
+        raise SystemExit(f"Performance regressions against {baseline_file}: {json.dumps(regressions, indent=2)}")
+    print(f"No regression larger than {tolerance:.0%} against {baseline_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import json
+import os
+import subprocess
+import sys
+from typing import Text, List, Dict, Any
+
+import click
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# Modules that must not be imported before a command that needs them runs.
+_HEAVY_MODULES = ["torch", "transformers", "datasets", "google.cloud", "sklearn", "pyarrow", "onnxruntime"]
+
+
+def parse_importtime(stderr: Text) -> List[Dict[Text, Any]]:
+    # Lines look like `import time:       self [us] |  cumulative | imported package`.
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    return imports
+
+
+def measure(args: List[Text]) -> Dict[Text, Any]:
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.join(ROOT_DIR, "run_cli.py"), *args],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    imports = parse_importtime(process.stderr)
+    modules = {item["module"] for item in imports}
+    return {
+        "command": " ".join(["run_cli.py", *args]),
+        "returncode": process.returncode,
+        "import_ms": sum(item["cumulative_ms"] for item in imports if item["depth"] == 0),
+        "heavy_modules": [name for name in _HEAVY_MODULES if name in modules],
+        "slowest": sorted(
+            (item for item in imports if item["depth"] == 0), key=lambda item: -item["cumulative_ms"]
+        )[:10],
+    }
+
+
+@click.command()
+@click.option('--budget_ms', type=float, default=300.0, help='Maximum total import time of a command.')
+@click.option('--repeats', type=int, default=3, help='Number of runs per command, the fastest one is kept.')
+def main(budget_ms: float, repeats: int):
+    commands = [["--help"], ["predict", "--help"], ["serve", "--help"], ["train", "--bad-option"]]
+    results = [min((measure(args) for _ in range(repeats)), key=lambda result: result["import_ms"])
+               for args in commands]
+    print(json.dumps(results, indent=2))
+    failures = [
+        result["command"] for result in results if result["import_ms"] > budget_ms or result["heavy_modules"]
+    ]
+    if failures:
+        raise SystemExit(f"Startup budget of {budget_ms}ms exceeded or heavy modules imported by: {failures}")
+
+
+if __name__ == "__main__":
+    main()
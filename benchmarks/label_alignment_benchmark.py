@@ -0,0 +1,158 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Text, List, Dict, Any
+
+import click
+import numpy as np
+from datasets import Dataset
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from classification.token import TokenClassifier  # noqa: E402
+from utils.testing import build_tiny_model, synthetic_vocab  # noqa: E402
+
+_LABELS = ["O", "B-PER", "I-PER", "B-LOC", "I-LOC", "B-ORG", "I-ORG"]
+# (padding, padding side)
+_CASES = [("max_length", "right"), ("max_length", "left"), (False, "right")]
+
+
+def random_examples(
+        num_examples: int,
+        min_words: int = 5,
+        max_words: int = 60,
+        max_pieces: int = 3,
+        seed: int = 42,
+) -> Dict[Text, List[List[Text]]]:
+    # Words are made of 1 to `max_pieces` vocabulary entries joined by ".", which the tokenizer splits into several
+    # tokens, so that tokens after the first one of a word are covered.
+    rng = np.random.default_rng(seed)
+    vocab = synthetic_vocab()
+    lengths = rng.integers(min_words, max_words + 1, size=num_examples)
+    pieces = rng.integers(1, max_pieces + 1, size=lengths.sum())
+    words = iter(rng.integers(0, len(vocab), size=pieces.sum()).tolist())
+    words = [".".join(vocab[next(words)] for _ in range(n)) for n in pieces.tolist()]
+    tags = [_LABELS[i] for i in rng.integers(0, len(_LABELS), size=lengths.sum()).tolist()]
+    starts = np.cumsum([0] + lengths.tolist()).tolist()
+    tokens = [words[start:end] for start, end in zip(starts[:-1], starts[1:])]
+    tags = [tags[start:end] for start, end in zip(starts[:-1], starts[1:])]
+    return {"tokens": tokens, "ner_tags": tags}
+
+
+def reference_labels(
+        tokenized_inputs,
+        examples: Dict[Text, List[List[Text]]],
+        label2id: Dict[Text, int],
+        b2i_label: List[int],
+        label_all_tokens: bool,
+) -> List[List[int]]:
+    # The token by token loop that `_preprocess_function` replaced.
+    labels = []
+    for i, label in enumerate(examples["ner_tags"]):
+        previous_word_idx = None
+        label_ids = []
+        for word_idx in tokenized_inputs.word_ids(batch_index=i):
+            if word_idx is None:
+                label_ids.append(-100)
+            elif word_idx != previous_word_idx:
+                label_ids.append(int(label2id[label[word_idx]]))
+            elif label_all_tokens:
+                label_ids.append(int(b2i_label[label2id[label[word_idx]]]))
+            else:
+                label_ids.append(-100)
+            previous_word_idx = word_idx
+        labels.append(label_ids)
+    return labels
+
+
+def run_case(
+        tokenizer,
+        padding,
+        padding_side: Text,
+        label_all_tokens: bool,
+        num_examples: int,
+        batch_size: int,
+        max_seq_length: int,
+        seed: int = 42,
+) -> Dict[Text, Any]:
+    label2id = {label: i for i, label in enumerate(_LABELS)}
+    b2i_label = [label2id[label.replace("B-", "I-")] for label in _LABELS]
+    examples = random_examples(num_examples, seed=seed)
+    batches = [
+        {key: values[i:i + batch_size] for key, values in examples.items()}
+        for i in range(0, num_examples, batch_size)
+    ]
+
+    # Tokenized once, only the alignment of word labels to tokens is timed.
+    tokenizer.padding_side = padding_side
+    tokenized = [
+        tokenizer(
+            batch["tokens"], padding=padding, truncation=True, max_length=max_seq_length, is_split_into_words=True
+        )
+        for batch in batches
+    ]
+
+    # Each batch of labels is also written to Arrow, as `datasets.map` does with the output of `_preprocess_function`.
+    start = time.perf_counter()
+    expected = []
+    for inputs, batch in zip(tokenized, batches):
+        labels = reference_labels(inputs, batch, label2id, b2i_label, label_all_tokens)
+        expected.append(Dataset.from_dict({"labels": labels}))
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = []
+    for inputs, batch in zip(tokenized, batches):
+        labels = TokenClassifier._align_labels(
+            inputs, batch["ner_tags"], label2id, b2i_label, label_all_tokens, padding_side
+        )
+        actual.append(Dataset.from_dict({"labels": labels}))
+    vectorized_time = time.perf_counter() - start
+    return {
+        "padding": padding,
+        "padding_side": padding_side,
+        "label_all_tokens": label_all_tokens,
+        "num_examples": num_examples,
+        "batch_size": batch_size,
+        "loop_seconds": loop_time,
+        "vectorized_seconds": vectorized_time,
+        "speedup": loop_time / vectorized_time,
+        "match": all(
+            x.features == y.features and x["labels"] == y["labels"] for x, y in zip(expected, actual)
+        ),
+    }
+
+
+def load_tokenizer(model_dir: Text) -> Any:
+    from transformers import AutoTokenizer
+
+    build_tiny_model(model_dir, "token-classification", labels=_LABELS)
+    return AutoTokenizer.from_pretrained(model_dir)
+
+
+@click.command()
+@click.option('--num_examples', type=int, default=20000, help='Number of random examples per case.')
+@click.option('--batch_size', type=int, default=1000, help='Number of examples per batch, as in `datasets.map`.')
+@click.option('--max_length', type=int, default=128, help='Maximum number of tokens, longer examples are truncated.')
+@click.option('--seeds', type=int, default=2, help='Number of random datasets checked per case.')
+def main(num_examples: int, batch_size: int, max_length: int, seeds: int):
+    with tempfile.TemporaryDirectory() as model_dir:
+        tokenizer = load_tokenizer(model_dir)
+        results = [
+            run_case(
+                tokenizer, padding, padding_side, label_all_tokens, num_examples, batch_size, max_length, seed=seed
+            )
+            for padding, padding_side in _CASES
+            for label_all_tokens in (False, True)
+            for seed in range(seeds)
+        ]
+    print(json.dumps(results, indent=2))
+    mismatches = [result for result in results if not result["match"]]
+    if mismatches:
+        raise SystemExit(f"Label alignment doesn't match the reference loop: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
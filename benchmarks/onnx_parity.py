@@ -0,0 +1,106 @@
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Text, Optional, List, Dict, Any
+
+import click
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from classification.sentence import SentenceClassifier  # noqa: E402
+from classification.token import TokenClassifier  # noqa: E402
+from utils.testing import build_tiny_model, synthetic_vocab  # noqa: E402
+
+_MODEL_CLASSES = {"sentence-classification": SentenceClassifier, "token-classification": TokenClassifier}
+
+
+def _random_texts(num_texts: int, max_words: int, seed: int = 42) -> List[Text]:
+    rng = random.Random(seed)
+    vocab = synthetic_vocab()
+    return [" ".join(rng.choices(vocab, k=rng.randint(1, max_words))) for _ in range(num_texts)]
+
+
+def _logits(model, texts: List[Text]) -> np.ndarray:
+    with torch.inference_mode():
+        outputs = model.forward(model.preprocess_batch(texts))
+    return outputs["logits"].float().cpu().numpy()
+
+
+def run_case(
+        task_name: Text,
+        model_dir: Text,
+        onnx_dir: Text,
+        batch_sizes: List[int],
+        max_words: int,
+        repeats: int,
+) -> Dict[Text, Any]:
+    model_class = _MODEL_CLASSES[task_name]
+    torch_model = model_class(task_name, model_dir, no_cuda=True)
+    torch_model.export(onnx_dir)
+    onnx_model = model_class(task_name, onnx_dir, backend="onnxruntime")
+
+    max_difference = 0.0
+    same_predictions = True
+    latencies = {"torch": 0.0, "onnxruntime": 0.0}
+    # Different batch sizes and lengths check that the batch and sequence axes are dynamic.
+    for i, batch_size in enumerate(batch_sizes):
+        texts = _random_texts(batch_size, max_words * (i + 1), seed=i)
+        expected = _logits(torch_model, texts)
+        actual = _logits(onnx_model, texts)
+        max_difference = max(max_difference, float(np.abs(expected - actual).max()))
+        same_predictions &= bool((expected.argmax(-1) == actual.argmax(-1)).all())
+        for name, model in (("torch", torch_model), ("onnxruntime", onnx_model)):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                _logits(model, texts)
+            latencies[name] += (time.perf_counter() - start) / repeats
+    return {
+        "task_name": task_name,
+        "max_difference": max_difference,
+        "same_predictions": same_predictions,
+        "torch_seconds": latencies["torch"],
+        "onnxruntime_seconds": latencies["onnxruntime"],
+        "speedup": latencies["torch"] / latencies["onnxruntime"],
+    }
+
+
+@click.command()
+@click.option('--model_name', help='A trained model to check. Default: tiny random models for both tasks.')
+@click.option('--task_name', help='Task of `--model_name`.')
+@click.option('--batch_sizes', default="1,8,32", help='Comma-separated batch sizes to check.')
+@click.option('--max_words', type=int, default=16, help='Maximum number of words of the texts in the first batch.')
+@click.option('--repeats', type=int, default=5, help='Number of timed forward passes per batch.')
+@click.option('--tolerance', type=float, default=1e-4, help='Maximum allowed logit difference with PyTorch.')
+def main(
+        model_name: Optional[Text],
+        task_name: Optional[Text],
+        batch_sizes: Text,
+        max_words: int,
+        repeats: int,
+        tolerance: float,
+):
+    batch_sizes = [int(size) for size in batch_sizes.split(",")]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if model_name is not None:
+            cases = [(task_name, model_name)]
+        else:
+            cases = [(task, build_tiny_model(os.path.join(tmp_dir, task), task)) for task in _MODEL_CLASSES]
+        results = [
+            run_case(task, model_dir, os.path.join(tmp_dir, f"{task}-onnx"), batch_sizes, max_words, repeats)
+            for task, model_dir in cases
+        ]
+    print(json.dumps(results, indent=2))
+    mismatches = [
+        result for result in results if result["max_difference"] > tolerance or not result["same_predictions"]
+    ]
+    if mismatches:
+        raise SystemExit(f"onnxruntime outputs don't match PyTorch: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
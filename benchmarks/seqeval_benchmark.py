@@ -0,0 +1,117 @@
+import json
+import math
+import os
+import sys
+import time
+from typing import Text, Optional, List, Dict, Any, Tuple
+
+import click
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from utils import metrics  # noqa: E402
+
+# (scheme, mode, prefixes used to generate random tags)
+_CASES = [
+    (None, None, "IOBES"),
+    ("IOB1", "strict", "IOB"),
+    ("IOB2", "strict", "IOB"),
+    ("IOE1", "strict", "IOE"),
+    ("IOE2", "strict", "IOE"),
+    ("IOBES", "strict", "IOBES"),
+    ("BILOU", "strict", "BILOU"),
+]
+_TYPES = ["PER", "LOC", "ORG", "MISC"]
+
+
+def random_tag_ids(
+        num_sequences: int,
+        num_labels: int,
+        min_length: int = 5,
+        max_length: int = 60,
+        outside_ratio: float = 0.6,
+        seed: int = 42,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Random tag id arrays of shape [N, max_length], -100 after the end of each sequence in the references.
+    # Label 0 is "O". Transitions are random, so invalid and unusual tag sequences are covered too.
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(min_length, max_length + 1, size=num_sequences)
+    mask = np.arange(max_length)[None, :] < lengths[:, None]
+
+    def sample() -> np.ndarray:
+        ids = rng.integers(1, num_labels, size=(num_sequences, max_length))
+        ids[rng.random((num_sequences, max_length)) < outside_ratio] = 0
+        return ids
+
+    references = sample()
+    # Predictions agree with the references most of the time, like a trained model.
+    predictions = np.where(rng.random((num_sequences, max_length)) < 0.8, references, sample())
+    references[~mask] = -100
+    return predictions, references
+
+
+def _decode(ids: np.ndarray, references: np.ndarray, label_names: List[Text]) -> List[List[Text]]:
+    return [[label_names[i] for i, r in zip(row, ref) if r != -100] for row, ref in zip(ids, references)]
+
+
+def _max_difference(expected: Dict[Text, Any], actual: Dict[Text, Any]) -> float:
+    if set(expected) != set(actual):
+        return math.inf
+    difference = 0.0
+    for key, value in expected.items():
+        if isinstance(value, dict):
+            difference = max(difference, _max_difference(value, actual[key]))
+        else:
+            difference = max(difference, abs(float(value) - float(actual[key])))
+    return difference
+
+
+def run_case(
+        scheme: Optional[Text],
+        mode: Optional[Text],
+        prefixes: Text,
+        num_sequences: int,
+        seed: int = 42,
+) -> Dict[Text, Any]:
+    label_names = ["O"] + [f"{prefix}-{type_name}" for prefix in prefixes if prefix != "O" for type_name in _TYPES]
+    predictions, references = random_tag_ids(num_sequences, len(label_names), seed=seed)
+    true_predictions = _decode(predictions, references, label_names)
+    true_labels = _decode(references, references, label_names)
+
+    start = time.perf_counter()
+    expected = metrics.seqeval(true_predictions, true_labels, scheme=scheme, mode=mode, zero_division=0)
+    seqeval_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = metrics.fast_seqeval(predictions, references, label_names, scheme=scheme, mode=mode, zero_division=0)
+    fast_time = time.perf_counter() - start
+    return {
+        "scheme": scheme,
+        "mode": mode,
+        "num_sequences": num_sequences,
+        "seqeval_seconds": seqeval_time,
+        "fast_seqeval_seconds": fast_time,
+        "speedup": seqeval_time / fast_time,
+        "max_difference": _max_difference(expected, actual),
+    }
+
+
+@click.command()
+@click.option('--num_sequences', type=int, default=20000, help='Number of random sequences per case.')
+@click.option('--seeds', type=int, default=3, help='Number of random datasets checked per case.')
+@click.option('--tolerance', type=float, default=1e-9, help='Maximum allowed score difference with seqeval.')
+def main(num_sequences: int, seeds: int, tolerance: float):
+    results = [
+        run_case(scheme, mode, prefixes, num_sequences, seed=seed)
+        for scheme, mode, prefixes in _CASES
+        for seed in range(seeds)
+    ]
+    print(json.dumps(results, indent=2))
+    mismatches = [result for result in results if result["max_difference"] > tolerance]
+    if mismatches:
+        raise SystemExit(f"fast_seqeval doesn't match seqeval: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,16 @@
 import importlib
 import logging
 import sys
-from typing import Text, Optional, Union, Dict, List, Any
+from typing import Text, Optional, Union, Dict, List, Any, Set
 
+import numpy as np
 import transformers
+from datasets import Dataset
 from torch import nn, Tensor
 from transformers import (
-    AutoConfig,
-    AutoTokenizer,
     AutoModelForSequenceClassification,
     default_data_collator,
-    DataCollatorWithPadding, PretrainedConfig
+    DataCollatorWithPadding, PretrainedConfig, PreTrainedTokenizerBase
 )
 
 from base import BaseModel
@@ -42,6 +42,10 @@ class SentenceClassifier(BaseModel):
         use_fast_tokenizer: bool = True,
         ignore_mismatched_sizes: bool = True,
         no_cuda: bool = False,
+        quantize: Optional[Text] = None,
+        backend: Text = "torch",
+        revision: Optional[Text] = None,
+        use_registry: bool = False,
     ):
         super().__init__(
             model_name=model_name,
@@ -51,37 +55,16 @@ class SentenceClassifier(BaseModel):
             use_fast_tokenizer=use_fast_tokenizer,
             ignore_mismatched_sizes=ignore_mismatched_sizes,
             no_cuda=no_cuda,
+            revision=revision,
+            use_registry=use_registry,
         )
         self.task_name = task_name
         if num_labels is not None:
-            self.config = AutoConfig.from_pretrained(
-                self.model_name,
-                num_labels=num_labels,
-                finetuning_task=self.task_name,
-                cache_dir=self.cache_dir,
-                use_auth_token=self.auth_token,
-            )
+            self.config = self._load_config(num_labels=num_labels, finetuning_task=self.task_name)
         else:
-            self.config = AutoConfig.from_pretrained(
-                self.model_name,
-                finetuning_task=self.task_name,
-                cache_dir=self.cache_dir,
-                use_auth_token=self.auth_token,
-            )
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            self.model_name,
-            cache_dir=self.cache_dir,
-            use_fast=self.use_fast_tokenizer,
-            use_auth_token=self.auth_token
-        )
-        self.model = AutoModelForSequenceClassification.from_pretrained(
-            self.model_name,
-            from_tf=self.use_tf,
-            config=self.config,
-            cache_dir=self.cache_dir,
-            use_auth_token=self.auth_token,
-            ignore_mismatched_sizes=self.ignore_mismatched_sizes,
-        )
+            self.config = self._load_config(finetuning_task=self.task_name)
+        self.tokenizer = self._load_tokenizer()
+        self.model = self._load_pretrained_model(AutoModelForSequenceClassification, quantize=quantize, backend=backend)
         self.model.to(self.device)
 
     def _get_collator(self, padding: bool = True, fp16: bool = True):
@@ -90,23 +73,32 @@ class SentenceClassifier(BaseModel):
         elif fp16:
             data_collator = DataCollatorWithPadding(self.tokenizer, pad_to_multiple_of=8)
         else:
-            data_collator = None
+            data_collator = DataCollatorWithPadding(self.tokenizer)
         return data_collator
 
+    @staticmethod
     def _preprocess_function(
-        self,
         examples,
+        tokenizer: PreTrainedTokenizerBase,
         input_key_1: Text,
         input_key_2: Optional[Text] = None,
         max_seq_length: int = 128,
         padding: Union[Text, bool] = True,
-        label_to_id: Optional[Dict[Text, int]] = None
+        label_to_id: Optional[Dict[Text, int]] = None,
+        label_set: Optional[Set[Any]] = None,
     ):
         # Tokenize the texts
         args = (
             (examples[input_key_1],) if input_key_2 is None else (examples[input_key_1], examples[input_key_2])
         )
-        tokenized_inputs = self.tokenizer(*args, padding=padding, max_length=max_seq_length, truncation=True)
+        tokenized_inputs = tokenizer(*args, padding=padding, max_length=max_seq_length, truncation=True)
+
+        if label_set is not None and "label" in examples:
+            # An explicit `label_list` is checked batch by batch here instead of scanning the labels beforehand.
+            # -1 marks unlabeled examples.
+            missing_labels = set(examples["label"]) - label_set - {-1}
+            if missing_labels:
+                raise ValueError(f"Labels of the data are missing from `label_list`: {sorted(missing_labels)}")
 
         # Map labels to IDs
         if label_to_id is not None and "label" in examples:
@@ -137,6 +129,7 @@ class SentenceClassifier(BaseModel):
                 self._init_linear_weights(v)
 
     def _update_model_number_labels(self, label_list: List[Any]) -> None:
+        self.label_list = label_list
         num_labels = len(label_list)
         if self.model.config.label2id != PretrainedConfig(num_labels=num_labels).label2id:
             label_name_to_id = {k.lower(): v for k, v in self.model.config.label2id.items()}
@@ -163,6 +156,14 @@ class SentenceClassifier(BaseModel):
         self.model.config.label2id = label_to_id
         self.model.config.id2label = {i: l for l, i in self.config.label2id.items()}
 
+    def _find_label_list(self, dataset: Dataset) -> List[Any]:
+        label_list = dataset.unique("label")
+        label_list.sort()
+        return label_list
+
+    def _label_feature(self, dataset: Dataset) -> Any:
+        return dataset.features["label"]
+
     def _preprocess_data(
         self,
         dataset,
@@ -171,6 +172,9 @@ class SentenceClassifier(BaseModel):
         overwrite_cache: bool = False,
         do_train: bool = True,
         split: Text = "train",
+        preprocessing_num_workers: Optional[int] = None,
+        preprocessing_batch_size: int = 1000,
+        label_list: Optional[List[Any]] = None,
         **kwargs,
     ):
         non_label_column_names = [name for name in dataset[split].column_names if name != "label" and name != "id"]
@@ -191,41 +195,83 @@ class SentenceClassifier(BaseModel):
                 f"model ({self.tokenizer.model_max_length}). Using max_seq_length={self.tokenizer.model_max_length}."
             )
         max_seq_length = min(max_seq_length, self.tokenizer.model_max_length)
+        if label_list is not None:
+            label_list = self._convert_label_list(dataset[split], label_list)
         if do_train:
-            label_list = dataset[split].unique("label")
-            label_list.sort()
-            self._update_model_number_labels(label_list)
+            self._update_model_number_labels(
+                list(label_list if label_list is not None else self._find_label_list(dataset[split]))
+            )
 
+        # The function only receives the tokenizer, so workers don't need to unpickle the whole model.
+        # Shards are contiguous and concatenated in order, so the output doesn't depend on the number of workers.
         processed_dataset = dataset.map(
             self._preprocess_function,
             batched=True,
+            batch_size=preprocessing_batch_size,
+            num_proc=preprocessing_num_workers,
             load_from_cache_file=not overwrite_cache,
             desc="Running tokenizer on dataset",
             fn_kwargs={
+                'tokenizer': self.tokenizer,
                 'max_seq_length': max_seq_length,
                 'input_key_1': input_key_1,
                 'input_key_2': input_key_2,
-                'padding': padding
+                'padding': padding,
+                'label_set': set(label_list) if label_list is not None else None,
             }
         )
         return processed_dataset
 
     def preprocess_input(self, inputs, **kwargs: Dict) -> Dict[str, Tensor]:
         if isinstance(inputs, dict):
-            return self.tokenizer(**inputs, return_tensors='pt', **kwargs)
+            return self.tokenizer(
+                **inputs, return_tensors='pt', **self._tokenizer_kwargs("text_pair" in inputs, **kwargs)
+            )
         elif isinstance(inputs, list) and len(inputs) == 1 and isinstance(inputs[0], list) and len(inputs[0]) == 2:
             return self.tokenizer(
-                text=inputs[0][0], text_pair=inputs[0][1], return_tensors='pt', **kwargs
+                text=inputs[0][0], text_pair=inputs[0][1], return_tensors='pt', **self._tokenizer_kwargs(True, **kwargs)
             )
         elif isinstance(inputs, list) and len(inputs) == 2:
             return self.tokenizer(
-                text=inputs[0], text_pair=inputs[1], return_tensors='pt', **kwargs
+                text=inputs[0], text_pair=inputs[1], return_tensors='pt', **self._tokenizer_kwargs(True, **kwargs)
+            )
+        return self.tokenizer(inputs, return_tensors='pt', **self._tokenizer_kwargs(**kwargs))
+
+    def preprocess_batch(self, inputs: List[Any], **kwargs: Dict) -> Dict[str, Tensor]:
+        if all(isinstance(x, dict) for x in inputs):
+            batch_inputs = {key: [x[key] for x in inputs] for key in inputs[0]}
+            return self.tokenizer(
+                **batch_inputs,
+                return_tensors='pt',
+                **self._tokenizer_kwargs("text_pair" in batch_inputs, padding=True, truncation=True, **kwargs)
+            )
+        elif all(isinstance(x, (list, tuple)) and len(x) == 2 for x in inputs):
+            return self.tokenizer(
+                text=[x[0] for x in inputs],
+                text_pair=[x[1] for x in inputs],
+                return_tensors='pt',
+                **self._tokenizer_kwargs(True, padding=True, truncation=True, **kwargs)
             )
-        return self.tokenizer(inputs, return_tensors='pt', **kwargs)
+        return self.tokenizer(
+            inputs, return_tensors='pt', **self._tokenizer_kwargs(padding=True, truncation=True, **kwargs)
+        )
+
+    def _pool_windows(self, logits: np.ndarray, sample_mapping: np.ndarray) -> np.ndarray:
+        # Windows of the same input are contiguous, so they are reduced segment by segment.
+        window_starts = np.flatnonzero(np.diff(sample_mapping, prepend=-1))
+        if self.sliding_window["pooling"] == "max":
+            return np.maximum.reduceat(logits, window_starts, axis=0)
+        num_windows = np.diff(window_starts, append=len(logits))[:, None]
+        return (np.add.reduceat(logits, window_starts, axis=0) / num_windows).astype(logits.dtype)
 
     def postprocess_output(self, model_outputs, activation: Text = "softmax", top_k: int = 1) -> Any:
-        outputs = model_outputs["logits"][0]
-        outputs = outputs.detach().numpy()
+        return self.postprocess_batch(model_outputs, activation, top_k)[0]
+
+    def postprocess_batch(self, model_outputs, activation: Text = "softmax", top_k: int = 1) -> List[Any]:
+        outputs = model_outputs["logits"].float().cpu().detach().numpy()
+        sample_mapping = model_outputs.get("overflow_to_sample_mapping")
+        if sample_mapping is not None:
+            outputs = self._pool_windows(outputs, sample_mapping.cpu().numpy())
 
         if activation == 'sigmoid':
             scores = sigmoid(outputs)
@@ -236,12 +282,19 @@ class SentenceClassifier(BaseModel):
         else:
             raise ValueError(f"Unrecognized `activation` argument: {activation}")
 
+        id2label = self.model.config.id2label
         if top_k == 1:
-            return {"label": self.model.config.id2label[scores.argmax().item()], "score": scores.max().item()}
-        else:
-            dict_scores = [
-                {"label": self.model.config.id2label[i], "score": score.item()} for i, score in enumerate(scores)
+            label_ids = scores.argmax(axis=-1)
+            label_scores = np.take_along_axis(scores, label_ids[:, None], axis=-1)[:, 0]
+            return [
+                {"label": id2label[i], "score": score}
+                for i, score in zip(label_ids.tolist(), label_scores.tolist())
             ]
-            dict_scores.sort(key=lambda x: x["score"], reverse=True)
-            dict_scores = dict_scores[:top_k]
-        return dict_scores
+        # A stable sort on negated scores keeps the lower label id first on ties, like `list.sort` did.
+        top_k = min(top_k, scores.shape[-1])
+        label_ids = np.argsort(-scores, axis=-1, kind="stable")[:, :top_k]
+        label_scores = np.take_along_axis(scores, label_ids, axis=-1)
+        return [
+            [{"label": id2label[i], "score": score} for i, score in zip(row_ids, row_scores)]
+            for row_ids, row_scores in zip(label_ids.tolist(), label_scores.tolist())
+        ]
@@ -1,19 +1,21 @@
+import itertools
 import logging
 import sys
 from typing import Text, Optional, Union, Dict, List, Any, Tuple
 
 import numpy as np
+import pyarrow.compute as pc
+from datasets import Dataset
 from torch import nn, Tensor
 from transformers import (
-    AutoConfig,
-    AutoTokenizer,
     AutoModelForTokenClassification,
     PretrainedConfig,
-    DataCollatorForTokenClassification, EvalPrediction
+    DataCollatorForTokenClassification, EvalPrediction, PreTrainedTokenizerBase
 )
 
 from base import BaseModel
 from utils import metrics
+from utils.helpers import softmax
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -37,6 +39,10 @@ class TokenClassifier(BaseModel):
         use_fast_tokenizer: bool = True,
         ignore_mismatched_sizes: bool = True,
         no_cuda: bool = False,
+        quantize: Optional[Text] = None,
+        backend: Text = "torch",
+        revision: Optional[Text] = None,
+        use_registry: bool = False,
     ):
         super().__init__(
             model_name=model_name,
@@ -46,61 +52,39 @@ class TokenClassifier(BaseModel):
             use_fast_tokenizer=use_fast_tokenizer,
             ignore_mismatched_sizes=ignore_mismatched_sizes,
             no_cuda=no_cuda,
+            revision=revision,
+            use_registry=use_registry,
         )
         self.task_name = task_name
         if num_labels is not None:
-            self.config = AutoConfig.from_pretrained(
-                self.model_name,
-                num_labels=num_labels,
-                finetuning_task=self.task_name,
-                cache_dir=self.cache_dir,
-                use_auth_token=self.auth_token,
-            )
+            self.config = self._load_config(num_labels=num_labels, finetuning_task=self.task_name)
         else:
-            self.config = AutoConfig.from_pretrained(
-                self.model_name,
-                finetuning_task=self.task_name,
-                cache_dir=self.cache_dir,
-                use_auth_token=self.auth_token,
-            )
+            self.config = self._load_config(finetuning_task=self.task_name)
         if self.config.model_type in {"gpt2", "roberta"}:
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                self.model_name,
-                cache_dir=self.cache_dir,
-                use_fast=self.use_fast_tokenizer,
-                use_auth_token=self.auth_token,
-                add_prefix_space=True,
-            )
+            self.tokenizer = self._load_tokenizer(add_prefix_space=True)
         else:
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                self.model_name,
-                cache_dir=self.cache_dir,
-                use_fast=self.use_fast_tokenizer,
-                use_auth_token=self.auth_token
-            )
-        self.model = AutoModelForTokenClassification.from_pretrained(
-            self.model_name,
-            from_tf=self.use_tf,
-            config=self.config,
-            cache_dir=self.cache_dir,
-            use_auth_token=self.auth_token,
-            ignore_mismatched_sizes=self.ignore_mismatched_sizes,
-        )
+            self.tokenizer = self._load_tokenizer()
+        self.model = self._load_pretrained_model(AutoModelForTokenClassification, quantize=quantize, backend=backend)
         self.model.to(self.device)
+        self._tag_metadata = None
+        self._special_ids = None
 
     def _get_collator(self, padding: bool = True, fp16: bool = True):
         return DataCollatorForTokenClassification(self.tokenizer, pad_to_multiple_of=8 if fp16 else None)
 
+    @staticmethod
     def _preprocess_function(
-        self,
         examples,
+        tokenizer: PreTrainedTokenizerBase,
+        label2id: Dict[Any, int],
+        b2i_label: Optional[List[int]],
         input_key: Text,
         label_key: Text,
         max_seq_length: int = 128,
         padding: Union[Text, bool] = True,
         label_all_tokens: bool = False,
     ):
-        tokenized_inputs = self.tokenizer(
+        tokenized_inputs = tokenizer(
             examples[input_key],
             padding=padding,
             truncation=True,
@@ -108,38 +92,83 @@ class TokenClassifier(BaseModel):
             # We use this argument because the texts in our dataset are lists of words (with a label for each word).
             is_split_into_words=True,
         )
-        labels = []
-        for i, label in enumerate(examples[label_key]):
-            word_ids = tokenized_inputs.word_ids(batch_index=i)
-            previous_word_idx = None
-            label_ids = []
-            for word_idx in word_ids:
-                # Special tokens have a word id that is None. We set the label to -100, so they are automatically
-                # ignored in the loss function.
-                if word_idx is None:
-                    label_ids.append(-100)
-                # We set the label for the first token of each word.
-                elif word_idx != previous_word_idx:
-                    label_ids.append(int(self.model.config.label2id[label[word_idx]]))
-                # For the other tokens in a word, we set the label to either the current label or -100, depending on
-                # the label_all_tokens flag.
-                else:
-                    if label_all_tokens:
-                        label_ids.append(int(self.model.config.b2i_label[self.model.config.label2id[label[word_idx]]]))
-                    else:
-                        label_ids.append(-100)
-                previous_word_idx = word_idx
-
-            labels.append(label_ids)
-        tokenized_inputs["labels"] = labels
+        tokenized_inputs["labels"] = TokenClassifier._align_labels(
+            tokenized_inputs, examples[label_key], label2id, b2i_label, label_all_tokens, tokenizer.padding_side
+        )
         return tokenized_inputs
 
+    @staticmethod
+    def _align_labels(
+        tokenized_inputs,
+        word_labels: List[List[Any]],
+        label2id: Dict[Any, int],
+        b2i_label: Optional[List[int]],
+        label_all_tokens: bool = False,
+        padding_side: Text = "right",
+    ) -> Union[np.ndarray, List[List[int]]]:
+        num_tokens = [len(input_ids) for input_ids in tokenized_inputs["input_ids"]]
+        if not num_tokens:
+            return []
+        # Rows of different lengths aren't padded. Padding tokens are labeled -100 like special tokens, they are
+        # skipped because converting word ids to integers costs more than the rest of the alignment.
+        is_padded = min(num_tokens) == max(num_tokens) and "attention_mask" in tokenized_inputs
+        num_unpadded = list(map(sum, tokenized_inputs["attention_mask"])) if is_padded else num_tokens
+        pad_offsets = np.subtract(num_tokens, num_unpadded) if padding_side == "left" else np.zeros_like(num_tokens)
+        word_ids = (
+            tokenized_inputs.word_ids(i)[offset:offset + length]
+            for i, (offset, length) in enumerate(zip(pad_offsets.tolist(), num_unpadded))
+        )
+        # The word ids of the whole batch are flattened once. Special tokens have a word id that is None, their label
+        # is set to -100, so they are automatically ignored in the loss function.
+        word_ids = np.fromiter(itertools.chain.from_iterable(word_ids), dtype=object, count=sum(num_unpadded))
+        is_word = word_ids != None  # noqa: E711
+        unpadded_starts = np.cumsum([0] + num_unpadded[:-1])
+
+        # Every word label of the batch is looked up once, then gathered for each token by its index in the batch.
+        num_words = [len(labels) for labels in word_labels]
+        try:
+            word_label_ids = np.fromiter(
+                map(label2id.__getitem__, itertools.chain.from_iterable(word_labels)),
+                dtype=np.int64,
+                count=sum(num_words),
+            )
+        except KeyError as e:
+            raise ValueError(f"Label {e} of the data isn't a label of the model, `label_list` must cover every label "
+                             f"of the data: {list(label2id)}")
+        token_word_ids = np.full(len(word_ids), -1, dtype=np.int64)
+        token_word_ids[is_word] = word_ids[is_word]
+        token_word_ids[is_word] += np.repeat(np.cumsum([0] + num_words[:-1]), num_unpadded)[is_word]
+
+        # We set the label for the first token of each word. For the other tokens in a word, we set the label to
+        # either the current label or -100, depending on the label_all_tokens flag.
+        previous_word_ids = np.roll(token_word_ids, 1)
+        previous_word_ids[unpadded_starts[np.not_equal(num_unpadded, 0)]] = -1
+        is_first_token = is_word & (token_word_ids != previous_word_ids)
+        label_ids = np.full(len(word_ids), -100, dtype=np.int64)
+        label_ids[is_first_token] = word_label_ids[token_word_ids[is_first_token]]
+        if label_all_tokens:
+            is_other_token = is_word & ~is_first_token
+            label_ids[is_other_token] = np.asarray(b2i_label, dtype=np.int64)[
+                word_label_ids[token_word_ids[is_other_token]]
+            ]
+
+        if is_padded:
+            # A padded batch is returned as one array, `datasets` writes it to Arrow much faster than nested lists.
+            padded_label_ids = np.full((len(num_tokens), num_tokens[0]), -100, dtype=np.int64)
+            rows = np.repeat(np.arange(len(num_tokens)), num_unpadded)
+            columns = np.arange(len(word_ids)) - np.repeat(unpadded_starts - pad_offsets, num_unpadded)
+            padded_label_ids[rows, columns] = label_ids
+            return padded_label_ids
+        label_ids = label_ids.tolist()
+        return [label_ids[start:start + length] for start, length in zip(unpadded_starts.tolist(), num_tokens)]
+
     def _init_linear_weights(self):
         self.model.classifier.weight.data.normal_(mean=0.0, std=self.config.initializer_range)
         if self.model.classifier.bias is not None:
             self.model.classifier.bias.data.zero_()
 
     def _update_model_number_labels(self, label_list: List[Any]) -> None:
+        self.label_list = label_list
         num_labels = len(label_list)
         if self.model.config.label2id != PretrainedConfig(num_labels=num_labels).label2id:
             label_name_to_id = {k.lower(): v for k, v in self.model.config.label2id.items()}
@@ -174,6 +203,25 @@ class TokenClassifier(BaseModel):
         self.model.config.label2id = label_to_id
         self.model.config.id2label = {i: l for l, i in self.config.label2id.items()}
 
+    @staticmethod
+    def _get_label_list(dataset: Dataset, label_key: Text) -> List[Any]:
+        # Flatten the list column and take its unique values in Arrow, without building Python lists per row.
+        labels = pc.list_flatten(dataset.with_format("arrow")[label_key])
+        return sorted(pc.unique(labels).drop_null().to_pylist())
+
+    @staticmethod
+    def _get_column_keys(column_names: List[Text]) -> Tuple[Text, Text]:
+        non_id_column_names = [col for col in column_names if col != 'id']
+        input_key = "input" if 'input' in non_id_column_names else non_id_column_names[0]
+        label_key = "label" if 'label' in non_id_column_names else non_id_column_names[1]
+        return input_key, label_key
+
+    def _find_label_list(self, dataset: Dataset) -> List[Any]:
+        return self._get_label_list(dataset, self._get_column_keys(dataset.column_names)[1])
+
+    def _label_feature(self, dataset: Dataset) -> Any:
+        return dataset.features[self._get_column_keys(dataset.column_names)[1]].feature
+
     def _preprocess_data(
         self,
         dataset,
@@ -182,12 +230,13 @@ class TokenClassifier(BaseModel):
         overwrite_cache: bool = False,
         do_train: bool = True,
         split: Text = "train",
+        preprocessing_num_workers: Optional[int] = None,
+        preprocessing_batch_size: int = 1000,
+        label_list: Optional[List[Any]] = None,
         **kwargs,
     ):
         column_names = dataset[split].column_names
-        non_id_column_names = [col for col in column_names if col != 'id']
-        input_key = "input" if 'input' in non_id_column_names else non_id_column_names[0]
-        label_key = "label" if 'label' in non_id_column_names else non_id_column_names[1]
+        input_key, label_key = self._get_column_keys(column_names)
         padding = "max_length" if pad_to_max_length else False
         if max_seq_length > self.tokenizer.model_max_length:
             logger.warning(
@@ -196,20 +245,26 @@ class TokenClassifier(BaseModel):
             )
         max_seq_length = min(max_seq_length, self.tokenizer.model_max_length)
         if do_train:
-            unique_labels = set()
-            for label in dataset[split][label_key]:
-                unique_labels = unique_labels | set(label)
-            label_list = list(unique_labels)
-            label_list.sort()
-            self._update_model_number_labels(label_list)
+            if label_list is None:
+                label_list = self._find_label_list(dataset[split])
+            else:
+                label_list = self._convert_label_list(dataset[split], label_list)
+            self._update_model_number_labels(list(label_list))
 
+        # The function only receives the tokenizer and label maps, so workers don't need to unpickle the whole model.
+        # Shards are contiguous and concatenated in order, so the output doesn't depend on the number of workers.
         processed_dataset = dataset.map(
             self._preprocess_function,
             batched=True,
+            batch_size=preprocessing_batch_size,
+            num_proc=preprocessing_num_workers,
             load_from_cache_file=not overwrite_cache,
             desc="Running tokenizer on dataset",
             remove_columns=column_names,
             fn_kwargs={
+                'tokenizer': self.tokenizer,
+                'label2id': self.model.config.label2id,
+                'b2i_label': getattr(self.model.config, 'b2i_label', None),
                 'max_seq_length': max_seq_length,
                 'input_key': input_key,
                 'label_key': label_key,
@@ -219,101 +274,178 @@ class TokenClassifier(BaseModel):
         )
         return processed_dataset
 
+    def _prediction_cache_key(self, inputs, activation: Text, top_k: int, precision: Text, **kwargs: Dict) -> Text:
+        # Entity offsets index into the exact input text, so differently spaced inputs can't share an entry.
+        return super()._prediction_cache_key(inputs, activation, top_k, precision, normalize=False, **kwargs)
+
     def preprocess_input(self, inputs, **kwargs: Dict) -> Dict[str, Tensor]:
         truncation = True if self.tokenizer.model_max_length and self.tokenizer.model_max_length > 0 else False
         model_inputs = self.tokenizer(
             inputs,
             return_tensors="pt",
-            truncation=truncation,
-            return_offsets_mapping=self.tokenizer.is_fast,
-            **kwargs,
+            **self._tokenizer_kwargs(truncation=truncation, return_offsets_mapping=self.tokenizer.is_fast, **kwargs),
         )
         return model_inputs
 
-    def forward(self, model_inputs: Dict[str, Tensor]):
+    def preprocess_batch(self, inputs: List[Any], **kwargs: Dict) -> Dict[str, Tensor]:
+        return self.preprocess_input(inputs, padding=True, **kwargs)
+
+    def forward(self, model_inputs: Dict[str, Tensor], precision: Text = "fp32"):
         offset_mapping = model_inputs.pop("offset_mapping", None)
-        model_inputs = {k: v.to(self.device) for k, v in model_inputs.items()}
-        model_outputs = self.model(**model_inputs)
+        sample_mapping = model_inputs.pop("overflow_to_sample_mapping", None)
+        with self._trace("host_to_device"):
+            model_inputs = {k: v.to(self.device) for k, v in model_inputs.items()}
+        with self._trace("model"), self._autocast(precision):
+            model_outputs = self._call_model(model_inputs)
         return {
             "input_ids": model_inputs["input_ids"],
             "offset_mapping": offset_mapping,
+            "overflow_to_sample_mapping": sample_mapping,
             **model_outputs,
         }
 
     def postprocess_output(self, model_outputs, activation: Text = "softmax", top_k: int = 1) -> Any:
-        logits = model_outputs["logits"][0].cpu().detach().numpy()
-        input_ids = model_outputs["input_ids"][0]
-        offset_mapping = model_outputs["offset_mapping"][0] if model_outputs["offset_mapping"] is not None else None
+        return self.postprocess_batch(model_outputs, activation, top_k)[0]
 
-        maxes = np.max(logits, axis=-1, keepdims=True)
-        shifted_exp = np.exp(logits - maxes)
-        scores = shifted_exp / shifted_exp.sum(axis=-1, keepdims=True)
+    def postprocess_batch(self, model_outputs, activation: Text = "softmax", top_k: int = 1) -> List[Any]:
+        logits = model_outputs["logits"].float().cpu().detach().numpy()
+        input_ids = model_outputs["input_ids"].cpu().numpy()
+        offset_mapping = model_outputs["offset_mapping"]
+        if offset_mapping is not None:
+            offset_mapping = offset_mapping.cpu().numpy()
 
-        pre_entities = self.gather_pre_entities(input_ids, scores, offset_mapping)
-        grouped_entities = self.aggregate(pre_entities)
-        return grouped_entities
+        # [batch, seq_len, num_labels]
+        scores = softmax(logits)
+        pre_entities, words = self.gather_pre_entities(input_ids, scores, offset_mapping)
+        sample_mapping = model_outputs.get("overflow_to_sample_mapping")
+        if sample_mapping is not None:
+            pre_entities, words = self.merge_windows(pre_entities, words, sample_mapping.cpu().numpy())
+        return self.aggregate(pre_entities, words)
+
+    def _get_tag_metadata(self) -> Dict[Text, np.ndarray]:
+        # Tag strings are parsed once per label set instead of once per token.
+        id2label = self.model.config.id2label
+        key = tuple(sorted((int(i), label) for i, label in id2label.items()))
+        if self._tag_metadata is None or self._tag_metadata[0] != key:
+            labels = self._id2label_array()
+            tags = [self.get_tag(label) if isinstance(label, str) else ("B", label) for label in labels]
+            _, tag_ids = np.unique(np.array([str(tag) for _, tag in tags], dtype=object), return_inverse=True)
+            self._tag_metadata = (key, {
+                "labels": labels,
+                "is_begin": np.array([bi != "I" for bi, _ in tags], dtype=bool),
+                "tag_ids": tag_ids.reshape(-1),
+                "groups": np.array([str(label).split("-")[-1] for label in labels], dtype=object),
+            })
+        return self._tag_metadata[1]
+
+    def _get_special_ids(self) -> np.ndarray:
+        if self._special_ids is None:
+            self._special_ids = np.array(self.tokenizer.all_special_ids, dtype=np.int64)
+        return self._special_ids
 
     def gather_pre_entities(
         self,
         input_ids: np.ndarray,
         scores: np.ndarray,
-        offset_mapping: Optional[List[Tuple[int, int]]],
-    ) -> List[dict]:
-        pre_entities = []
-        for idx, token_scores in enumerate(scores):
-            if input_ids[idx] in self.tokenizer.all_special_ids:
-                continue
-            word = self.tokenizer.convert_ids_to_tokens(int(input_ids[idx]))
-            if offset_mapping is not None:
-                start_ind, end_ind = offset_mapping[idx]
-                if not isinstance(start_ind, int):
-                    start_ind = start_ind.item()
-                    end_ind = end_ind.item()
-            else:
-                start_ind = None
-                end_ind = None
-
-            pre_entity = {
-                "word": word,
-                "scores": token_scores,
-                "start": start_ind,
-                "end": end_ind,
-                "index": idx,
-            }
-            pre_entities.append(pre_entity)
-        return pre_entities
+        offset_mapping: Optional[np.ndarray],
+    ) -> Tuple[Dict[Text, np.ndarray], List[Text]]:
+        # Flatten the non-special tokens of the whole [batch, seq_len] batch in row-major order.
+        rows, indices = np.nonzero(~np.isin(input_ids, self._get_special_ids()))
+        token_ids = input_ids[rows, indices]
+        token_scores = scores[rows, indices]
+        entity_ids = token_scores.argmax(axis=-1)
+        pre_entities = {
+            "row": rows,
+            "index": indices,
+            "entity": entity_ids,
+            "score": np.take_along_axis(token_scores, entity_ids[:, None], axis=-1)[:, 0],
+            "start": offset_mapping[rows, indices, 0] if offset_mapping is not None else None,
+            "end": offset_mapping[rows, indices, 1] if offset_mapping is not None else None,
+            "batch_size": len(input_ids),
+        }
 
-    def aggregate(self, pre_entities: List[dict]) -> List[dict]:
-        entity_groups = []
-        entity_group_disagg = []
+        # Each distinct id is converted and checked for a subword prefix once per batch.
+        unique_ids, inverse = np.unique(token_ids, return_inverse=True)
+        unique_words = self.tokenizer.convert_ids_to_tokens(unique_ids.tolist())
         subword_prefix = self.tokenizer._tokenizer.model.continuing_subword_prefix
-        for pre_entity in pre_entities:
-            entity_idx = pre_entity["scores"].argmax()
-            score = pre_entity["scores"][entity_idx]
-            entity = {
-                "entity": self.model.config.id2label[entity_idx],
-                "score": score,
-                "index": pre_entity["index"],
-                "word": pre_entity["word"],
-                "start": pre_entity["start"],
-                "end": pre_entity["end"],
-            }
-            if not entity_group_disagg:
-                entity_group_disagg.append(entity)
-                continue
-
-            bi, tag = self.get_tag(entity["entity"])
-            last_bi, last_tag = self.get_tag(entity_group_disagg[-1]["entity"])
-            is_subword = entity["word"].strip(subword_prefix) != entity["word"]
-            if tag == last_tag and bi != "B" or is_subword:
-                entity_group_disagg.append(entity)
-            else:
-                entity_groups.append(self.group_sub_entities(entity_group_disagg))
-                entity_group_disagg = [entity]
-        if entity_group_disagg:
-            entity_groups.append(self.group_sub_entities(entity_group_disagg))
+        is_subword = np.array([word.strip(subword_prefix) != word for word in unique_words], dtype=bool)
+        pre_entities["is_subword"] = is_subword[inverse.reshape(-1)]
+        words = [unique_words[i] for i in inverse.reshape(-1).tolist()]
+        return pre_entities, words
 
-        return entity_groups
+    @staticmethod
+    def merge_windows(
+        pre_entities: Dict[Text, np.ndarray],
+        words: List[Text],
+        sample_mapping: np.ndarray,
+    ) -> Tuple[Dict[Text, np.ndarray], List[Text]]:
+        # Windows of one input overlap by `stride` tokens. A token is identified in its input by its character offsets,
+        # plus its rank among tokens with the same offsets, and in overlaps the most confident prediction is kept.
+        rows = sample_mapping[pre_entities["row"]]
+        starts, ends = pre_entities["start"], pre_entities["end"]
+        order = np.lexsort((pre_entities["index"], ends, starts, pre_entities["row"]))
+        same_offsets = np.zeros(len(order), dtype=bool)
+        same_offsets[1:] = (
+            (pre_entities["row"][order][1:] == pre_entities["row"][order][:-1])
+            & (starts[order][1:] == starts[order][:-1])
+            & (ends[order][1:] == ends[order][:-1])
+        )
+        positions = np.arange(len(order))
+        ranks = np.empty(len(order), dtype=np.int64)
+        ranks[order] = positions - np.maximum.accumulate(np.where(same_offsets, 0, positions))
+
+        order = np.lexsort((-pre_entities["score"], ranks, ends, starts, rows))
+        is_first = np.ones(len(order), dtype=bool)
+        is_first[1:] = (
+            (rows[order][1:] != rows[order][:-1])
+            | (starts[order][1:] != starts[order][:-1])
+            | (ends[order][1:] != ends[order][:-1])
+            | (ranks[order][1:] != ranks[order][:-1])
+        )
+        keep = order[is_first]
+        merged = {key: value[keep] if isinstance(value, np.ndarray) else value for key, value in pre_entities.items()}
+        merged["row"] = rows[keep]
+        merged["batch_size"] = int(sample_mapping.max()) + 1 if len(sample_mapping) else 0
+        return merged, [words[i] for i in keep.tolist()]
+
+    def aggregate(self, pre_entities: Dict[Text, np.ndarray], words: List[Text]) -> List[List[dict]]:
+        grouped_entities = [[] for _ in range(pre_entities["batch_size"])]
+        rows = pre_entities["row"]
+        if len(rows) == 0:
+            return grouped_entities
+        tag_metadata = self._get_tag_metadata()
+        entity_ids = pre_entities["entity"]
+        is_begin = tag_metadata["is_begin"][entity_ids]
+        tag_ids = tag_metadata["tag_ids"][entity_ids]
+
+        # A token continues the previous group if it is an I- tag of the same type or a subword.
+        # Every sequence starts a new group.
+        continues = np.zeros(len(rows), dtype=bool)
+        continues[1:] = (
+            (rows[1:] == rows[:-1])
+            & (((tag_ids[1:] == tag_ids[:-1]) & ~is_begin[1:]) | pre_entities["is_subword"][1:])
+        )
+        group_starts = np.flatnonzero(~continues)
+        group_ends = np.append(group_starts[1:], len(rows)) - 1
+
+        scores = pre_entities["score"]
+        is_valid = ~np.isnan(scores)
+        group_scores = (
+            np.add.reduceat(np.where(is_valid, scores, 0), group_starts)
+            / np.add.reduceat(is_valid, group_starts)
+        ).astype(scores.dtype)
+        group_names = tag_metadata["groups"][entity_ids[group_starts]]
+        starts = pre_entities["start"][group_starts].tolist() if pre_entities["start"] is not None else None
+        ends = pre_entities["end"][group_ends].tolist() if pre_entities["end"] is not None else None
+        for i, (first, last) in enumerate(zip(group_starts.tolist(), group_ends.tolist())):
+            grouped_entities[rows[first]].append({
+                "entity_group": group_names[i],
+                "score": group_scores[i],
+                "word": self.tokenizer.convert_tokens_to_string(words[first:last + 1]),
+                "start": starts[i] if starts is not None else None,
+                "end": ends[i] if ends is not None else None,
+            })
+        return grouped_entities
 
     @staticmethod
     def get_tag(entity_name: str) -> Tuple[str, str]:
@@ -324,40 +456,35 @@ class TokenClassifier(BaseModel):
             tag = entity_name
         return bi, tag
 
-    def group_sub_entities(self, entities: List[dict]) -> dict:
-        entity = entities[0]["entity"].split("-")[-1]
-        scores = np.nanmean([entity["score"] for entity in entities])
-        tokens = [entity["word"] for entity in entities]
-
-        entity_group = {
-            "entity_group": entity,
-            "score": np.mean(scores),
-            "word": self.tokenizer.convert_tokens_to_string(tokens),
-            "start": entities[0]["start"],
-            "end": entities[-1]["end"],
-        }
-        return entity_group
+    def _id2label_array(self) -> np.ndarray:
+        id2label = self.model.config.id2label
+        labels = np.empty(max(int(i) for i in id2label) + 1, dtype=object)
+        for i, label in id2label.items():
+            labels[int(i)] = label
+        return labels
 
-    def compute_metrics(self, p: EvalPrediction, metric: Optional[Text] = None, **kwargs):
-        predictions, labels = p
-        predictions = np.argmax(predictions, axis=2)
+    def _remove_ignored_index(
+        self,
+        predictions: np.ndarray,
+        labels: np.ndarray,
+        flatten: bool = False,
+    ) -> Tuple[List[Any], List[Any]]:
+        # Remove ignored index (special tokens) with a boolean mask over the [N, seq_len] arrays
+        # and decode all ids at once through an id-to-label array.
+        id2label = self._id2label_array()
+        mask = labels != -100
+        true_predictions = id2label[predictions[mask]]
+        true_labels = id2label[labels[mask]]
+        if flatten:
+            return true_predictions.tolist(), true_labels.tolist()
+        splits = np.cumsum(mask.sum(axis=1))[:-1]
+        return (
+            [sequence.tolist() for sequence in np.split(true_predictions, splits)],
+            [sequence.tolist() for sequence in np.split(true_labels, splits)],
+        )
 
-        # Remove ignored index (special tokens)
-        true_predictions = [
-            [self.model.config.id2label[p] for (p, l) in zip(prediction, label) if l != -100]
-            for prediction, label in zip(predictions, labels)
-        ]
-        true_labels = [
-            [self.model.config.id2label[l] for (p, l) in zip(prediction, label) if l != -100]
-            for prediction, label in zip(predictions, labels)
-        ]
-        if type(true_labels[0][0]) == int:
-            label_is_int = True
-            true_predictions = [p for prediction in true_predictions for p in prediction]
-            true_labels = [l for label in true_labels for l in label]
-        else:
-            label_is_int = False
-        results = _DEFAULT_METRIC(predictions=true_predictions, references=true_labels, label_is_int=label_is_int, **kwargs)
+    @staticmethod
+    def _format_results(results: Dict[Text, Any], **kwargs) -> Dict[Text, Any]:
         if kwargs.get('return_entity_level_metrics'):
             # Unpack nested dictionaries
             final_results = {}
@@ -375,3 +502,46 @@ class TokenClassifier(BaseModel):
                 "f1": results["overall_f1"],
                 "accuracy": results["overall_accuracy"],
             }
+
+    def compute_metrics(self, p: EvalPrediction, metric: Optional[Text] = None, **kwargs):
+        predictions, labels = p
+        predictions = np.argmax(predictions, axis=2)
+        if metric == "fast_seqeval":
+            results = metrics.fast_seqeval(predictions=predictions,
+                                           references=labels,
+                                           label_names=self._id2label_array().tolist(),
+                                           **kwargs)
+            return self._format_results(results, **kwargs)
+
+        label_is_int = any(isinstance(label, int) for label in self.model.config.id2label.values())
+        true_predictions, true_labels = self._remove_ignored_index(predictions, labels, flatten=label_is_int)
+        results = _DEFAULT_METRIC(predictions=true_predictions, references=true_labels, label_is_int=label_is_int, **kwargs)
+        return self._format_results(results, **kwargs)
+
+    def _get_metric_accumulator(self, metric: Optional[Text] = None, **kwargs) -> Optional[metrics.MetricAccumulator]:
+        if metric == "fast_seqeval":
+            return metrics.FastSeqevalAccumulator(self._id2label_array().tolist(),
+                                                  suffix=kwargs.get("suffix", False),
+                                                  scheme=kwargs.get("scheme"),
+                                                  mode=kwargs.get("mode"))
+        # Integer labels and strict `scheme`/`mode` matching are only supported on full arrays with `seqeval`.
+        if any(isinstance(label, int) for label in self.model.config.id2label.values()):
+            return None
+        if kwargs.get("scheme") is not None or kwargs.get("mode") is not None:
+            return None
+        return metrics.SeqevalAccumulator(suffix=kwargs.get("suffix", False))
+
+    def _update_metric_accumulator(
+        self,
+        accumulator: metrics.MetricAccumulator,
+        logits: np.ndarray,
+        labels: np.ndarray,
+    ) -> None:
+        if isinstance(accumulator, metrics.FastSeqevalAccumulator):
+            accumulator.update(np.argmax(logits, axis=2), labels)
+            return
+        true_predictions, true_labels = self._remove_ignored_index(np.argmax(logits, axis=2), labels)
+        accumulator.update(true_predictions, true_labels)
+
+    def _compute_accumulated_metrics(self, accumulator: metrics.MetricAccumulator, **kwargs) -> Dict:
+        return self._format_results(accumulator.compute(**kwargs), **kwargs)
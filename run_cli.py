@@ -1,20 +1,28 @@
+import io
 import logging
 import os
-from typing import Text, Optional, Union
+from typing import Text, Optional, Union, Dict, Any
 import click
 import json
-import datasets
-import transformers
 
-from classification.sentence import SentenceClassifier
-from classification.token import TokenClassifier
-from utils.helpers import makerdir
-from utils.model_selection import select_model_suggestion
+from utils.streaming import iter_records, get_writer, count_complete_lines, chunked
 
+# torch, transformers, datasets and the classifiers are imported inside the commands that need them,
+# so that `--help` and argument errors don't pay for loading them.
 CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
 logger = logging.getLogger(__name__)
 
 
+def _get_model_class(task_name: Text):
+    if task_name == 'sentence-classification':
+        from classification.sentence import SentenceClassifier
+        return SentenceClassifier
+    elif task_name == 'token-classification':
+        from classification.token import TokenClassifier
+        return TokenClassifier
+    raise ValueError("Currently we only support `sentence-classification` and `token-classification`")
+
+
 @click.group()
 def commands():
   pass
@@ -48,6 +56,10 @@ def commands():
 @click.option('--hub_token', help='The token to use to pull the model from HuggingFace Hub.')
 @click.option('--use_fast', is_flag=True, default=True, help='Whether to use fast Tokenizer.')
 @click.option('--overwrite_output_dir', is_flag=True, default=False, help='Whether to overwrite the existing output dir.')
+@click.option('--tokenized_cache_dir', help='Where to cache tokenized datasets, shared by `train` and `evaluate` runs.')
+@click.option('--preprocessing_num_workers', type=int, default=None, help='Number of processes used to tokenize the data.')
+@click.option('--preprocessing_batch_size', type=int, default=1000, help='Number of examples per tokenization batch.')
+@click.option('--label_list', help='Comma-separated labels of the training data, label ids follow their order.')
 def train(
         task_name: Text,
         model_name: Text,
@@ -73,18 +85,23 @@ def train(
         hub_token: Optional[Text] = None,
         use_fast: bool = True,
         overwrite_output_dir: bool = False,
+        tokenized_cache_dir: Optional[Text] = None,
+        preprocessing_num_workers: Optional[int] = None,
+        preprocessing_batch_size: int = 1000,
+        label_list: Optional[Text] = None,
 ) -> None:
+    import datasets
+    import transformers
+    from utils.helpers import makerdir
+
     logger.setLevel(logging.DEBUG)
     datasets.utils.logging.set_verbosity(logging.DEBUG)
     transformers.utils.logging.set_verbosity(logging.DEBUG)
+    model_class = _get_model_class(task_name)
     if model_name is None:
+        from utils.model_selection import select_model_suggestion
         model_name, hub_token = select_model_suggestion()
-    if task_name == 'sentence-classification':
-        model = SentenceClassifier(task_name, model_name, auth_token=hub_token, use_fast_tokenizer=use_fast)
-    elif task_name == 'token-classification':
-        model = TokenClassifier(task_name, model_name, auth_token=hub_token, use_fast_tokenizer=use_fast)
-    else:
-        raise ValueError("Currently we only support `sentence-classification` and `token-classification`")
+    model = model_class(task_name, model_name, auth_token=hub_token, use_fast_tokenizer=use_fast)
     if output_dir is None:
         output_dir = os.path.join(CURRENT_DIR, 'outputs/')
         makerdir(output_dir)
@@ -110,7 +127,11 @@ def train(
                 warmup_ratio=warmup_ratio,
                 gradient_accumulation_steps=gradient_accumulation_steps,
                 weight_decay=weight_decay,
-                overwrite_output_dir=overwrite_output_dir)
+                overwrite_output_dir=overwrite_output_dir,
+                tokenized_cache_dir=tokenized_cache_dir,
+                preprocessing_num_workers=preprocessing_num_workers,
+                preprocessing_batch_size=preprocessing_batch_size,
+                label_list=label_list.split(",") if label_list else None)
 
 
 @commands.command()
@@ -131,6 +152,18 @@ def train(
 @click.option('--hub_token', help='The token to use to pull the model from HuggingFace Hub.')
 @click.option('--use_fast', is_flag=True, default=True, help='Whether to use fast Tokenizer.')
 @click.option('--no_cuda', is_flag=True, default=False, help='Whether to use CUDA to train on GPU.')
+@click.option('--group_by_length', is_flag=True, default=False, help='Whether to batch examples of similar length '
+                                                                      'together and pad each batch to its longest '
+                                                                      'sequence instead of `max_length`.')
+@click.option('--streaming_metrics', is_flag=True, default=False, help='Whether to update metrics batch by batch '
+                                                                        'instead of keeping all predictions in memory.')
+@click.option('--precision', type=click.Choice(["fp32", "bf16", "fp16"]), default=None,
+              help='Precision of the forward pass. Default: fp16 on GPU when `--fp16` is set, fp32 otherwise.')
+@click.option('--tokenized_cache_dir', help='Where to cache tokenized datasets, shared by `train` and `evaluate` runs.')
+@click.option('--preprocessing_num_workers', type=int, default=None, help='Number of processes used to tokenize the data.')
+@click.option('--preprocessing_batch_size', type=int, default=1000, help='Number of examples per tokenization batch.')
+@click.option('--trace', is_flag=True, default=False, help='Whether to record the time spent in each stage per batch, '
+                                                           'written to `latency_trace.json` in `output_dir`.')
 def evaluate(
         task_name: Text,
         model_name: Text,
@@ -148,15 +181,21 @@ def evaluate(
         hub_token: Optional[Text] = None,
         use_fast: bool = True,
         no_cuda: bool = False,
+        group_by_length: bool = False,
+        streaming_metrics: bool = False,
+        precision: Optional[Text] = None,
+        tokenized_cache_dir: Optional[Text] = None,
+        preprocessing_num_workers: Optional[int] = None,
+        preprocessing_batch_size: int = 1000,
+        trace: bool = False,
         **kwargs
 ):
+    from utils.helpers import makerdir
+
     logger.setLevel(logging.INFO)
-    if task_name == 'sentence-classification':
-        model = SentenceClassifier(task_name, model_name, auth_token=hub_token, use_fast_tokenizer=use_fast)
-    elif task_name == 'token-classification':
-        model = TokenClassifier(task_name, model_name, auth_token=hub_token, use_fast_tokenizer=use_fast)
-    else:
-        raise ValueError("Currently we only support `sentence-classification` and `token-classification`")
+    model = _get_model_class(task_name)(task_name, model_name, auth_token=hub_token, use_fast_tokenizer=use_fast)
+    if trace:
+        model.enable_tracing()
     if output_dir is None:
         output_dir = os.path.join(CURRENT_DIR, 'outputs/')
         makerdir(output_dir)
@@ -172,11 +211,377 @@ def evaluate(
                              metric=metric,
                              average=metric_average,
                              no_cuda=no_cuda,
+                             group_by_length=group_by_length,
+                             streaming_metrics=streaming_metrics,
+                             precision=precision,
+                             tokenized_cache_dir=tokenized_cache_dir,
+                             preprocessing_num_workers=preprocessing_num_workers,
+                             preprocessing_batch_size=preprocessing_batch_size,
                              **kwargs)
     with open(os.path.join(output_dir, "evaluation_results.json"), 'w') as f:
         results['task_name'] = task_name
         results['model_name'] = model_name
         json.dump(results, f)
+    if trace:
+        with open(os.path.join(output_dir, "latency_trace.json"), 'w') as f:
+            json.dump(model.tracer.to_dict(), f, indent=2)
+
+
+def _load_inference_model(
+        task_name: Text,
+        model_name: Text,
+        hub_token: Optional[Text] = None,
+        use_fast: bool = True,
+        no_cuda: bool = False,
+        quantize: Optional[Text] = None,
+        backend: Text = "torch",
+        revision: Optional[Text] = None,
+        use_registry: bool = False,
+):
+    return _get_model_class(task_name)(task_name, model_name, auth_token=hub_token, use_fast_tokenizer=use_fast,
+                                       no_cuda=no_cuda, quantize=quantize, backend=backend, revision=revision,
+                                       use_registry=use_registry)
+
+
+def _compile_model(model, mode: Text, batch_size: int, max_length: int) -> None:
+    from utils.compiled_model import DEFAULT_BATCH_BUCKETS, DEFAULT_SEQUENCE_BUCKETS
+
+    # Buckets never exceed the largest batch and sequence the command can produce.
+    stats = model.compile(
+        mode,
+        batch_buckets=[size for size in DEFAULT_BATCH_BUCKETS if size < batch_size] + [batch_size],
+        sequence_buckets=[size for size in DEFAULT_SEQUENCE_BUCKETS if size < max_length] + [max_length],
+    )
+    logger.info(f"Compilation and warmup: {json.dumps(stats)}")
+
+
+def _get_model_input(record: Dict[Text, Any], task_name: Text, input_column: Optional[Text] = None) -> Any:
+    if input_column is not None:
+        model_input = record[input_column]
+    elif "input1" in record and "input2" in record:
+        model_input = [record["input1"], record["input2"]]
+    else:
+        model_input = record["input"]
+    if task_name == 'token-classification' and isinstance(model_input, list):
+        # Token classification files store pre-split words.
+        model_input = " ".join(model_input)
+    return model_input
+
+
+@commands.command()
+@click.option('--task_name', required=True, help='Name of the task: `sentence-classification` or `token-classification`.')
+@click.option('--model_name', required=True, help='Path to pretrained model or model identifier from huggingface.co/models.')
+@click.option('--input_file', required=True, help='A csv, jsonl or parquet file containing the inputs to predict.')
+@click.option('--output_file', required=True, help='A jsonl or parquet file to write the predictions to.')
+@click.option('--input_column', help='The column containing the inputs. Default: `input` or `input1,input2`.')
+@click.option('--max_length', type=int, default=128, help='The maximum total input sequence length after tokenization.')
+@click.option('--batch_size', type=int, default=32, help='Batch size for the forward pass.')
+@click.option('--chunk_size', type=int, default=1024, help='Number of rows read from `input_file` at a time.')
+@click.option('--activation', type=str, default="softmax", help='Activation applied on logits (sentence-classification).')
+@click.option('--top_k', type=int, default=1, help='Number of labels returned per input (sentence-classification).')
+@click.option('--offset', type=int, default=0, help='Number of input rows to skip before predicting.')
+@click.option('--resume', is_flag=True, default=False, help='Append to an existing jsonl `output_file`, '
+                                                             'skipping the rows it already contains.')
+@click.option('--hub_token', help='The token to use to pull the model from HuggingFace Hub.')
+@click.option('--use_fast', is_flag=True, default=True, help='Whether to use fast Tokenizer.')
+@click.option('--no_cuda', is_flag=True, default=False, help='Whether to use CUDA to run on GPU.')
+@click.option('--precision', type=click.Choice(["fp32", "bf16", "fp16"]), default="fp32",
+              help='Precision of the forward pass. bf16 is usually the fastest on recent CPUs.')
+@click.option('--quantize', type=click.Choice(["dynamic-int8"]), default=None,
+              help='Quantize the model on load (CPU only). Models saved by `quantize` are loaded quantized already.')
+@click.option('--backend', type=click.Choice(["torch", "onnxruntime"]), default="torch",
+              help='Run the forward pass with PyTorch or with ONNX Runtime on a model saved by `export`.')
+@click.option('--compile', 'compile_mode', type=click.Choice(["torch.compile", "torchscript"]), default=None,
+              help='Compile the forward pass for a fixed set of padded shapes, warmed up before the first request.')
+@click.option('--revision', help='The model revision (branch, tag or commit id) to load from the Hub.')
+@click.option('--stride', type=int, default=None,
+              help='Split inputs longer than `max_length` into windows overlapping by `stride` tokens instead of '
+                   'truncating them.')
+@click.option('--window_pooling', type=click.Choice(["mean", "max"]), default="mean",
+              help='How window logits are combined with `--stride` (sentence-classification).')
+@click.option('--trace_file', help='A json file to write the time spent in each stage, batch sizes and padding to.')
+def predict(
+        task_name: Text,
+        model_name: Text,
+        input_file: Text,
+        output_file: Text,
+        input_column: Optional[Text] = None,
+        max_length: int = 128,
+        batch_size: int = 32,
+        chunk_size: int = 1024,
+        activation: Text = "softmax",
+        top_k: int = 1,
+        offset: int = 0,
+        resume: bool = False,
+        hub_token: Optional[Text] = None,
+        use_fast: bool = True,
+        no_cuda: bool = False,
+        precision: Text = "fp32",
+        quantize: Optional[Text] = None,
+        backend: Text = "torch",
+        compile_mode: Optional[Text] = None,
+        revision: Optional[Text] = None,
+        stride: Optional[int] = None,
+        window_pooling: Text = "mean",
+        trace_file: Optional[Text] = None,
+):
+    logger.setLevel(logging.INFO)
+    model = _load_inference_model(task_name, model_name, hub_token=hub_token, use_fast=use_fast, no_cuda=no_cuda,
+                                  quantize=quantize, backend=backend, revision=revision, use_registry=True)
+    if stride is not None:
+        model.enable_sliding_window(stride=stride, pooling=window_pooling)
+    if compile_mode is not None:
+        _compile_model(model, compile_mode, batch_size, max_length)
+    if trace_file is not None:
+        model.enable_tracing()
+    if resume:
+        offset += count_complete_lines(output_file)
+        logger.info(f"Resuming predictions from row {offset}")
+
+    records = iter_records(input_file, offset=offset, batch_size=chunk_size)
+    inputs = (_get_model_input(record, task_name, input_column) for record in records)
+    predictions = model.predict_stream(inputs,
+                                       chunk_size=chunk_size,
+                                       batch_size=batch_size,
+                                       activation=activation,
+                                       top_k=top_k,
+                                       precision=precision,
+                                       max_length=max_length)
+    writer = get_writer(output_file, append=resume)
+    try:
+        for chunk in chunked(enumerate(predictions, start=offset), chunk_size):
+            writer.write([{"index": index, "prediction": prediction} for index, prediction in chunk])
+            logger.info(f"Predicted {chunk[-1][0] + 1} rows")
+    finally:
+        writer.close()
+    if trace_file is not None:
+        with open(trace_file, 'w') as f:
+            json.dump(model.tracer.to_dict(), f, indent=2)
+
+
+@commands.command()
+@click.option('--task_name', required=True, help='Name of the task: `sentence-classification` or `token-classification`.')
+@click.option('--model_name', required=True, help='Path to pretrained model or model identifier from huggingface.co/models.')
+@click.option('--host', default="127.0.0.1", help='Host to bind the server to.')
+@click.option('--port', type=int, default=8000, help='Port to bind the server to.')
+@click.option('--max_batch_size', type=int, default=32, help='Maximum number of requests in one forward pass.')
+@click.option('--max_latency_ms', type=float, default=10.0, help='Maximum time a request waits for its batch to fill.')
+@click.option('--max_length', type=int, default=128, help='The maximum total input sequence length after tokenization.')
+@click.option('--activation', type=str, default="softmax", help='Activation applied on logits (sentence-classification).')
+@click.option('--top_k', type=int, default=1, help='Number of labels returned per input (sentence-classification).')
+@click.option('--precision', type=click.Choice(["fp32", "bf16", "fp16"]), default="fp32",
+              help='Precision of the forward pass.')
+@click.option('--cache_size', type=int, default=0, help='Number of predictions kept in an LRU cache. 0 disables it.')
+@click.option('--cache_ttl', type=float, default=None, help='Seconds after which a cached prediction expires.')
+@click.option('--cache_path', help='A sqlite file backing the prediction cache, so restarted workers start warm.')
+@click.option('--hub_token', help='The token to use to pull the model from HuggingFace Hub.')
+@click.option('--use_fast', is_flag=True, default=True, help='Whether to use fast Tokenizer.')
+@click.option('--no_cuda', is_flag=True, default=False, help='Whether to use CUDA to run on GPU.')
+@click.option('--quantize', type=click.Choice(["dynamic-int8"]), default=None,
+              help='Quantize the model on load (CPU only). Models saved by `quantize` are loaded quantized already.')
+@click.option('--backend', type=click.Choice(["torch", "onnxruntime"]), default="torch",
+              help='Run the forward pass with PyTorch or with ONNX Runtime on a model saved by `export`.')
+@click.option('--compile', 'compile_mode', type=click.Choice(["torch.compile", "torchscript"]), default=None,
+              help='Compile the forward pass for a fixed set of padded shapes, warmed up before the first request.')
+@click.option('--revision', help='The model revision (branch, tag or commit id) to load from the Hub.')
+@click.option('--stride', type=int, default=None,
+              help='Split inputs longer than `max_length` into windows overlapping by `stride` tokens instead of '
+                   'truncating them.')
+@click.option('--window_pooling', type=click.Choice(["mean", "max"]), default="mean",
+              help='How window logits are combined with `--stride` (sentence-classification).')
+@click.option('--trace', is_flag=True, default=False, help='Whether to record the time spent in each stage, '
+                                                           'exported on `/metrics` in the Prometheus text format.')
+@click.option('--workers', type=int, default=1, help='Number of server processes forked after the model is loaded, '
+                                                     'sharing its weights copy-on-write.')
+def serve(
+        task_name: Text,
+        model_name: Text,
+        host: Text = "127.0.0.1",
+        port: int = 8000,
+        max_batch_size: int = 32,
+        max_latency_ms: float = 10.0,
+        max_length: int = 128,
+        activation: Text = "softmax",
+        top_k: int = 1,
+        precision: Text = "fp32",
+        cache_size: int = 0,
+        cache_ttl: Optional[float] = None,
+        cache_path: Optional[Text] = None,
+        hub_token: Optional[Text] = None,
+        use_fast: bool = True,
+        no_cuda: bool = False,
+        quantize: Optional[Text] = None,
+        backend: Text = "torch",
+        compile_mode: Optional[Text] = None,
+        revision: Optional[Text] = None,
+        stride: Optional[int] = None,
+        window_pooling: Text = "mean",
+        trace: bool = False,
+        workers: int = 1,
+):
+    logger.setLevel(logging.INFO)
+    if workers > 1:
+        import torch
+
+        if backend != "torch":
+            raise ValueError("`--workers` > 1 is only supported with the torch backend, ONNX Runtime starts its "
+                             "thread pool when the model is loaded.")
+        # An OpenMP thread pool started before forking deadlocks the workers, so the model is loaded with a single
+        # thread and each worker sets its own number of threads.
+        torch.set_num_threads(1)
+    model = _load_inference_model(task_name, model_name, hub_token=hub_token, use_fast=use_fast, no_cuda=no_cuda,
+                                  quantize=quantize, backend=backend, revision=revision, use_registry=True)
+    if workers > 1 and model.device != "cpu":
+        raise ValueError("`--workers` > 1 is only supported on CPU, CUDA can't be used in forked workers. "
+                         "Pass `--no_cuda`.")
+    if stride is not None:
+        model.enable_sliding_window(stride=stride, pooling=window_pooling)
+    tracer = model.enable_tracing() if trace else None
+    if workers > 1:
+        # The cache's sqlite connection can't be shared across processes, so it is opened after forking.
+        _fork_workers(model, workers)
+    if compile_mode is not None:
+        # Compiled in each worker, compilation starts threads and processes that don't survive a fork.
+        _compile_model(model, compile_mode, max_batch_size, max_length)
+    cache = None
+    if cache_size > 0:
+        cache = model.enable_prediction_cache(max_size=cache_size, ttl=cache_ttl, path=cache_path)
+
+    def predict_fn(inputs):
+        return model.predict_batch(inputs,
+                                   batch_size=max_batch_size,
+                                   activation=activation,
+                                   top_k=top_k,
+                                   precision=precision,
+                                   max_length=max_length)
+
+    import asyncio
+    from serving.batcher import MicroBatcher
+    from serving.server import InferenceServer
+
+    async def run():
+        batcher = MicroBatcher(predict_fn, max_batch_size=max_batch_size, max_latency_ms=max_latency_ms)
+        await InferenceServer(batcher,
+                              host=host,
+                              port=port,
+                              cache=cache,
+                              reuse_port=workers > 1,
+                              tracer=tracer).serve_forever()
+
+    asyncio.run(run())
+
+
+def _fork_workers(model, workers: int) -> None:
+    import gc
+    import torch
+
+    # Workers are forked after the model is loaded, so they share the weight pages copy-on-write. A single-threaded
+    # forward pass first initializes the lazy state of torch and its kernels once for all workers, without starting
+    # a thread pool. Freezing the GC keeps collections from writing to the pages of the parent's objects.
+    with torch.no_grad():
+        model.model(input_ids=torch.ones((1, 8), dtype=torch.long))
+    gc.collect()
+    gc.freeze()
+    for _ in range(workers - 1):
+        if os.fork() == 0:
+            break
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    logger.info(f"Worker {os.getpid()} started")
+
+
+def _state_dict_size(model) -> int:
+    import torch
+
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+@commands.command()
+@click.option('--task_name', required=True, help='Name of the task: `sentence-classification` or `token-classification`.')
+@click.option('--model_name', required=True, help='Path to pretrained model or model identifier from huggingface.co/models.')
+@click.option('--output_dir', required=True, help='Where to store the quantized model.')
+@click.option('--method', type=click.Choice(["dynamic-int8"]), default="dynamic-int8", help='Quantization method.')
+@click.option('--eval_file', help='A csv or a json file used to compare the quantized model against the fp32 one.')
+@click.option('--eval_dataset_name', help='The name of the dataset to use (via the datasets library).')
+@click.option('--eval_dataset_config_name', help='The configuration name of the dataset to use (via the datasets library).')
+@click.option('--split', help='The split of the dataset to use (via the datasets library).')
+@click.option('--max_length', type=int, default=128, help='The maximum total input sequence length after tokenization.')
+@click.option('--batch_size', type=int, default=32, help='Batch size for the evaluation.')
+@click.option('--metric', type=str, default="accuracy", help='Metric type to compute score.')
+@click.option('--metric_average', type=str, default=None, help='Determines the type of averaging performed on '
+                                                               'the metrics (used for recall/precision/f1)')
+@click.option('--hub_token', help='The token to use to pull the model from HuggingFace Hub.')
+@click.option('--use_fast', is_flag=True, default=True, help='Whether to use fast Tokenizer.')
+def quantize(
+        task_name: Text,
+        model_name: Text,
+        output_dir: Text,
+        method: Text = "dynamic-int8",
+        eval_file: Optional[Text] = None,
+        eval_dataset_name: Optional[Text] = None,
+        eval_dataset_config_name: Optional[Text] = None,
+        split: Optional[Text] = None,
+        max_length: int = 128,
+        batch_size: int = 32,
+        metric: Text = "accuracy",
+        metric_average: Optional[Text] = None,
+        hub_token: Optional[Text] = None,
+        use_fast: bool = True,
+):
+    logger.setLevel(logging.INFO)
+    model = _load_inference_model(task_name, model_name, hub_token=hub_token, use_fast=use_fast, no_cuda=True)
+    do_eval = eval_file is not None or eval_dataset_name is not None
+    eval_kwargs = dict(eval_dataset_name=eval_dataset_name,
+                       eval_dataset_config_name=eval_dataset_config_name,
+                       split=split,
+                       batch_size=batch_size,
+                       max_length=max_length,
+                       metric=metric,
+                       average=metric_average,
+                       precision="fp32")
+    report = {"task_name": task_name, "model_name": model_name, "method": method,
+              "fp32_size_bytes": _state_dict_size(model.model)}
+    if do_eval:
+        report["fp32"] = model.evaluate(eval_file, **eval_kwargs)
+
+    model.optimize(quantize=method)
+    report["quantized_size_bytes"] = _state_dict_size(model.model)
+    if do_eval:
+        report["quantized"] = model.evaluate(eval_file, **eval_kwargs)
+        report["delta"] = {
+            name: report["quantized"][name] - value
+            for name, value in report["fp32"].items()
+            if isinstance(value, (int, float)) and isinstance(report["quantized"].get(name), (int, float))
+        }
+        logger.info(f"Metric delta of the quantized model against fp32: {report['delta']}")
+
+    model.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, "quantization_report.json"), 'w') as f:
+        json.dump(report, f)
+
+
+@commands.command()
+@click.option('--task_name', required=True, help='Name of the task: `sentence-classification` or `token-classification`.')
+@click.option('--model_name', required=True, help='Path to pretrained model or model identifier from huggingface.co/models.')
+@click.option('--output_dir', required=True, help='Where to store the exported model.')
+@click.option('--format', 'export_format', type=click.Choice(["onnx"]), default="onnx", help='Export format.')
+@click.option('--opset', type=int, default=14, help='ONNX opset version.')
+@click.option('--hub_token', help='The token to use to pull the model from HuggingFace Hub.')
+@click.option('--use_fast', is_flag=True, default=True, help='Whether to use fast Tokenizer.')
+def export(
+        task_name: Text,
+        model_name: Text,
+        output_dir: Text,
+        export_format: Text = "onnx",
+        opset: int = 14,
+        hub_token: Optional[Text] = None,
+        use_fast: bool = True,
+):
+    logger.setLevel(logging.INFO)
+    model = _load_inference_model(task_name, model_name, hub_token=hub_token, use_fast=use_fast, no_cuda=True)
+    path = model.export(output_dir, format=export_format, opset=opset)
+    logger.info(f"Exported the model to {path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+import asyncio
+import collections
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Any, Dict, Text, Optional, Tuple
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class MicroBatcher:
+    def __init__(
+            self,
+            predict_fn: Callable[[List[Any]], List[Any]],
+            max_batch_size: int = 32,
+            max_latency_ms: float = 10.0,
+            max_queue_size: int = 0,
+            stats_window: int = 10000,
+    ):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._submitted = asyncio.Event()
+        # A single worker keeps the model off the event loop without running two forward passes at once.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.latencies = collections.deque(maxlen=stats_window)
+        self.batch_sizes = collections.deque(maxlen=stats_window)
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_errors = 0
+        self.max_queue_depth = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, inputs: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((inputs, future, time.perf_counter()))
+        self._submitted.set()
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[Any, asyncio.Future, float]]:
+        # Block for the first request, then flush once the batch is full or the deadline of the first one passes.
+        batch = [await self.queue.get()]
+        deadline = batch[0][2] + self.max_latency
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            # Only the wake-up has a timeout: before Python 3.12, `wait_for(queue.get(), timeout)` can drop an item
+            # that was dequeued just as the timeout fired.
+            self._submitted.clear()
+            try:
+                await asyncio.wait_for(self._submitted.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _predict(self, inputs: List[Any]) -> List[Any]:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.predict_fn, inputs)
+
+    async def _predict_each(self, inputs: List[Any]) -> List[Any]:
+        # Retried one by one after a failed batch, so that a bad request only fails itself.
+        outputs = []
+        for x in inputs:
+            try:
+                outputs.append((await self._predict([x]))[0])
+            except Exception as e:
+                outputs.append(e)
+        return outputs
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            inputs = [item[0] for item in batch]
+            try:
+                outputs = await self._predict(inputs)
+            except Exception as e:
+                outputs = [e] if len(batch) == 1 else await self._predict_each(inputs)
+            now = time.perf_counter()
+            for (_, future, submitted_at), output in zip(batch, outputs):
+                if isinstance(output, Exception):
+                    self.num_errors += 1
+                    if not future.done():
+                        future.set_exception(output)
+                    continue
+                self.latencies.append(now - submitted_at)
+                if not future.done():
+                    future.set_result(output)
+            self.batch_sizes.append(len(batch))
+            self.num_requests += len(batch)
+            self.num_batches += 1
+
+    def stats(self) -> Dict[Text, Any]:
+        latencies = list(self.latencies)
+        p50 = percentile(latencies, 50)
+        p99 = percentile(latencies, 99)
+        return {
+            "num_requests": self.num_requests,
+            "num_batches": self.num_batches,
+            "num_errors": self.num_errors,
+            "avg_batch_size": sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else None,
+            "latency_p50_ms": p50 * 1000 if p50 is not None else None,
+            "latency_p99_ms": p99 * 1000 if p99 is not None else None,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+        }
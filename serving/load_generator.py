@@ -0,0 +1,84 @@
+import asyncio
+import json
+import random
+import time
+from typing import Text, List, Dict, Any
+from urllib.parse import urlparse
+
+import click
+
+from serving.batcher import percentile
+from utils.testing import synthetic_vocab
+
+
+async def _request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: Text, body: bytes) -> int:
+    writer.write(
+        f"POST /predict HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    content_length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, value = line.decode("latin-1").split(":", 1)
+        if name.strip().lower() == "content-length":
+            content_length = int(value)
+    await reader.readexactly(content_length)
+    return status
+
+
+async def _client(url: Text, texts: List[Text], num_requests: int, latencies: List[float], errors: List[int]) -> None:
+    parsed = urlparse(url)
+    reader, writer = await asyncio.open_connection(parsed.hostname, parsed.port or 80)
+    try:
+        for _ in range(num_requests):
+            body = json.dumps({"inputs": random.choice(texts)}).encode("utf-8")
+            start = time.perf_counter()
+            status = await _request(reader, writer, parsed.hostname, body)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run_load(url: Text, texts: List[Text], concurrency: int = 32, num_requests: int = 1000) -> Dict[Text, Any]:
+    latencies, errors = [], []
+    per_client = max(1, num_requests // concurrency)
+    start = time.perf_counter()
+    await asyncio.gather(*[_client(url, texts, per_client, latencies, errors) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "num_requests": len(latencies),
+        "num_errors": len(errors),
+        "throughput_rps": len(latencies) / elapsed,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def synthetic_texts(num_texts: int = 1000, min_words: int = 5, max_words: int = 30, seed: int = 42) -> List[Text]:
+    rng = random.Random(seed)
+    vocab = synthetic_vocab()
+    return [" ".join(rng.choices(vocab, k=rng.randint(min_words, max_words))) for _ in range(num_texts)]
+
+
+@click.command()
+@click.option('--url', default="http://127.0.0.1:8000", help='Address of a server started with `run_cli.py serve`.')
+@click.option('--concurrency', type=int, default=32, help='Number of concurrent clients.')
+@click.option('--num_requests', type=int, default=1000, help='Total number of requests to send.')
+@click.option('--input_file', help='A text file with one input per line. Default: synthetic texts.')
+def main(url: Text, concurrency: int, num_requests: int, input_file: Text = None):
+    if input_file is not None:
+        with open(input_file, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = synthetic_texts()
+    print(json.dumps(asyncio.run(run_load(url, texts, concurrency, num_requests)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import logging
+import sys
+from typing import Text, Tuple, Dict, Any, Optional
+
+from serving.batcher import MicroBatcher
+from utils.cache import PredictionCache
+from utils.streaming import to_serializable
+from utils.tracing import LatencyTracer
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+    datefmt="%m/%d/%Y %H:%M:%S",
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[Text, Text, Dict[Text, Text], bytes]]:
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, value = line.decode("latin-1").split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, path, headers, body
+
+
+def _write_response(writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool) -> None:
+    if isinstance(payload, str):
+        # Prometheus scrapes its text format.
+        body = payload.encode("utf-8")
+        content_type = "text/plain; version=0.0.4"
+    else:
+        body = json.dumps(payload, ensure_ascii=False, default=to_serializable).encode("utf-8")
+        content_type = "application/json"
+    writer.write(
+        f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body
+    )
+
+
+def _is_valid_input(inputs: Any) -> bool:
+    # A text, a `[text, text_pair]` pair or a `{"text": ..., "text_pair": ...}` object.
+    if isinstance(inputs, str):
+        return True
+    if isinstance(inputs, list):
+        return len(inputs) == 2 and all(isinstance(x, str) for x in inputs)
+    if isinstance(inputs, dict):
+        return "text" in inputs and set(inputs) <= {"text", "text_pair"} and all(
+            isinstance(x, str) for x in inputs.values()
+        )
+    return False
+
+
+class InferenceServer:
+    def __init__(
+            self,
+            batcher: MicroBatcher,
+            host: Text = "127.0.0.1",
+            port: int = 8000,
+            cache: Optional[PredictionCache] = None,
+            reuse_port: bool = False,
+            tracer: Optional[LatencyTracer] = None,
+    ):
+        self.batcher = batcher
+        self.cache = cache
+        self.host = host
+        self.port = port
+        # Lets several forked workers accept connections on the same port.
+        self.reuse_port = reuse_port
+        self.tracer = tracer
+
+    async def _dispatch(self, method: Text, path: Text, body: bytes) -> Tuple[int, Any]:
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        elif method == "GET" and path == "/stats":
+            stats = self.batcher.stats()
+            if self.cache is not None:
+                stats["cache"] = self.cache.stats()
+            if self.tracer is not None:
+                stats["trace"] = self.tracer.to_dict()
+            return 200, stats
+        elif method == "GET" and path == "/metrics" and self.tracer is not None:
+            return 200, self.tracer.to_prometheus()
+        elif method == "POST" and path == "/predict":
+            try:
+                inputs = json.loads(body)["inputs"]
+            except (ValueError, KeyError, TypeError):
+                return 400, {"error": 'Request body must be a JSON object like {"inputs": "<text>"}'}
+            # Rejected before batching, an invalid input would otherwise fail the batch it's part of.
+            if not _is_valid_input(inputs):
+                return 400, {"error": '`inputs` must be a text, a [text, text_pair] list or a {"text": ...} object'}
+            return 200, {"prediction": await self.batcher.submit(inputs)}
+        return 404, {"error": f"Unknown route: {method} {path}"}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "keep-alive").lower() != "close"
+                try:
+                    status, payload = await self._dispatch(method, path, body)
+                except Exception as e:
+                    logger.exception("Failed to handle request")
+                    status, payload = 500, {"error": str(e)}
+                _write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_forever(self) -> None:
+        self.batcher.start()
+        server = await asyncio.start_server(self.handle, self.host, self.port, reuse_port=self.reuse_port or None)
+        logger.info(f"Serving on http://{self.host}:{self.port} "
+                    f"(max_batch_size={self.batcher.max_batch_size}, "
+                    f"max_latency_ms={self.batcher.max_latency * 1000})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+            if self.cache is not None:
+                # Commits the buffered writes of the on-disk cache.
+                self.cache.close()
@@ -0,0 +1,195 @@
+import base64
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Text, Optional, Dict, List, Tuple, BinaryIO
+
+MANIFEST_FILE = "octopus_manifest.json"
+DEFAULT_GCS_PROJECT = "momovn-dev-us"
+DEFAULT_GCS_BUCKET = "momovn-models-dev"
+_BLOBS_DIR = ".blobs"
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def _new_hash(algorithm: Text):
+    if algorithm == "md5":
+        return hashlib.md5()
+    if algorithm == "crc32c":
+        import google_crc32c
+
+        return google_crc32c.Checksum()
+    raise ValueError(f"Unsupported checksum algorithm {algorithm}.")
+
+
+def hash_file(path: Text, algorithm: Text = "md5") -> Text:
+    checksum = _new_hash(algorithm)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+            checksum.update(block)
+    digest = checksum.hexdigest()
+    # `google_crc32c` returns the hex digest as bytes.
+    return f"{algorithm}:{digest.decode() if isinstance(digest, bytes) else digest}"
+
+
+class ArtifactStore:
+    # Remote storage of model files. `stat` returns the size and checksum of a file as `<algorithm>:<hex digest>`,
+    # `download` appends the bytes of a file from `start` on to `f`.
+    def stat(self, path: Text) -> Tuple[int, Text]:
+        raise NotImplementedError
+
+    def download(self, path: Text, f: BinaryIO, start: int = 0) -> None:
+        raise NotImplementedError
+
+
+class LocalArtifactStore(ArtifactStore):
+    def __init__(self, root: Text):
+        self.root = root
+
+    def stat(self, path: Text) -> Tuple[int, Text]:
+        full_path = os.path.join(self.root, path)
+        if not os.path.isfile(full_path):
+            raise FileNotFoundError(f"{full_path} doesn't exist.")
+        return os.path.getsize(full_path), hash_file(full_path)
+
+    def download(self, path: Text, f: BinaryIO, start: int = 0) -> None:
+        with open(os.path.join(self.root, path), "rb") as source:
+            source.seek(start)
+            shutil.copyfileobj(source, f, _HASH_BLOCK_SIZE)
+
+
+class GCSArtifactStore(ArtifactStore):
+    def __init__(self, bucket: Text = DEFAULT_GCS_BUCKET, project: Text = DEFAULT_GCS_PROJECT):
+        self.bucket_name = bucket
+        self.project = project
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    @property
+    def bucket(self):
+        # One client for all downloads, its connection pool is shared by the fetch threads.
+        with self._lock:
+            if self._bucket is None:
+                from google.cloud import storage
+
+                self._bucket = storage.Client(project=self.project).bucket(self.bucket_name)
+            return self._bucket
+
+    def stat(self, path: Text) -> Tuple[int, Text]:
+        blob = self.bucket.get_blob(path)
+        if blob is None:
+            raise FileNotFoundError(f"gs://{self.bucket_name}/{path} doesn't exist.")
+        # Composite objects, e.g. from parallel uploads, only have a CRC32C checksum.
+        if blob.md5_hash is not None:
+            return blob.size, f"md5:{base64.b64decode(blob.md5_hash).hex()}"
+        return blob.size, f"crc32c:{base64.b64decode(blob.crc32c).hex()}"
+
+    def download(self, path: Text, f: BinaryIO, start: int = 0) -> None:
+        # Checksums of ranged downloads can't be validated by the client, `fetch_artifacts` checks the whole file.
+        self.bucket.blob(path).download_to_file(f, start=start or None, checksum=None)
+
+
+def get_artifact_store(uri: Optional[Text] = None) -> ArtifactStore:
+    # `gs://<bucket>` or a local directory. Defaults to `$OCTOPUS_ARTIFACT_STORE`, then our GCS bucket.
+    uri = uri or os.environ.get("OCTOPUS_ARTIFACT_STORE") or f"gs://{DEFAULT_GCS_BUCKET}"
+    if uri.startswith("gs://"):
+        project = os.environ.get("OCTOPUS_GCS_PROJECT", DEFAULT_GCS_PROJECT)
+        return GCSArtifactStore(uri[len("gs://"):].rstrip("/"), project)
+    return LocalArtifactStore(uri[len("file://"):] if uri.startswith("file://") else uri)
+
+
+def load_manifest(local_dir: Text) -> Optional[Dict[Text, Dict]]:
+    path = os.path.join(local_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_complete(local_dir: Text, files: List[Text], verify_checksums: bool = False) -> bool:
+    manifest = load_manifest(local_dir)
+    if manifest is None or any(filename not in manifest["files"] for filename in files):
+        return False
+    for filename in files:
+        path = os.path.join(local_dir, filename)
+        entry = manifest["files"][filename]
+        if not os.path.isfile(path) or os.path.getsize(path) != entry["size"]:
+            return False
+        if verify_checksums and hash_file(path, entry["checksum"].split(":")[0]) != entry["checksum"]:
+            return False
+    return True
+
+
+def _fetch_blob(store: ArtifactStore, path: Text, size: int, checksum: Text, blobs_dir: Text) -> Text:
+    # Blobs are addressed by their checksum, so files shared by several models are downloaded once.
+    blob_path = os.path.join(blobs_dir, checksum.replace(":", "-"))
+    if os.path.exists(blob_path):
+        return blob_path
+    part_path = f"{blob_path}.part"
+    with open(part_path, "ab") as f:
+        # Another process fetching the same blob holds the lock until it's done.
+        fcntl.flock(f, fcntl.LOCK_EX)
+        if os.path.exists(blob_path):
+            return blob_path
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        if offset > size:
+            f.truncate(0)
+            offset = 0
+        # An interrupted download continues from the bytes already in the part file.
+        if offset < size:
+            store.download(path, f, start=offset)
+        f.flush()
+        os.fsync(f.fileno())
+        actual = hash_file(part_path, checksum.split(":")[0])
+        if actual != checksum:
+            os.remove(part_path)
+            raise ValueError(f"Checksum mismatch for {path}: expected {checksum}, got {actual}.")
+        os.replace(part_path, blob_path)
+    return blob_path
+
+
+def _link(source: Text, destination: Text) -> None:
+    tmp_path = f"{destination}.tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+
+def fetch_artifacts(
+        store: ArtifactStore,
+        prefix: Text,
+        files: List[Text],
+        local_dir: Text,
+        cache_dir: Optional[Text] = None,
+        max_workers: int = 8,
+) -> Text:
+    if is_complete(local_dir, files):
+        return local_dir
+    cache_dir = cache_dir or os.path.dirname(os.path.abspath(local_dir))
+    blobs_dir = os.path.join(cache_dir, _BLOBS_DIR)
+    os.makedirs(blobs_dir, exist_ok=True)
+    os.makedirs(local_dir, exist_ok=True)
+
+    def fetch(filename: Text) -> Tuple[Text, Dict]:
+        path = f"{prefix.rstrip('/')}/{filename}" if prefix else filename
+        size, checksum = store.stat(path)
+        _link(_fetch_blob(store, path, size, checksum, blobs_dir), os.path.join(local_dir, filename))
+        return filename, {"size": size, "checksum": checksum}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        entries = dict(executor.map(fetch, files))
+    # The manifest is written last, so a directory without one is never mistaken for a complete download.
+    fd, tmp_path = tempfile.mkstemp(dir=local_dir, prefix=f".{MANIFEST_FILE}.")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"prefix": prefix, "files": entries}, f, indent=2)
+    os.replace(tmp_path, os.path.join(local_dir, MANIFEST_FILE))
+    return local_dir
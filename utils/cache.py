@@ -0,0 +1,197 @@
+import collections
+import hashlib
+import json
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Text, Optional, Any, Dict, Tuple
+
+from utils.streaming import to_serializable
+
+_MISSING = object()
+_WHITESPACE = re.compile(r"\s+")
+_MODEL_FILE_EXTENSIONS = (".bin", ".safetensors", ".onnx", ".pt", ".h5", ".json", ".txt", ".model")
+
+
+def normalize_text(text: Text) -> Text:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def _normalize_input(inputs: Any) -> Any:
+    if isinstance(inputs, str):
+        return normalize_text(inputs)
+    elif isinstance(inputs, dict):
+        return {k: _normalize_input(v) for k, v in inputs.items()}
+    elif isinstance(inputs, (list, tuple)):
+        return [_normalize_input(x) for x in inputs]
+    return inputs
+
+
+def make_cache_key(inputs: Any, normalize: bool = True, **params: Any) -> Text:
+    payload = json.dumps(
+        {"inputs": _normalize_input(inputs) if normalize else inputs, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def model_fingerprint(model_name: Text, config: Any = None) -> Text:
+    # Changes when a model is retrained in place: it covers the config and the size and mtime of the weights,
+    # config and tokenizer files of a local model. Hub models are identified by the commit they were downloaded at.
+    parts = [config.to_json_string() if config is not None else ""]
+    if os.path.isdir(model_name):
+        for filename in sorted(os.listdir(model_name)):
+            path = os.path.join(model_name, filename)
+            if filename.endswith(_MODEL_FILE_EXTENSIONS) and os.path.isfile(path):
+                stat = os.stat(path)
+                parts.append(f"{filename}:{stat.st_size}:{stat.st_mtime_ns}")
+    else:
+        parts.append(str(getattr(config, "_commit_hash", None)))
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class PredictionCache:
+    def __init__(
+            self,
+            max_size: int = 10000,
+            ttl: Optional[float] = None,
+            path: Optional[Text] = None,
+            write_batch_size: int = 256,
+            flush_interval: float = 1.0,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.write_batch_size = write_batch_size
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Values are kept pickled, so that every hit returns a new object and a caller mutating a prediction doesn't
+        # change it for the others.
+        self._entries: "collections.OrderedDict[Text, Tuple[Optional[float], bytes]]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        # Writes to sqlite are buffered and committed together, so that a batch of predictions costs one commit.
+        self._pending: Dict[Text, Tuple[Text, Optional[float], float]] = {}
+        self._last_flush = time.monotonic()
+        if path is not None:
+            # Entries are also written to sqlite so that a restarted worker starts warm.
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions "
+                "(key TEXT PRIMARY KEY, value TEXT, expires_at REAL, written_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS predictions_written_at ON predictions (written_at)")
+            self._db.commit()
+
+    def _expired(self, expires_at: Optional[float]) -> bool:
+        return expires_at is not None and expires_at <= time.time()
+
+    def _load(self, key: Text) -> Any:
+        if key in self._pending:
+            value, expires_at, _ = self._pending[key]
+        else:
+            row = self._db.execute("SELECT value, expires_at FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return _MISSING
+            value, expires_at = row
+        if self._expired(expires_at):
+            # Expired rows are deleted with the next flush.
+            return _MISSING
+        value = json.loads(value)
+        self._put(key, value, expires_at)
+        return value
+
+    def _put(self, key: Text, value: Any, expires_at: Optional[float]) -> None:
+        self._entries[key] = (expires_at, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if self._db is None:
+            return
+        if self._pending:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO predictions (key, value, expires_at, written_at) VALUES (?, ?, ?, ?)",
+                [(key, *row) for key, row in self._pending.items()],
+            )
+            self._pending = {}
+        # The same size and TTL bounds as in memory, the least recently written rows are evicted first.
+        self._db.execute("DELETE FROM predictions WHERE expires_at <= ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM predictions WHERE key IN "
+            "(SELECT key FROM predictions ORDER BY written_at LIMIT max(0, (SELECT COUNT(*) FROM predictions) - ?))",
+            (self.max_size,),
+        )
+        self._db.commit()
+
+    def get(self, key: Text, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                value = pickle.loads(entry[1])
+            elif self._db is not None:
+                value = self._load(key)
+            else:
+                value = _MISSING
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key: Text, value: Any) -> None:
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._put(key, value, expires_at)
+            if self._db is None:
+                return
+            serialized = json.dumps(value, ensure_ascii=False, default=to_serializable)
+            self._pending[key] = (serialized, expires_at, time.time())
+            if len(self._pending) >= self.write_batch_size or time.monotonic() > self._last_flush + self.flush_interval:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._pending = {}
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions")
+                self._db.commit()
+
+    def stats(self) -> Dict[Text, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else None,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._flush()
+                self._db.close()
+                self._db = None
@@ -0,0 +1,132 @@
+import collections
+import inspect
+import time
+from typing import Text, Optional, Dict, List, Any, Tuple
+
+import torch
+import torch.nn.functional as F
+
+from utils.onnx_backend import LogitsOnly
+
+COMPILE_MODES = ["torch.compile", "torchscript"]
+DEFAULT_BATCH_BUCKETS = [1, 8, 32]
+DEFAULT_SEQUENCE_BUCKETS = [32, 64, 128, 256, 512]
+
+
+def _bucket(size: int, buckets: List[int]) -> Optional[int]:
+    for bucket in buckets:
+        if size <= bucket:
+            return bucket
+    return None
+
+
+def _pad(tensor: torch.Tensor, shape: Tuple[int, int], value: int) -> torch.Tensor:
+    return F.pad(tensor, (0, shape[1] - tensor.shape[1], 0, shape[0] - tensor.shape[0]), value=value)
+
+
+class BucketedModel:
+    # Pads inputs to a fixed set of [batch, sequence] shapes, so that a compiled graph is only built once per shape.
+    # Larger inputs fall back to the eager model instead of triggering a new compilation.
+    def __init__(
+            self,
+            model: torch.nn.Module,
+            mode: Text = "torch.compile",
+            batch_buckets: Optional[List[int]] = None,
+            sequence_buckets: Optional[List[int]] = None,
+            pad_token_id: int = 0,
+    ):
+        if mode not in COMPILE_MODES:
+            raise ValueError(f"`mode` must be one of {COMPILE_MODES}, got {mode}.")
+        self.model = model
+        self.mode = mode
+        self.batch_buckets = sorted(batch_buckets or DEFAULT_BATCH_BUCKETS)
+        self.sequence_buckets = sorted(sequence_buckets or DEFAULT_SEQUENCE_BUCKETS)
+        max_position_embeddings = getattr(model.config, "max_position_embeddings", None)
+        if max_position_embeddings is not None:
+            self.sequence_buckets = [size for size in self.sequence_buckets if size <= max_position_embeddings]
+        self.pad_token_id = pad_token_id
+        self.use_token_type_ids = "token_type_ids" in inspect.signature(model.forward).parameters
+        self.module = LogitsOnly(model)
+        self.graphs: Dict[Tuple[int, int], Any] = {}
+        self.compile_seconds: Dict[Tuple[int, int], float] = {}
+        self.steady_latency_ms: Dict[Tuple[int, int], float] = {}
+        self.bucket_hits = collections.Counter()
+        self.num_fallbacks = 0
+        if mode == "torch.compile":
+            # Every bucket is a static shape, the default recompile limit would otherwise evict most of them.
+            import torch._dynamo.config as dynamo_config
+
+            limit_name = "recompile_limit" if hasattr(dynamo_config, "recompile_limit") else "cache_size_limit"
+            num_shapes = len(self.batch_buckets) * len(self.sequence_buckets)
+            setattr(dynamo_config, limit_name, max(getattr(dynamo_config, limit_name), num_shapes))
+            self.compiled = torch.compile(self.module, dynamic=False)
+
+    @property
+    def shapes(self) -> List[Tuple[int, int]]:
+        return [(batch, sequence) for batch in self.batch_buckets for sequence in self.sequence_buckets]
+
+    def _example_inputs(self, shape: Tuple[int, int], device) -> List[torch.Tensor]:
+        input_ids = torch.full(shape, self.pad_token_id, dtype=torch.long, device=device)
+        inputs = [input_ids, torch.ones_like(input_ids)]
+        if self.use_token_type_ids:
+            inputs.append(torch.zeros_like(input_ids))
+        return inputs
+
+    def _get_graph(self, shape: Tuple[int, int], inputs: List[torch.Tensor]):
+        if self.mode == "torch.compile":
+            return self.compiled
+        if shape not in self.graphs:
+            self.graphs[shape] = torch.jit.trace(self.module, tuple(inputs), strict=False, check_trace=False)
+        return self.graphs[shape]
+
+    def warmup(self, device, shapes: Optional[List[Tuple[int, int]]] = None) -> Dict[Text, Any]:
+        # The first calls of a shape build and optimize its graph (TorchScript re-optimizes on the second run),
+        # only the last call measures the steady-state latency.
+        with torch.inference_mode():
+            for shape in shapes or self.shapes:
+                inputs = self._example_inputs(shape, device)
+                start = time.perf_counter()
+                for _ in range(2):
+                    self._get_graph(shape, inputs)(*inputs)
+                self.compile_seconds[shape] = time.perf_counter() - start
+                start = time.perf_counter()
+                self._get_graph(shape, inputs)(*inputs)
+                self.steady_latency_ms[shape] = (time.perf_counter() - start) * 1000
+        return self.stats()
+
+    def __call__(self, **inputs: torch.Tensor) -> Dict[Text, Any]:
+        input_ids = inputs["input_ids"]
+        batch_size, sequence_length = input_ids.shape
+        shape = (_bucket(batch_size, self.batch_buckets), _bucket(sequence_length, self.sequence_buckets))
+        if None in shape:
+            self.num_fallbacks += 1
+            return self.model(**inputs)
+        attention_mask = inputs.get("attention_mask")
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        padded_inputs = [_pad(input_ids, shape, self.pad_token_id), _pad(attention_mask, shape, 0)]
+        if self.use_token_type_ids:
+            token_type_ids = inputs.get("token_type_ids")
+            if token_type_ids is None:
+                token_type_ids = torch.zeros_like(input_ids)
+            padded_inputs.append(_pad(token_type_ids, shape, 0))
+        self.bucket_hits[shape] += 1
+        logits = self._get_graph(shape, padded_inputs)(*padded_inputs)
+        # Sentence logits are [batch, num_labels], token logits [batch, sequence, num_labels].
+        logits = logits[:batch_size, :sequence_length] if logits.dim() == 3 else logits[:batch_size]
+        return {"logits": logits}
+
+    def stats(self) -> Dict[Text, Any]:
+        return {
+            "mode": self.mode,
+            "compile_seconds": sum(self.compile_seconds.values()),
+            "shapes": {
+                f"{batch}x{sequence}": {
+                    "compile_seconds": self.compile_seconds.get((batch, sequence)),
+                    "steady_latency_ms": self.steady_latency_ms.get((batch, sequence)),
+                    "hits": self.bucket_hits[(batch, sequence)],
+                }
+                for batch, sequence in self.shapes
+            },
+            "num_fallbacks": self.num_fallbacks,
+        }
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Text, Optional, Any, Dict, List, Tuple
+
+_METADATA_FILE = "octopus_metadata.json"
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def hash_text(text: Text) -> Text:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_fingerprint(paths: List[Optional[Text]]) -> Text:
+    # Content hash, so that renaming or touching a file keeps its cache while editing it invalidates it.
+    sha = hashlib.sha256()
+    for path in paths:
+        if path is None:
+            sha.update(b"\0")
+            continue
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+                sha.update(block)
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def make_dataset_cache_key(**params: Any) -> Text:
+    return hash_text(json.dumps(params, sort_keys=True, ensure_ascii=False, default=str))
+
+
+def load_cached_dataset(cache_dir: Text, key: Text) -> Optional[Tuple[Any, Dict[Text, Any]]]:
+    path = os.path.join(cache_dir, key)
+    metadata_path = os.path.join(path, _METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        return None
+    from datasets import load_from_disk
+
+    try:
+        with open(metadata_path, encoding="utf-8") as f:
+            metadata = json.load(f)
+        # `load_from_disk` memory-maps the Arrow files instead of reading them into RAM.
+        return load_from_disk(path), metadata
+    except FileNotFoundError:
+        # Removed by a concurrent `overwrite_cache` run.
+        return None
+
+
+def save_cached_dataset(
+        cache_dir: Text,
+        key: Text,
+        dataset: Any,
+        metadata: Dict[Text, Any],
+        overwrite: bool = False,
+) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key)
+    # Write to a temporary directory first so that an interrupted run never leaves a half-written entry.
+    tmp_path = tempfile.mkdtemp(dir=cache_dir, prefix=f".{key}.")
+    old_path = None
+    try:
+        dataset.save_to_disk(tmp_path)
+        with open(os.path.join(tmp_path, _METADATA_FILE), "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        if overwrite and os.path.exists(path):
+            # Moved aside rather than deleted in place, so concurrent readers never see a partial entry.
+            old_path = tempfile.mkdtemp(dir=cache_dir, prefix=f".{key}.old.")
+            try:
+                os.replace(path, old_path)
+            except FileNotFoundError:
+                pass
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process wrote the same entry first. Entries are keyed by their content, so it is kept.
+            if not os.path.exists(os.path.join(path, _METADATA_FILE)):
+                raise
+    finally:
+        for leftover in [tmp_path, old_path]:
+            if leftover is not None and os.path.exists(leftover):
+                shutil.rmtree(leftover)
+
+
+def load_cached_labels(cache_dir: Text, key: Text) -> Optional[List[Any]]:
+    path = os.path.join(cache_dir, f"{key}.labels.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_cached_labels(cache_dir: Text, key: Text, label_list: List[Any]) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=f".{key}.labels.")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(label_list, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(cache_dir, f"{key}.labels.json"))
@@ -1,6 +1,5 @@
 import os
 import numpy as np
-from google.cloud import storage
 
 
 def sigmoid(_outputs):
@@ -19,7 +18,7 @@ def makerdir(path: str, exist_ok=True):
 
 
 def pull_from_gcs(source: str, destination: str):
-    client = storage.Client(project="momovn-dev-us")
-    bucket = client.bucket("momovn-models-dev")
-    blob = bucket.blob(source)
-    blob.download_to_filename(destination)
+    from utils.artifact_store import GCSArtifactStore
+
+    with open(destination, "wb") as f:
+        GCSArtifactStore().download(source, f)
@@ -1,5 +1,8 @@
 import importlib
-from typing import Optional, Union, List, Text, Any
+from collections import Counter
+from typing import Optional, Union, List, Text, Any, Dict, Tuple
+
+import numpy as np
 
 from sklearn.metrics import (
     f1_score,
@@ -14,8 +17,10 @@ from seqeval.metrics import (
     classification_report as entity_classification_report,
     accuracy_score as entity_accuracy_score
 )
+from seqeval.metrics.sequence_labeling import get_entities
 
 
+# `fast_seqeval` needs the label names of the model, only `TokenClassifier` computes it.
 SUPPORTED_METRICS = ["accuracy", "f1", "recall", "precision", "mse", "roc_auc", "seqeval"]
 
 
@@ -196,3 +201,444 @@ def mse(
         references, predictions, sample_weight=sample_weight, multioutput=multioutput, squared=squared
         )
     }
+
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray, zero_division: Union[Text, int] = "warn"):
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    fill_value = 0.0 if zero_division == "warn" else float(zero_division)
+    result = np.full(np.broadcast(numerator, denominator).shape, fill_value)
+    np.divide(numerator, denominator, out=result, where=denominator != 0)
+    return result
+
+
+# Accumulators keep sufficient statistics updated batch by batch,
+# so that evaluation never has to hold every prediction in memory.
+class MetricAccumulator:
+    def update(self, predictions, references) -> None:
+        raise NotImplementedError("Hasn't implemented yet!")
+
+    def compute(self, **kwargs) -> Dict[Text, Any]:
+        raise NotImplementedError("Hasn't implemented yet!")
+
+
+def _check_unweighted(sample_weight: Optional[List[int]]) -> None:
+    # Weights are given per example of the whole dataset, they can't be matched with the batches seen by `update`.
+    if sample_weight is not None:
+        raise ValueError("Streaming metrics don't support `sample_weight`, compute them on the full arrays instead.")
+
+
+class ConfusionMatrixAccumulator(MetricAccumulator):
+    def __init__(self, num_labels: int, metric: Text = "accuracy"):
+        if metric not in ["accuracy", "f1", "recall", "precision"]:
+            raise ValueError(f"`{metric}` can't be computed from a confusion matrix.")
+        self.num_labels = num_labels
+        self.metric = metric
+        self.confusion_matrix = np.zeros((num_labels, num_labels), dtype=np.int64)
+
+    def update(self, predictions, references) -> None:
+        predictions = np.asarray(predictions).reshape(-1)
+        references = np.asarray(references).reshape(-1)
+        # Examples without a label, e.g. `-1` in an unlabeled test set, aren't scored.
+        labeled = references >= 0
+        predictions, references = predictions[labeled], references[labeled]
+        self.confusion_matrix += np.bincount(
+            references * self.num_labels + predictions, minlength=self.num_labels ** 2
+        ).reshape(self.num_labels, self.num_labels)
+
+    def compute(
+            self,
+            labels: Optional[List[int]] = None,
+            pos_label: int = 1,
+            average: Optional[Text] = None,
+            normalize: bool = True,
+            zero_division: Union[Text, int] = "warn",
+            sample_weight: Optional[List[int]] = None,
+            **kwargs
+    ) -> Dict[Text, Any]:
+        _check_unweighted(sample_weight)
+        true_positives = np.diag(self.confusion_matrix)
+        if self.metric == "accuracy":
+            score = true_positives.sum()
+            if normalize:
+                score = score / max(self.confusion_matrix.sum(), 1)
+            return {"accuracy": float(score)}
+
+        num_predicted = self.confusion_matrix.sum(axis=0)
+        num_true = self.confusion_matrix.sum(axis=1)
+        if average == "binary":
+            labels = [pos_label]
+        elif labels is None:
+            # Like sklearn, only the labels seen in either the references or the predictions are scored.
+            labels = np.flatnonzero(num_predicted + num_true)
+        labels = np.asarray(labels, dtype=np.int64)
+        true_positives, num_predicted, num_true = true_positives[labels], num_predicted[labels], num_true[labels]
+        if average == "micro":
+            true_positives, num_predicted, num_true = true_positives.sum(), num_predicted.sum(), num_true.sum()
+
+        if self.metric == "precision":
+            score = _safe_divide(true_positives, num_predicted, zero_division)
+        elif self.metric == "recall":
+            score = _safe_divide(true_positives, num_true, zero_division)
+        else:
+            score = _safe_divide(2 * true_positives, num_predicted + num_true, zero_division)
+
+        if average == "macro":
+            score = score.mean()
+        elif average == "weighted":
+            score = np.average(score, weights=num_true) if num_true.sum() > 0 else np.float64(0.0)
+        elif average not in [None, "micro", "binary"]:
+            raise ValueError(f"Unsupported `average` for streaming metrics: {average}")
+        score = np.asarray(score)
+        return {self.metric: score.item() if score.size == 1 else score.tolist()}
+
+
+class MseAccumulator(MetricAccumulator):
+    def __init__(self):
+        self.squared_errors = None
+        self.count = 0
+
+    def update(self, predictions, references) -> None:
+        predictions = np.asarray(predictions, dtype=np.float64)
+        references = np.asarray(references, dtype=np.float64)
+        errors = predictions.reshape(len(predictions), -1) - references.reshape(len(references), -1)
+        squared_errors = (errors ** 2).sum(axis=0)
+        self.squared_errors = squared_errors if self.squared_errors is None else self.squared_errors + squared_errors
+        self.count += len(predictions)
+
+    def compute(
+            self,
+            multioutput: Text = "uniform_average",
+            squared: bool = True,
+            sample_weight: Optional[List[int]] = None,
+            **kwargs
+    ) -> Dict[Text, Any]:
+        _check_unweighted(sample_weight)
+        score = self.squared_errors / max(self.count, 1)
+        if not squared:
+            score = np.sqrt(score)
+        if multioutput == "uniform_average":
+            return {"mse": float(score.mean())}
+        return {"mse": score}
+
+
+# Counts entity spans per type like `seqeval` does in its default (non-strict) mode.
+class SeqevalAccumulator(MetricAccumulator):
+    def __init__(self, suffix: bool = False):
+        self.suffix = suffix
+        self.true_positives = Counter()
+        self.num_predicted = Counter()
+        self.num_true = Counter()
+        self.num_correct_tokens = 0
+        self.num_tokens = 0
+
+    def update(self, predictions: List[List[Text]], references: List[List[Text]]) -> None:
+        for prediction, reference in zip(predictions, references):
+            pred_entities = set(get_entities(prediction, suffix=self.suffix))
+            true_entities = set(get_entities(reference, suffix=self.suffix))
+            self.num_predicted.update(entity[0] for entity in pred_entities)
+            self.num_true.update(entity[0] for entity in true_entities)
+            self.true_positives.update(entity[0] for entity in pred_entities & true_entities)
+            self.num_correct_tokens += sum(p == r for p, r in zip(prediction, reference))
+            self.num_tokens += len(reference)
+
+    def compute(
+            self,
+            zero_division: Union[Text, int] = "warn",
+            sample_weight: Optional[List[int]] = None,
+            **kwargs
+    ) -> Dict[Text, Any]:
+        _check_unweighted(sample_weight)
+        return _entity_scores(
+            self.true_positives,
+            self.num_predicted,
+            self.num_true,
+            self.num_correct_tokens,
+            self.num_tokens,
+            zero_division=zero_division,
+        )
+
+
+def _entity_scores(
+        true_positives: Dict[Text, int],
+        num_predicted: Dict[Text, int],
+        num_true: Dict[Text, int],
+        num_correct_tokens: int,
+        num_tokens: int,
+        zero_division: Union[Text, int] = "warn",
+) -> Dict[Text, Any]:
+    scores = {}
+    for type_name in sorted(set(num_true) | set(num_predicted)):
+        type_true_positives = true_positives.get(type_name, 0)
+        precision = float(_safe_divide(type_true_positives, num_predicted.get(type_name, 0), zero_division))
+        recall = float(_safe_divide(type_true_positives, num_true.get(type_name, 0), zero_division))
+        scores[type_name] = {
+            "precision": precision,
+            "recall": recall,
+            "f1": float(_safe_divide(2 * precision * recall, precision + recall, zero_division)),
+            "number": num_true.get(type_name, 0),
+        }
+    total_true_positives = sum(true_positives.values())
+    precision = float(_safe_divide(total_true_positives, sum(num_predicted.values()), zero_division))
+    recall = float(_safe_divide(total_true_positives, sum(num_true.values()), zero_division))
+    scores["overall_precision"] = precision
+    scores["overall_recall"] = recall
+    scores["overall_f1"] = float(_safe_divide(2 * precision * recall, precision + recall, zero_division))
+    scores["overall_accuracy"] = num_correct_tokens / max(num_tokens, 1)
+    return scores
+
+
+# Native span engine working on integer tag ids. Tag strings are parsed once per label into lookup tables
+# indexed by (previous tag id, current tag id), so sequences are never parsed in Python.
+# Prefix patterns of the strict schemes, as `(previous prefixes, current prefixes, type condition)`,
+# following `seqeval.scheme`. "*" matches any prefix.
+_ENTITY_SCHEMES = {
+    "IOB1": {
+        "allowed": "IOB",
+        "start": [("O", "I", "any"), ("I", "I", "diff"), ("B", "I", "any"), ("I", "B", "same"), ("B", "B", "same")],
+        "inside": [("B", "I", "same"), ("I", "I", "same")],
+        "end": [("I", "I", "diff"), ("I", "O", "any"), ("I", "B", "any"), ("B", "O", "any"), ("B", "I", "diff"),
+                ("B", "B", "same")],
+    },
+    "IOE1": {
+        "allowed": "IOE",
+        "start": [("O", "I", "any"), ("I", "I", "diff"), ("E", "I", "any"), ("E", "E", "same")],
+        "inside": [("I", "I", "same"), ("I", "E", "same")],
+        "end": [("I", "I", "diff"), ("I", "O", "any"), ("I", "E", "diff"), ("E", "I", "same"), ("E", "E", "same")],
+    },
+    "IOB2": {
+        "allowed": "IOB",
+        "start": [("*", "B", "any")],
+        "inside": [("B", "I", "same"), ("I", "I", "same")],
+        "end": [("I", "O", "any"), ("I", "I", "diff"), ("I", "B", "any"), ("B", "O", "any"), ("B", "I", "diff"),
+                ("B", "B", "any")],
+    },
+    "IOE2": {
+        "allowed": "IOE",
+        "start": [("O", "I", "any"), ("O", "E", "any"), ("E", "I", "any"), ("E", "E", "any"), ("I", "I", "diff"),
+                  ("I", "E", "diff")],
+        "inside": [("I", "E", "same"), ("I", "I", "same")],
+        "end": [("E", "O", "any"), ("E", "I", "any"), ("E", "E", "any")],
+    },
+    "IOBES": {
+        "allowed": "IOBES",
+        "start": [("*", "B", "any"), ("*", "S", "any")],
+        "inside": [("B", "I", "same"), ("B", "E", "same"), ("I", "I", "same"), ("I", "E", "same")],
+        "end": [("S", "*", "any"), ("E", "*", "any")],
+    },
+    "BILOU": {
+        "allowed": "BILOU",
+        "start": [("*", "B", "any"), ("*", "U", "any")],
+        "inside": [("B", "I", "same"), ("B", "L", "same"), ("I", "I", "same"), ("I", "L", "same")],
+        "end": [("U", "*", "any"), ("L", "*", "any")],
+    },
+}
+
+
+def _parse_tag(tag: Text, suffix: bool = False, strict: bool = False) -> Tuple[Text, Text]:
+    if strict:
+        # `seqeval.scheme.Token`
+        prefix = tag[-1] if suffix else tag[0]
+        type_name = (tag[:-1] if suffix else tag[1:]).strip("-") or "_"
+    elif suffix:
+        # `seqeval.metrics.sequence_labeling.get_entities`
+        prefix, type_name = tag[-1], tag[:-1].rsplit("-", maxsplit=1)[0] or "_"
+    else:
+        prefix, type_name = tag[0], tag[1:].split("-", maxsplit=1)[-1] or "_"
+    return prefix, type_name
+
+
+def _is_chunk_end(prev_prefix: Text, prefix: Text, prev_type: Text, type_name: Text) -> bool:
+    return (
+        prev_prefix in ("E", "S")
+        or (prev_prefix in ("B", "I") and prefix in ("B", "S", "O"))
+        or (prev_prefix not in ("O", ".") and prev_type != type_name)
+    )
+
+
+def _is_chunk_start(prev_prefix: Text, prefix: Text, prev_type: Text, type_name: Text) -> bool:
+    return (
+        prefix in ("B", "S")
+        or (prev_prefix in ("E", "S", "O") and prefix in ("E", "I"))
+        or (prefix not in ("O", ".") and prev_type != type_name)
+    )
+
+
+def _matches(patterns, prev_prefix: Text, prefix: Text, prev_type: Text, type_name: Text) -> bool:
+    for prev_pattern, pattern, condition in patterns:
+        if prev_pattern != "*" and prev_prefix != prev_pattern:
+            continue
+        if pattern != "*" and prefix != pattern:
+            continue
+        if condition == "any" or (condition == "same") == (prev_type == type_name):
+            return True
+    return False
+
+
+def _pad_sequences(sequences, padding_value: int = -100) -> np.ndarray:
+    if isinstance(sequences, np.ndarray):
+        return sequences
+    max_length = max((len(sequence) for sequence in sequences), default=0)
+    padded = np.full((len(sequences), max_length), padding_value, dtype=np.int64)
+    for i, sequence in enumerate(sequences):
+        padded[i, :len(sequence)] = sequence
+    return padded
+
+
+class EntitySpanEngine:
+    def __init__(
+            self,
+            label_names: List[Text],
+            suffix: bool = False,
+            scheme: Optional[Text] = None,
+            mode: Optional[Text] = None,
+    ):
+        # Like `seqeval`, the scheme is only enforced in strict mode.
+        self.strict = mode == "strict"
+        if self.strict and scheme not in _ENTITY_SCHEMES:
+            raise ValueError(f"Strict mode needs a scheme, one of {list(_ENTITY_SCHEMES)}, got {scheme}")
+        num_labels = len(label_names)
+        # Two extra codes: the "O" separating sequences, and the start of the data ("O" with an empty type in the
+        # non-strict mode of `seqeval`, the same "O" token in strict mode).
+        self.separator, self.begin = num_labels, num_labels + 1
+        prefixes, type_names = [], []
+        for name in label_names:
+            prefix, type_name = _parse_tag(str(name), suffix=suffix, strict=self.strict)
+            prefixes.append(prefix)
+            type_names.append(type_name)
+        prefixes += ["O", "O"]
+        type_names += ["_", "_" if self.strict else ""]
+        self.type_names = sorted(set(type_names))
+        self.type_ids = np.array([self.type_names.index(type_name) for type_name in type_names], dtype=np.int64)
+        if self.strict:
+            self.allowed = np.array([prefix in _ENTITY_SCHEMES[scheme]["allowed"] for prefix in prefixes])
+            tables = {key: _ENTITY_SCHEMES[scheme][key] for key in ["start", "inside", "end"]}
+        else:
+            self.allowed = np.ones(len(prefixes), dtype=bool)
+            tables = {"start": _is_chunk_start, "end": _is_chunk_end}
+        self.label_names = list(label_names)
+        # Labels with the same name are the same tag for token accuracy.
+        self.canonical_ids = np.array(
+            [self.label_names.index(name) for name in self.label_names] + [self.separator, self.begin], dtype=np.int64
+        )
+
+        size = len(prefixes)
+        for key, rule in tables.items():
+            table = np.zeros((size, size), dtype=bool)
+            for prev in range(size):
+                for cur in range(size):
+                    args = (prefixes[prev], prefixes[cur], type_names[prev], type_names[cur])
+                    table[prev, cur] = rule(*args) if callable(rule) else _matches(rule, *args)
+            setattr(self, f"{key}_table", table)
+
+    def _flatten(self, ids: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        # Layout of `seqeval`: begin, sequence 1, "O", sequence 2, "O", ..., sequence N, "O".
+        lengths = mask.sum(axis=1)
+        offsets = 1 + np.concatenate([[0], np.cumsum(lengths + 1)[:-1]])
+        codes = np.full(1 + int(lengths.sum()) + len(lengths), self.separator, dtype=np.int64)
+        codes[0] = self.separator if self.strict else self.begin
+        positions = offsets[:, None] + np.cumsum(mask, axis=1) - 1
+        codes[positions[mask]] = ids[mask]
+        return codes
+
+    def _entities(self, codes: np.ndarray) -> np.ndarray:
+        if not self.allowed[codes].all():
+            invalid = [self.label_names[code] for code in np.unique(codes[~self.allowed[codes]])]
+            raise ValueError(f"Invalid tokens are found for the scheme: {invalid}")
+        prev, cur = codes[:-1], codes[1:]
+        positions = np.arange(1, len(codes))
+        starts = self.start_table[prev, cur]
+        ends = self.end_table[prev, cur]
+        if not self.strict:
+            # A chunk ending at position `i` covers [last start before `i`, i - 1].
+            last_start = np.maximum.accumulate(np.where(starts, positions, 1))
+            end_positions = positions[ends]
+            begin_positions = np.concatenate([[1], last_start])[end_positions - 1]
+            return np.stack([self.type_ids[codes[end_positions - 1]], begin_positions, end_positions - 1], axis=1)
+
+        # In strict mode an entity starts at a start pattern, extends while tokens are inside it and is only kept
+        # if the first token after it closes it. Tokens inside an entity are never checked for a new start.
+        inside = np.concatenate([[False], self.inside_table[prev, cur]])
+        is_end = np.concatenate([[False], ends])
+        breaks = np.where(inside, len(codes), np.arange(len(codes)))
+        next_break = np.minimum.accumulate(breaks[::-1])[::-1]
+        entities = []
+        position = 0
+        for start in positions[starts].tolist():
+            if start < position:
+                continue
+            end = int(next_break[start + 1])
+            if is_end[end]:
+                entities.append((self.type_ids[codes[start]], start, end))
+            position = end
+        return np.array(entities, dtype=np.int64).reshape(-1, 3)
+
+    def count(self, predictions, references) -> Dict[Text, Any]:
+        predictions = _pad_sequences(predictions)
+        references = _pad_sequences(references)
+        mask = references != -100
+        pred_entities = self._entities(self._flatten(predictions, mask))
+        true_entities = self._entities(self._flatten(references, mask))
+        # Entities never overlap within one side, so an entity found twice is in both.
+        entities, counts = np.unique(np.concatenate([pred_entities, true_entities]), axis=0, return_counts=True)
+        num_types = len(self.type_names)
+        return {
+            "true_positives": np.bincount(entities[counts == 2, 0], minlength=num_types),
+            "num_predicted": np.bincount(pred_entities[:, 0], minlength=num_types),
+            "num_true": np.bincount(true_entities[:, 0], minlength=num_types),
+            "num_correct_tokens": int(
+                (self.canonical_ids[predictions[mask]] == self.canonical_ids[references[mask]]).sum()
+            ),
+            "num_tokens": int(mask.sum()),
+        }
+
+    def scores(self, counts: Dict[Text, Any], zero_division: Union[Text, int] = "warn") -> Dict[Text, Any]:
+        def by_type(values: np.ndarray) -> Dict[Text, int]:
+            return {self.type_names[i]: int(value) for i, value in enumerate(values) if value > 0}
+
+        return _entity_scores(
+            by_type(counts["true_positives"]),
+            by_type(counts["num_predicted"]),
+            by_type(counts["num_true"]),
+            counts["num_correct_tokens"],
+            counts["num_tokens"],
+            zero_division=zero_division,
+        )
+
+
+def fast_seqeval(
+        predictions,
+        references,
+        label_names: List[Text],
+        suffix: bool = False,
+        scheme: Optional[Text] = None,
+        mode: Optional[Text] = None,
+        zero_division: Union[Text, int] = "warn",
+        **kwargs
+):
+    # `predictions` and `references` are tag ids of shape [N, seq_len] (or lists of id sequences),
+    # positions where `references` is -100 are ignored. Scores match `seqeval`.
+    engine = EntitySpanEngine(label_names, suffix=suffix, scheme=scheme, mode=mode)
+    return engine.scores(engine.count(predictions, references), zero_division=zero_division)
+
+
+class FastSeqevalAccumulator(MetricAccumulator):
+    def __init__(
+            self,
+            label_names: List[Text],
+            suffix: bool = False,
+            scheme: Optional[Text] = None,
+            mode: Optional[Text] = None,
+    ):
+        self.engine = EntitySpanEngine(label_names, suffix=suffix, scheme=scheme, mode=mode)
+        self.counts = None
+
+    def update(self, predictions, references) -> None:
+        counts = self.engine.count(predictions, references)
+        if self.counts is None:
+            self.counts = counts
+        else:
+            self.counts = {key: self.counts[key] + value for key, value in counts.items()}
+
+    def compute(self, zero_division: Union[Text, int] = "warn", **kwargs) -> Dict[Text, Any]:
+        return self.engine.scores(self.counts, zero_division=zero_division)
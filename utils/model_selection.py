@@ -3,7 +3,7 @@ import logging
 import sys
 
 from pick import pick
-from utils.helpers import pull_from_gcs, makerdir
+from utils.artifact_store import get_artifact_store, fetch_artifacts
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -62,12 +62,12 @@ def select_model_suggestion():
     else:
         logger.info("Using models from our GCS bucket")
         saved_model_path = os.path.join(TEMP_DIR, option)
-        if os.path.exists(saved_model_path):
-            return saved_model_path, None
-        makerdir(saved_model_path)
-        logger.info(f"Start downloading {option} model weights from GCS...")
-        for filename in MOBERTA_DOWNLOAD_LINKS[option]['files']:
-            pull_from_gcs(os.path.join(MOBERTA_DOWNLOAD_LINKS[option]["bucket"], filename),
-                          os.path.join(saved_model_path, filename))
-        logger.info(f"Downloading successfully. The model is saved at {saved_model_path}")
+        logger.info(f"Fetching {option} model weights from GCS...")
+        fetch_artifacts(
+            get_artifact_store(),
+            MOBERTA_DOWNLOAD_LINKS[option]["bucket"],
+            MOBERTA_DOWNLOAD_LINKS[option]["files"],
+            saved_model_path,
+        )
+        logger.info(f"The model is saved at {saved_model_path}")
         return saved_model_path, None
@@ -0,0 +1,75 @@
+import os
+from typing import Text, Optional, Dict, Any
+
+import torch
+
+ONNX_MODEL_NAME = "model.onnx"
+_DYNAMIC_AXES = {0: "batch", 1: "sequence"}
+
+
+class LogitsOnly(torch.nn.Module):
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids=None):
+        if token_type_ids is None:
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids).logits
+
+
+def export_onnx(model, tokenizer, output_dir: Text, opset: int = 14) -> Text:
+    os.makedirs(output_dir, exist_ok=True)
+    model = model.to("cpu").eval()
+    # Two sequences of different lengths, so that the exported graph can't specialize on a shape.
+    dummy_inputs = tokenizer(["Hello world", "Hello"], padding=True, return_tensors="pt")
+    input_names = [name for name in ["input_ids", "attention_mask", "token_type_ids"] if name in dummy_inputs]
+    with torch.no_grad():
+        logits = model(**dummy_inputs).logits
+    dynamic_axes = {name: _DYNAMIC_AXES for name in input_names}
+    # Sentence classification returns [batch, num_labels], token classification [batch, sequence, num_labels].
+    dynamic_axes["logits"] = _DYNAMIC_AXES if logits.dim() == 3 else {0: "batch"}
+    path = os.path.join(output_dir, ONNX_MODEL_NAME)
+    torch.onnx.export(
+        LogitsOnly(model),
+        tuple(dummy_inputs[name] for name in input_names),
+        path,
+        input_names=input_names,
+        output_names=["logits"],
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+    )
+    model.config.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    return path
+
+
+class OnnxRuntimeModel:
+    # Stands in for a `PreTrainedModel` at inference time, so tokenization and postprocessing stay unchanged.
+    def __init__(self, model_dir: Text, config, num_threads: Optional[int] = None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, ONNX_MODEL_NAME),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        self.config = config
+
+    def __call__(self, **inputs: torch.Tensor) -> Dict[Text, Any]:
+        feeds = {name: inputs[name].cpu().numpy() for name in self.input_names}
+        logits = self.session.run(["logits"], feeds)[0]
+        return {"logits": torch.from_numpy(logits)}
+
+    def to(self, device: Text) -> "OnnxRuntimeModel":
+        if torch.device(device).type != "cpu":
+            raise ValueError("The onnxruntime backend only runs on CPU.")
+        return self
+
+    def eval(self) -> "OnnxRuntimeModel":
+        return self
@@ -0,0 +1,46 @@
+import collections
+import threading
+from typing import Text, Callable, Dict, Any, Tuple
+
+
+class ModelRegistry:
+    # Process-wide cache of loaded configs, tokenizers and models, keyed by everything that changes what is loaded.
+    # Entries are shared between instances, so they must only be used for inference.
+    def __init__(self):
+        self._entries: Dict[Tuple, Any] = {}
+        self._key_locks: Dict[Tuple, threading.Lock] = collections.defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key: Tuple, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                return self._entries[key]
+            key_lock = self._key_locks[key]
+        # Loading happens outside the registry lock, so that different models load concurrently
+        # while two threads asking for the same one only load it once.
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    self.hits += 1
+                    return self._entries[key]
+            value = loader()
+            with self._lock:
+                self._entries[key] = value
+                self.misses += 1
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._key_locks.clear()
+
+    def stats(self) -> Dict[Text, Any]:
+        with self._lock:
+            kinds = collections.Counter(key[0] for key in self._entries)
+            return {"hits": self.hits, "misses": self.misses, **{f"num_{kind}s": n for kind, n in kinds.items()}}
+
+
+model_registry = ModelRegistry()
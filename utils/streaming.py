@@ -0,0 +1,148 @@
+import csv
+import itertools
+import json
+import os
+from typing import Text, Iterable, Iterator, List, Dict, Any
+
+SUPPORTED_INPUT_FORMATS = ["csv", "json", "jsonl", "parquet"]
+SUPPORTED_OUTPUT_FORMATS = ["jsonl", "parquet"]
+
+
+def get_extension(path: Text) -> Text:
+    return path.split(".")[-1].lower()
+
+
+def chunked(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_csv(path: Text) -> Iterator[Dict[Text, Any]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+def _iter_jsonl(path: Text) -> Iterator[Dict[Text, Any]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _iter_parquet(path: Text, batch_size: int, offset: int) -> Iterator[Dict[Text, Any]]:
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path)
+    # Skip whole row groups without decoding them.
+    row_groups = []
+    for i in range(parquet_file.num_row_groups):
+        num_rows = parquet_file.metadata.row_group(i).num_rows
+        if offset >= num_rows:
+            offset -= num_rows
+        else:
+            row_groups.append(i)
+    if not row_groups:
+        return
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=row_groups):
+        if offset >= record_batch.num_rows:
+            offset -= record_batch.num_rows
+            continue
+        yield from record_batch.slice(offset).to_pylist()
+        offset = 0
+
+
+def iter_records(path: Text, offset: int = 0, batch_size: int = 1024) -> Iterator[Dict[Text, Any]]:
+    extension = get_extension(path)
+    if extension == "csv":
+        return itertools.islice(_iter_csv(path), offset, None)
+    elif extension in ["json", "jsonl"]:
+        return itertools.islice(_iter_jsonl(path), offset, None)
+    elif extension == "parquet":
+        return _iter_parquet(path, batch_size=batch_size, offset=offset)
+    raise ValueError(f"`{path}` should be one of {SUPPORTED_INPUT_FORMATS} files.")
+
+
+def count_complete_lines(path: Text) -> int:
+    # Rows of a jsonl output file written before an interruption. A crash can leave a partial last line, it is
+    # truncated so that appended rows start on a new line.
+    if not os.path.exists(path):
+        return 0
+    if get_extension(path) not in ["json", "jsonl"]:
+        raise ValueError("Resuming is only supported for jsonl output files.")
+    num_lines = 0
+    end = 0
+    with open(path, "rb+") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                json.loads(line)
+            except ValueError:
+                break
+            num_lines += 1
+            end += len(line)
+        f.truncate(end)
+    return num_lines
+
+
+def to_serializable(obj: Any) -> Any:
+    # Numpy scalars and arrays coming out of `postprocess_output`.
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class JsonlWriter:
+    def __init__(self, path: Text, append: bool = False):
+        self.file = open(path, "a" if append else "w", encoding="utf-8")
+
+    def write(self, records: List[Dict[Text, Any]]) -> None:
+        for record in records:
+            self.file.write(json.dumps(record, ensure_ascii=False, default=to_serializable) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetWriter:
+    def __init__(self, path: Text):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        # Predictions are nested and their shape depends on `top_k`, so they are stored as JSON strings.
+        self.schema = pa.schema([("index", pa.int64()), ("prediction", pa.string())])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, records: List[Dict[Text, Any]]) -> None:
+        table = self._pa.Table.from_pydict(
+            {
+                "index": [record["index"] for record in records],
+                "prediction": [
+                    json.dumps(record["prediction"], ensure_ascii=False, default=to_serializable)
+                    for record in records
+                ],
+            },
+            schema=self.schema,
+        )
+        self.writer.write_table(table)
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def get_writer(path: Text, append: bool = False):
+    extension = get_extension(path)
+    if extension in ["json", "jsonl"]:
+        return JsonlWriter(path, append=append)
+    elif extension == "parquet":
+        if append:
+            raise ValueError("Resuming is only supported for jsonl output files.")
+        return ParquetWriter(path)
+    raise ValueError(f"`{path}` should be one of {SUPPORTED_OUTPUT_FORMATS} files.")
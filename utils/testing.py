@@ -0,0 +1,147 @@
+import os
+from typing import Text, Optional, List
+
+from utils.helpers import makerdir
+
+_SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+
+
+def synthetic_vocab(size: int = 1000) -> List[Text]:
+    return [f"w{i}" for i in range(size)]
+
+
+def build_tiny_model(
+        output_dir: Text,
+        task_name: Text = "sentence-classification",
+        labels: Optional[List[Text]] = None,
+        vocab_size: int = 1000,
+        hidden_size: int = 32,
+        num_hidden_layers: int = 2,
+        num_attention_heads: int = 2,
+        max_position_embeddings: int = 512,
+        seed: int = 42,
+) -> Text:
+    # Builds a randomly initialized BERT and a WordPiece tokenizer over `synthetic_vocab` without network access,
+    # so that serving, benchmarks and examples can run locally.
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, processors
+    from transformers import (
+        BertConfig,
+        BertForSequenceClassification,
+        BertForTokenClassification,
+        PreTrainedTokenizerFast,
+    )
+
+    if labels is None:
+        labels = ["negative", "positive"] if task_name == "sentence-classification" else ["O", "B-ENT", "I-ENT"]
+    makerdir(output_dir)
+
+    vocab = {token: i for i, token in enumerate(_SPECIAL_TOKENS + synthetic_vocab(vocab_size))}
+    tokenizer = Tokenizer(models.WordPiece(vocab, unk_token="[UNK]", continuing_subword_prefix="##"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.decoder = decoders.WordPiece(prefix="##")
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]",
+        pair="[CLS] $A [SEP] $B:1 [SEP]:1",
+        special_tokens=[("[CLS]", vocab["[CLS]"]), ("[SEP]", vocab["[SEP]"])],
+    )
+    PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        model_max_length=max_position_embeddings,
+        pad_token="[PAD]",
+        unk_token="[UNK]",
+        cls_token="[CLS]",
+        sep_token="[SEP]",
+        mask_token="[MASK]",
+    ).save_pretrained(output_dir)
+
+    config = BertConfig(
+        vocab_size=len(vocab),
+        hidden_size=hidden_size,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=num_attention_heads,
+        intermediate_size=hidden_size * 4,
+        max_position_embeddings=max_position_embeddings,
+        num_labels=len(labels),
+        id2label={i: label for i, label in enumerate(labels)},
+        label2id={label: i for i, label in enumerate(labels)},
+    )
+    torch.manual_seed(seed)
+    if task_name == "sentence-classification":
+        model = BertForSequenceClassification(config)
+    elif task_name == "token-classification":
+        model = BertForTokenClassification(config)
+    else:
+        raise ValueError("Currently we only support `sentence-classification` and `token-classification`")
+    model.save_pretrained(output_dir)
+    return os.path.abspath(output_dir)
+
+
+def synthetic_lengths(
+        num_examples: int,
+        min_words: int = 5,
+        max_words: int = 60,
+        distribution: Text = "uniform",
+        seed: int = 42,
+) -> List[int]:
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    if distribution == "uniform":
+        lengths = rng.integers(min_words, max_words + 1, size=num_examples)
+    elif distribution == "lognormal":
+        # Mostly short texts with a long tail, like real user inputs.
+        lengths = rng.lognormal(np.log((min_words + max_words) / 4), 0.6, size=num_examples).astype(int)
+    else:
+        raise ValueError(f"`distribution` must be `uniform` or `lognormal`, got {distribution}.")
+    return np.clip(lengths, min_words, max_words).tolist()
+
+
+def write_synthetic_dataset(
+        path: Text,
+        task_name: Text = "sentence-classification",
+        num_examples: int = 1000,
+        labels: Optional[List[Text]] = None,
+        min_words: int = 5,
+        max_words: int = 60,
+        distribution: Text = "uniform",
+        vocab_size: int = 1000,
+        seed: int = 42,
+) -> Text:
+    # Writes random texts over `synthetic_vocab` as a csv (sentence classification) or json lines file, in the formats
+    # read by `train` and `evaluate`. Sentence labels are written as ids, token labels as tag names.
+    import csv
+    import json
+    import random
+
+    if labels is None:
+        labels = ["negative", "positive"] if task_name == "sentence-classification" else ["O", "B-ENT", "I-ENT"]
+    rng = random.Random(seed)
+    vocab = synthetic_vocab(vocab_size)
+    lengths = synthetic_lengths(num_examples, min_words, max_words, distribution, seed)
+    if task_name == "sentence-classification":
+        records = [
+            {"input": " ".join(rng.choices(vocab, k=length)), "label": rng.randrange(len(labels))}
+            for length in lengths
+        ]
+    elif task_name == "token-classification":
+        records = [
+            {"input": rng.choices(vocab, k=length), "label": rng.choices(labels, k=length)} for length in lengths
+        ]
+    else:
+        raise ValueError("Currently we only support `sentence-classification` and `token-classification`")
+    makerdir(os.path.dirname(os.path.abspath(path)))
+    if path.endswith(".csv"):
+        if task_name == "token-classification":
+            raise ValueError("Token classification datasets must be written as json lines.")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["input", "label"])
+            writer.writeheader()
+            writer.writerows(records)
+    elif path.endswith(".json"):
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    else:
+        raise ValueError("`path` must be a csv or a json file.")
+    return os.path.abspath(path)
@@ -0,0 +1,142 @@
+import bisect
+import contextlib
+import threading
+import time
+from typing import Text, Optional, List, Dict, Any, Iterator, Tuple
+
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+TOKEN_BUCKETS = [16, 64, 256, 1024, 4096, 16384, 65536]
+RATIO_BUCKETS = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+# Returned by `BaseModel._trace` when tracing is disabled, so a disabled stage costs one attribute check.
+NO_TRACE = contextlib.nullcontext()
+# Only these stages launch CUDA work, the others run on the host and don't need a synchronization.
+CUDA_STAGES = ("host_to_device", "model")
+
+
+class Histogram:
+    def __init__(self, buckets: List[float]):
+        self.buckets = sorted(buckets)
+        # The last count is the `+Inf` bucket.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        # Upper bound of the bucket holding the q-th quantile, like Prometheus' `histogram_quantile`, not interpolated.
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self) -> Dict[Text, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets + ["+Inf"], self.counts)},
+        }
+
+
+def _format_labels(labels: Dict[Text, Any]) -> Text:
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+
+class LatencyTracer:
+    # Per-stage wall time of the inference path, with the size and padding of every batch that went through it.
+    def __init__(self, cuda_sync: bool = False):
+        # CUDA kernels run asynchronously, synchronizing at the end of the stages that launch them attributes their
+        # time correctly.
+        self.cuda_sync = cuda_sync
+        self.stage_seconds: Dict[Text, Histogram] = {}
+        self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+        self.num_tokens = Histogram(TOKEN_BUCKETS)
+        self.padding_ratio = Histogram(RATIO_BUCKETS)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: Text) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.cuda_sync and name in CUDA_STAGES:
+                import torch
+
+                torch.cuda.synchronize()
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: Text, seconds: float) -> None:
+        with self._lock:
+            if name not in self.stage_seconds:
+                self.stage_seconds[name] = Histogram(LATENCY_BUCKETS)
+            self.stage_seconds[name].observe(seconds)
+
+    def observe_batch(self, model_inputs: Dict[Text, Any]) -> None:
+        input_ids = model_inputs.get("input_ids")
+        if input_ids is None:
+            return
+        attention_mask = model_inputs.get("attention_mask")
+        num_slots = input_ids.numel()
+        num_tokens = int(attention_mask.sum()) if attention_mask is not None else num_slots
+        with self._lock:
+            self.batch_size.observe(input_ids.shape[0])
+            self.num_tokens.observe(num_tokens)
+            self.padding_ratio.observe(1 - num_tokens / num_slots if num_slots else 0.0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stage_seconds = {}
+            self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+            self.num_tokens = Histogram(TOKEN_BUCKETS)
+            self.padding_ratio = Histogram(RATIO_BUCKETS)
+
+    def _histograms(self) -> List[Tuple[Text, Text, Dict[Text, Any], Histogram]]:
+        return [
+            *[
+                ("stage_seconds", "Wall time of each inference stage.", {"stage": name}, histogram)
+                for name, histogram in self.stage_seconds.items()
+            ],
+            ("batch_size", "Number of sequences per forward pass.", {}, self.batch_size),
+            ("batch_tokens", "Number of non-padding tokens per forward pass.", {}, self.num_tokens),
+            ("batch_padding_ratio", "Fraction of padding tokens per forward pass.", {}, self.padding_ratio),
+        ]
+
+    def to_dict(self) -> Dict[Text, Any]:
+        with self._lock:
+            return {
+                "stages": {name: histogram.to_dict() for name, histogram in self.stage_seconds.items()},
+                "batch_size": self.batch_size.to_dict(),
+                "batch_tokens": self.num_tokens.to_dict(),
+                "batch_padding_ratio": self.padding_ratio.to_dict(),
+            }
+
+    def to_prometheus(self, prefix: Text = "octopus") -> Text:
+        lines = []
+        described = set()
+        with self._lock:
+            for name, description, labels, histogram in self._histograms():
+                metric = f"{prefix}_{name}"
+                if metric not in described:
+                    described.add(metric)
+                    lines += [f"# HELP {metric} {description}", f"# TYPE {metric} histogram"]
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{{{_format_labels({**labels, 'le': bound})}}} {cumulative}")
+                suffix = f"{{{_format_labels(labels)}}}" if labels else ""
+                lines.append(f"{metric}_sum{suffix} {histogram.sum}")
+                lines.append(f"{metric}_count{suffix} {histogram.count}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,177 @@
+import inspect
+import resource
+import time
+from typing import Text, List, Dict, Any
+
+import torch
+from transformers import TrainerCallback
+
+
+def _peak_memory_mb(device_type: Text) -> float:
+    if device_type == "cuda":
+        return torch.cuda.max_memory_allocated() / (1 << 20)
+    # Linux reports the peak resident set size in KB.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Forward pre-hooks receive keyword arguments, which `Trainer` passes the batch as, since torch 2.0.
+_HOOKS_WITH_KWARGS = "with_kwargs" in inspect.signature(torch.nn.Module.register_forward_pre_hook).parameters
+
+
+class _ForwardWrapper:
+    # Calls `hook(module, args, kwargs)` before each forward pass with torch<2.0, by wrapping the forward method of the
+    # instance. `remove` mirrors a hook handle.
+    def __init__(self, module: torch.nn.Module, hook):
+        self._module = module
+        self._previous = module.__dict__.get("forward")
+        forward = module.forward
+
+        def wrapped(*args, **kwargs):
+            hook(module, args, kwargs)
+            return forward(*args, **kwargs)
+
+        self._wrapped = wrapped
+        module.forward = wrapped
+
+    def remove(self) -> None:
+        # Left in place if the forward method was wrapped again since, the hook ignores calls outside of training.
+        if self._module.__dict__.get("forward") is not self._wrapped:
+            return
+        if self._previous is None:
+            del self._module.forward
+        else:
+            self._module.forward = self._previous
+
+
+def _register_forward_pre_hook(module: torch.nn.Module, hook):
+    if _HOOKS_WITH_KWARGS:
+        return module.register_forward_pre_hook(hook, with_kwargs=True)
+    return _ForwardWrapper(module, hook)
+
+
+class ThroughputCallback(TrainerCallback):
+    # Records tokens/sec, padding, dataloader stalls and peak memory for each logging step of `Trainer.train`.
+    # Token counts come from a forward pre-hook and stay on the device until they are logged, so they don't add syncs.
+    def __init__(self):
+        self.history: List[Dict[Text, Any]] = []
+        self._hook = None
+        self._device_type = "cpu"
+        self._training = False
+        self._reset_window()
+        self._total_real_tokens = 0
+        self._total_tokens = 0
+        self._total_stall_seconds = 0.0
+        self._train_start = None
+        self._train_seconds = None
+
+    def _reset_window(self) -> None:
+        self._window_start = time.perf_counter()
+        self._real_tokens = None
+        self._tokens = 0
+        self._samples = 0
+        self._steps = 0
+        self._stall_seconds = 0.0
+        self._last_step_end = self._window_start
+        self._waiting_for_batch = True
+
+    def _count_tokens(self, module, args, kwargs) -> None:
+        if not self._training:
+            return
+        if self._waiting_for_batch:
+            # The first forward pass of a micro-batch runs once the batch is fetched and on the device, the time since
+            # the previous micro-batch ended was spent waiting for it.
+            self._stall_seconds += time.perf_counter() - self._last_step_end
+            self._waiting_for_batch = False
+        input_ids = kwargs.get("input_ids")
+        if input_ids is None:
+            return
+        attention_mask = kwargs.get("attention_mask")
+        real_tokens = attention_mask.sum() if attention_mask is not None else input_ids.numel()
+        self._real_tokens = real_tokens if self._real_tokens is None else self._real_tokens + real_tokens
+        self._tokens += input_ids.numel()
+        self._samples += input_ids.shape[0]
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        self._device_type = args.device.type
+        if model is not None:
+            self._hook = _register_forward_pre_hook(model, self._count_tokens)
+        if self._device_type == "cuda":
+            torch.cuda.reset_peak_memory_stats()
+        self._train_start = time.perf_counter()
+        self._reset_window()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        # Only called before the first micro-batch of a step with gradient accumulation, stalls are measured by
+        # `_count_tokens` for every micro-batch.
+        self._training = True
+
+    def _end_micro_batch(self) -> None:
+        self._waiting_for_batch = True
+        self._last_step_end = time.perf_counter()
+
+    def on_substep_end(self, args, state, control, **kwargs):
+        self._end_micro_batch()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self._training = False
+        self._steps += 1
+        self._end_micro_batch()
+
+    def _skip_callback_time(self) -> None:
+        # Logging, evaluation and checkpointing run between steps too, they aren't dataloader stalls.
+        self._last_step_end = time.perf_counter()
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        self._skip_callback_time()
+
+    def on_save(self, args, state, control, **kwargs):
+        self._skip_callback_time()
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if self._steps == 0:
+            self._skip_callback_time()
+            return
+        seconds = time.perf_counter() - self._window_start
+        real_tokens = int(self._real_tokens) if self._real_tokens is not None else 0
+        self.history.append({
+            "step": state.global_step,
+            "epoch": state.epoch,
+            "seconds": seconds,
+            "samples_per_second": self._samples / seconds,
+            "tokens_per_second": real_tokens / seconds,
+            "padded_tokens_per_second": self._tokens / seconds,
+            "real_tokens_per_step": real_tokens / self._steps,
+            "padded_tokens_per_step": self._tokens / self._steps,
+            "padding_ratio": 1 - real_tokens / self._tokens if self._tokens else None,
+            "dataloader_stall_seconds": self._stall_seconds,
+            "dataloader_stall_ratio": self._stall_seconds / seconds,
+            "peak_memory_mb": _peak_memory_mb(self._device_type),
+        })
+        self._total_real_tokens += real_tokens
+        self._total_tokens += self._tokens
+        self._total_stall_seconds += self._stall_seconds
+        if self._device_type == "cuda":
+            torch.cuda.reset_peak_memory_stats()
+        self._reset_window()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self._hook is not None:
+            self._hook.remove()
+            self._hook = None
+        # Steps after the last logging step are recorded too.
+        self.on_log(args, state, control)
+        self._train_seconds = time.perf_counter() - self._train_start
+
+    def summary(self) -> Dict[Text, float]:
+        seconds = self._train_seconds
+        if not seconds:
+            return {}
+        summary = {
+            "train_tokens_per_second": self._total_real_tokens / seconds,
+            "train_padded_tokens_per_second": self._total_tokens / seconds,
+            "train_padding_ratio": 1 - self._total_real_tokens / self._total_tokens if self._total_tokens else None,
+            "train_dataloader_stall_ratio": self._total_stall_seconds / seconds,
+            "train_peak_memory_mb": max((entry["peak_memory_mb"] for entry in self.history), default=None),
+        }
+        # A run resumed from its last checkpoint trains no step, `Trainer.log_metrics` can't format the missing values.
+        return {name: value for name, value in summary.items() if value is not None}